@@ -4,6 +4,10 @@ Centralized Distributed Learning
 """
 from . import training
 from .centralized_fl_algorithm import CentralFLAlgorithm
+from .comparison import LockstepComparison
+from .hierarchy import EdgeAggregation
+from .sampling import StratifiedSampler
+from .stopping import EarlyStopping
 from .training import AdaBest
 from .training import FedAvg
 from .training import FedDF
@@ -11,6 +15,7 @@ from .training import FedDyn
 from .training import FedNova
 from .training import FedProx
 
-__all__ = ["training", "CentralFLAlgorithm"]
+__all__ = ["training", "CentralFLAlgorithm", "LockstepComparison"]
+__all__ += ["EdgeAggregation", "EarlyStopping", "StratifiedSampler"]
 
 __all__ += ["FedAvg", "AdaBest", "FedDyn", "FedNova", "FedProx", "FedDF"]
@@ -2,29 +2,87 @@ r"""
 Centralized Federated Learnming Algorithm
 -----------------------------------------
 """
+import collections
+import contextlib
+import copy
 import inspect
+import math
+import os
 import random
+from concurrent.futures import ThreadPoolExecutor
 from functools import partial
 from typing import Any
 from typing import Callable
 from typing import Dict
 from typing import Hashable
 from typing import Iterable
+from typing import List
 from typing import Mapping
 from typing import Optional
 from typing import Union
 
 import torch
+import torch.distributed as dist
 from torch import nn
 from torch.utils.data import DataLoader
+from torch.utils.data import default_collate
 from tqdm import trange
 
 from fedsim import scores
+from fedsim.local.training import compile_module
+from fedsim.local.training import limit_steps
+from fedsim.local.training import local_precision
+from fedsim.local.training.precision import PRECISIONS
 from fedsim.utils import AppendixAggregator
+from fedsim.utils import LazyStorageDict
 from fedsim.utils import SerialAggregator
 from fedsim.utils import Storage
 from fedsim.utils import apply_on_dict
+from fedsim.utils import copy_vector_to_module
+from fedsim.utils import derive_seed
+from fedsim.utils import fork_rng
 from fedsim.utils import get_from_module
+from fedsim.utils import get_rng_state
+from fedsim.utils import set_rng_state
+
+from .execution import ProcessPoolClientExecutor
+from .execution import SerialClientExecutor
+from .execution import StackedClientExecutor
+from .execution import run_stacked
+from .execution.distributed import broadcast_tasks
+from .execution.distributed import reduce_round
+from .execution.distributed import run_tasks
+from .hierarchy import EdgeAggregation
+from .sampling import StratifiedSampler
+from .sampling import select_highest_losses
+from .simulation import message_size
+
+
+class _TaggedLogger(object):
+    # metric logger that puts a tag in front of the logged keys
+    def __init__(self, logger, tag) -> None:
+        self.logger = logger
+        self.tag = tag
+
+    def log_scalar(self, key, value, step=None):
+        return self.logger.log_scalar(f"{self.tag}.{key}", value, step=step)
+
+    def __getattr__(self, name):
+        if name.startswith("__") or name in ("logger", "tag"):
+            raise AttributeError(name)
+        return getattr(self.logger, name)
+
+
+def _get_owner(cls, name):
+    # the class in the mro of cls that defines the attribute
+    for owner in cls.__mro__:
+        if name in owner.__dict__:
+            return owner
+    return None
+
+
+def _make_compiled_model(model_def):
+    return compile_module(model_def())
 
 
 class CentralFLAlgorithm(object):
@@ -34,8 +92,10 @@ class CentralFLAlgorithm(object):
             data_manager (``distributed.data_management.DataManager``): data manager
             metric_logger (``logall.Logger``): metric logger for tracking.
             num_clients (int): number of clients
-            sample_scheme (``str``): mode of sampling clients. Options are ``'uniform'``
-                and ``'sequential'``
+            sample_scheme (``str``): mode of sampling clients. Options are
+                ``'uniform'``, ``'sequential'``, ``'stratified'`` (see
+                ``StratifiedSampler``, one stratum per sampled client) and
+                ``'power_of_choice'`` (see ``num_candidates``)
             sample_rate (``float``): rate of sampling clients
             model_def (``torch.Module``): definition of for constructing the model
             epochs (``int``): number of local epochs
@@ -52,6 +112,97 @@ class CentralFLAlgorithm(object):
             batch_size (int): batch size of the local trianing
             test_batch_size (int): inference time batch size
             device (str): cpu, cuda, or gpu number
+            workers (int): number of worker processes to run the clients on. Defaults
+                to 0 which runs the clients one after another in the main process.
+            stack_clients (bool): trains the sampled clients of each round together
+                with their parameters stacked and vectorized (see
+                ``send_to_server_stacked``). Defaults to False.
+            async_buffer_size (int): if positive, trains asynchronously. As many
+                clients as sampled in a round are kept running and the server
+                optimizes each time this many client updates are buffered. Defaults
+                to 0 which trains in synchronous rounds.
+            staleness_exponent (float): in asynchronous training, the update of a
+                client that started :math:`\tau` rounds ago is scaled by
+                :math:`(1 + \tau)^{-a}` where :math:`a` is this exponent. Defaults
+                to 0.5.
+            overlap_report (bool): evaluates the deployment points of each round in
+                a background thread while the next round trains. Scores are logged
+                under the round they belong to, however, ``at_round_end`` only sees
+                the reports finished so far. Defaults to False.
+            system_simulator (``SystemSimulator``): simulates the time the clients
+                spend on computation and communication, drops or truncates the
+                clients that miss the round deadline and logs the reports against
+                the virtual time as well (under ``vtime.`` prefix, in milliseconds).
+                Defaults to None.
+            checkpoint_dir (str): directory to save the checkpoints of the simulation
+                in. Defaults to None.
+            checkpoint_freq (int): saves a checkpoint every this many rounds and at
+                the end of the training. Defaults to 0 which does not save
+                checkpoints.
+            client_memory_budget (int): bytes of client storage tensors kept in
+                memory. Beyond it, the storages of the least recently used clients
+                are spilled to memory-mapped files. Defaults to None which keeps all
+                in memory.
+            client_spill_dir (str): directory to spill the client storages in.
+                Defaults to None which uses a temporary directory.
+            seed (int): if given, the clients are sampled and run with random
+                streams derived from the seed, the round number and the client id,
+                so the outcome does not depend on the order or the process the
+                clients are run in. Defaults to None which samples the clients
+                with the default random generators and runs them in streams derived
+                from ``torch.initial_seed()``.
+            seeds (List[int]): if given, one replica of the algorithm is made and
+                trained for each seed in lockstep in the same process, sharing the
+                data manager. The reports of each replica are prefixed by
+                ``seed_{seed}``. Only one of ``seed`` and ``seeds`` can be given.
+                Defaults to None.
+            distributed (bool): runs the simulation on the ranks of the default
+                ``torch.distributed`` process group (e.g., with the gloo backend),
+                each running the same program. Rank 0 keeps the server and the other
+                ranks run their own slices of the clients; what the clients send is
+                aggregated on their ranks and summed by all-reduce. Defaults to
+                False.
+            shared_memory (bool): with worker processes, publishes the modules sent
+                to the clients once into shared memory buffers and has the workers
+                write the tensors of the client messages into shared memory slots,
+                so only small references are pickled. Defaults to False.
+            num_edges (int): if positive, the clients are grouped under this many
+                simulated edge aggregators that aggregate the messages of their
+                clients in parallel, so the server only combines the edges (see
+                ``EdgeAggregation``). Defaults to 0 which aggregates all clients on
+                the server.
+            edge_rounds (int): number of rounds the edges run with their clients
+                in each round of the server. Defaults to 1.
+            early_stopping (``EarlyStopping``): stops the training before the given
+                number of rounds once its rules are met. The round and the reason
+                are added to the reports returned by ``train`` as ``stop.round``
+                and ``stop.reason``. Defaults to None.
+            client_scheduling (str): with worker processes, ``'fifo'`` dispatches
+                the clients of a round in the sampled order and ``'lpt'``
+                dispatches the ones with the largest predicted cost first, with work
+                stealing at the end of the round (see
+                ``ProcessPoolClientExecutor``). Defaults to ``'fifo'``.
+            client_affinity (bool): with worker processes, each worker keeps the
+                storages and the local datasets of the clients it runs and the
+                clients are sent back to the worker that ran them last when it has
+                room. The hit rate is reported as ``affinity.hit_rate``. Defaults
+                to False.
+            num_candidates (int): number of candidates the ``'power_of_choice'``
+                sample scheme draws uniformly each round, of which the ones with
+                the highest last reported train loss (the criterion in the
+                ``metrics`` of the client messages) are trained. Candidates that
+                have not reported yet are probed by a forward pass of the
+                ``cloud_params`` on one batch of each. Defaults to None which
+                draws twice as many candidates as sampled clients.
+            compile (bool): compiles the models of the server, the clients and the
+                workers by ``torch.compile`` (see ``compile_module``). Each model
+                is compiled once and reused by all the clients and rounds it
+                runs. Defaults to False.
+            precision (str): precision of the forward passes of the clients and of
+                the server evaluation, ``'fp32'`` or ``'bf16'`` which runs them
+                under ``torch.autocast`` with bfloat16 (see ``local_precision``).
+                The parameters, the ``cloud_params`` and the aggregation stay in
+                float32. Defaults to ``'fp32'``.
 
     .. note::
         definition of
@@ -62,6 +213,40 @@ class CentralFLAlgorithm(object):
         * model, could be any ``torch.Module``.
         * criterion, could be any ``fedsim.losses``.
 
+    .. note::
+        In asynchronous training, if the server storage has ``cloud_params`` and the
+        client message has ``local_params``, the difference of the local params from
+        the cloud params the client started with is scaled by the staleness weight
+        and put on top of the current cloud params before ``receive_from_client``.
+
+    .. note::
+        A checkpoint (see ``save_checkpoint``) holds the entries of the server
+        storage written after construction (e.g., by ``init``) together with the
+        round number, the client sampling state, the storages of the clients and
+        the state of the random generators, so a run resumed by ``load_checkpoint``
+        continues exactly as the uninterrupted run would.
+
+    .. note::
+        With ``seeds``, each replica keeps its own server and client storages and its
+        own state of the random generators, so it follows the run that would be made
+        with ``seed`` set to its seed. The replicas go through the rounds together;
+        with ``stack_clients`` the clients of all replicas are trained in one stack.
+        ``train`` returns the reports of all replicas and the scores hooked to the
+        algorithm are hooked to all replicas.
+
+    .. note::
+        In distributed training, ``receive_from_client`` runs on the rank of the
+        client against the copy of the server storage of that rank, so it should
+        only depend on what is written by ``init``. Serial aggregators in the server
+        storage that it updates are summed into the ones of rank 0 every round.
+        ``train`` returns None on the ranks other than 0.
+
+    .. note::
+        With ``num_edges``, ``receive_from_client`` runs on the edge of the client
+        against a copy of the server storage in which the serial aggregators are
+        made per edge and summed into the ones of the server at the end of the
+        round.
+
     Architecture:
 
         .. image:: ../_static/arch.svg
@@ -85,9 +270,37 @@ class CentralFLAlgorithm(object):
         batch_size=32,
         test_batch_size=64,
         device="cpu",
+        workers=0,
+        stack_clients=False,
+        async_buffer_size=0,
+        staleness_exponent=0.5,
+        overlap_report=False,
+        system_simulator=None,
+        checkpoint_dir=None,
+        checkpoint_freq=0,
+        client_memory_budget=None,
+        client_spill_dir=None,
+        seed=None,
+        seeds=None,
+        distributed=False,
+        shared_memory=False,
+        num_edges=0,
+        edge_rounds=1,
+        early_stopping=None,
+        client_scheduling="fifo",
+        client_affinity=False,
+        num_candidates=None,
+        compile=False,
+        precision="fp32",
         *args,
         **kwargs,
     ):
+        # constructor arguments, to make the seed replicas
+        replica_args = {
+            name: value
+            for name, value in locals().items()
+            if name not in ("self", "args", "kwargs", "__class__")
+        }
         sample_count = int(sample_rate * num_clients)
         if not 1 <= sample_count <= num_clients:
             raise Exception(
@@ -113,6 +326,94 @@ class CentralFLAlgorithm(object):
         else:
             criterion_def = criterion_def
 
+        if workers < 0:
+            raise Exception(f"invalid number of workers ({workers})")
+
+        if async_buffer_size < 0:
+            raise Exception(f"invalid async buffer size ({async_buffer_size})")
+
+        if system_simulator is not None:
+            if async_buffer_size > 0:
+                raise Exception("system simulation needs synchronous rounds")
+            if stack_clients and system_simulator.policy == "truncate":
+                raise Exception("stacked clients can not be truncated at deadline")
+
+        if seeds is not None:
+            seeds = list(seeds)
+            if len(seeds) == 0 or len(set(seeds)) != len(seeds):
+                raise Exception(f"invalid seeds ({seeds})")
+            if seed is not None:
+                raise Exception("only one of seed and seeds can be given")
+            if async_buffer_size > 0:
+                raise Exception("seed replicas need synchronous rounds")
+            seed = seeds[0]
+            replica_tag = f"seed_{seed}"
+            if metric_logger is not None:
+                metric_logger = _TaggedLogger(metric_logger, replica_tag)
+            if checkpoint_dir is not None:
+                checkpoint_dir = os.path.join(checkpoint_dir, replica_tag)
+        else:
+            replica_tag = None
+
+        if distributed:
+            if not dist.is_initialized():
+                raise Exception("torch.distributed process group is not initialized")
+            if workers > 0 or async_buffer_size > 0 or seeds is not None:
+                raise Exception(
+                    "distributed training needs synchronous rounds in one process "
+                    "per rank"
+                )
+            if system_simulator is not None:
+                raise Exception("system simulation is not supported in distributed")
+            if checkpoint_freq > 0:
+                # the client storages are spread over the ranks
+                raise Exception("checkpoints are not supported in distributed")
+
+        if num_edges < 0:
+            raise Exception(f"invalid number of edges ({num_edges})")
+        if num_edges > 0:
+            if async_buffer_size > 0 or distributed:
+                raise Exception("edge aggregation needs synchronous rounds in one rank")
+        if edge_rounds != 1:
+            if num_edges == 0:
+                raise Exception("edge rounds need edges to run on")
+            if system_simulator is not None:
+                raise Exception("system simulation does not support edge rounds")
+            # raises for invalid numbers of rounds
+            EdgeAggregation(num_edges, edge_rounds)
+        if client_scheduling not in ("fifo", "lpt"):
+            raise Exception(f"invalid client scheduling ({client_scheduling})")
+        if precision not in PRECISIONS:
+            raise Exception(f"invalid precision ({precision})")
+        if num_candidates is None:
+            num_candidates = min(2 * sample_count, num_clients)
+        if not sample_count <= num_candidates <= num_clients:
+            raise Exception(f"invalid number of candidates ({num_candidates})")
+
+        if checkpoint_freq < 0:
+            raise Exception(f"invalid checkpoint frequency ({checkpoint_freq})")
+        if checkpoint_freq > 0:
+            if checkpoint_dir is None:
+                raise Exception("checkpoint_dir is needed to save checkpoints")
+            if async_buffer_size > 0:
+                # clients running across rounds can not be saved
+                raise Exception("checkpoints need synchronous rounds")
+
+        if compile:
+            model_def = partial(_make_compiled_model, model_def)
+
+        if stack_clients:
+            if workers > 0:
+                raise Exception("stacked clients can not be run on worker processes")
+            # the stacked client method of a parent does not know about the client
+            # side changes made by a child class
+            if _get_owner(self.__class__, "send_to_server_stacked") is not _get_owner(
+                self.__class__, "send_to_server"
+            ):
+                raise Exception(
+                    f"{self.__class__.__name__} does not support stacked clients"
+                )
+
         if r2r_local_lr_scheduler_def is not None:
             # get local lr to build r2r scheduler
 
@@ -246,9 +547,156 @@ class CentralFLAlgorithm(object):
             0,
             write_protected=True,
         )
+        self._server_memory.write(
+            "workers",
+            workers,
+            read_protected=True,
+            write_protected=True,
+        )
+        self._server_memory.write(
+            "stack_clients",
+            stack_clients,
+            read_protected=True,
+            write_protected=True,
+        )
+        self._server_memory.write(
+            "async_buffer_size",
+            async_buffer_size,
+            read_protected=True,
+            write_protected=True,
+        )
+        self._server_memory.write(
+            "staleness_exponent",
+            staleness_exponent,
+            read_protected=True,
+            write_protected=True,
+        )
+        self._server_memory.write(
+            "overlap_report",
+            overlap_report,
+            read_protected=True,
+            write_protected=True,
+        )
+        self._server_memory.write(
+            "system_simulator",
+            system_simulator,
+            read_protected=True,
+            write_protected=True,
+        )
+        self._server_memory.write(
+            "checkpoint_dir",
+            checkpoint_dir,
+            read_protected=True,
+            write_protected=True,
+        )
+        self._server_memory.write(
+            "checkpoint_freq",
+            checkpoint_freq,
+            read_protected=True,
+            write_protected=True,
+        )
+        self._server_memory.write(
+            "client_memory_budget",
+            client_memory_budget,
+            read_protected=True,
+            write_protected=True,
+        )
+        self._server_memory.write(
+            "client_spill_dir",
+            client_spill_dir,
+            read_protected=True,
+            write_protected=True,
+        )
+        self._server_memory.write(
+            "seed",
+            seed,
+            read_protected=True,
+            write_protected=True,
+        )
+        # the clients run in streams of their own even without a seed, derived from
+        # the seed torch was last seeded with, so every executor trains them alike
+        # without drawing from the default generators
+        self._server_memory.write(
+            "client_seed",
+            torch.initial_seed() if seed is None else seed,
+            read_protected=True,
+            write_protected=True,
+        )
+        self._server_memory.write(
+            "distributed",
+            distributed,
+            read_protected=True,
+            write_protected=True,
+        )
+        self._server_memory.write(
+            "shared_memory",
+            shared_memory,
+            read_protected=True,
+            write_protected=True,
+        )
+        self._server_memory.write(
+            "num_edges",
+            num_edges,
+            read_protected=True,
+            write_protected=True,
+        )
+        self._server_memory.write(
+            "early_stopping",
+            early_stopping,
+            read_protected=True,
+            write_protected=True,
+        )
+        self._server_memory.write(
+            "client_scheduling",
+            client_scheduling,
+            read_protected=True,
+            write_protected=True,
+        )
+        self._server_memory.write(
+            "client_affinity",
+            client_affinity,
+            read_protected=True,
+            write_protected=True,
+        )
+        self._server_memory.write(
+            "num_candidates",
+            num_candidates,
+            read_protected=True,
+            write_protected=True,
+        )
+        self._server_memory.write(
+            "compile",
+            compile,
+            read_protected=True,
+            write_protected=True,
+        )
+        if sample_scheme == "power_of_choice":
+            # last reported train loss of each client, nan if none
+            self._server_memory.write(
+                "client_losses",
+                torch.full((num_clients,), math.nan),
+                read_protected=True,
+                write_protected=True,
+            )
+        # number of times clients are sampled so far
+        self._server_memory.write(
+            "sampling_step",
+            0,
+            read_protected=True,
+            write_protected=True,
+        )
+        if system_simulator is not None:
+            self._server_memory.write(
+                "virtual_time",
+                system_simulator.virtual_time,
+                write_protected=True,
+            )
+            # size of the model, without drawing from the random generators
+            with torch.device("meta"):
+                self._model_bytes = message_size(model_def())
 
-        # client storage
-        self._client_memory = {k: Storage() for k in range(num_clients)}
+        # client storage, made on the first access of each client
+        self._client_memory = LazyStorageDict(client_memory_budget, client_spill_dir)
 
         self._local_cfg = Storage()  # private client memory
         self._local_cfg.write("epochs", epochs, write_protected=True)
@@ -266,14 +714,57 @@ class CentralFLAlgorithm(object):
             write_protected=True,
         )
         self._local_cfg.write("device", device)
+        self._local_cfg.write("precision", precision, write_protected=True)
 
         # this is over written in train method
         self._train_split_name = "train"
+        # steps each client is scheduled to take in the current round
+        self._scheduled_steps = dict()
+        # stats of the dispatch of the clients of the last round to the workers
+        self._schedule_stats = None
+        # strata of the clients for the stratified sample scheme
+        self._stratified_sampler = None
+        # name of the reported train loss and the model to probe the losses with
+        # for the power of choice sample scheme
+        self._criterion_name = None
+        self._probe_model = None
+        # step of the last report logged against the virtual time
+        self._last_vtime_step = -1
+
+        # entries of the server storage that are not saved in checkpoints
+        self._config_keys = set(self._server_memory.get_all_keys()) - {
+            "rounds",
+            "last_client_sampled",
+            "sampling_step",
+            "r2r_local_lr_scheduler",
+            "system_simulator",
+            "virtual_time",
+            "early_stopping",
+            "client_losses",
+            "client_seed",
+        }
+        # clients run since the last checkpoint and files of the saved clients
+        self._dirty_clients = set()
+        self._client_files = dict()
+        self._checkpoint_path = None
+        # reports of the ongoing training and the ones loaded from a checkpoint
+        self._score_aggregator = None
+        self._resumed_scores = None
 
         self._server_scores = {key: dict() for key in global_dataloaders}
         self._client_scores = {
             key: dict() for key in data_manager.get_local_splits_names()
         }
+        # gives the local datasets of the clients instead of the data manager if set
+        self._dataset_provider = None
+        # algorithms trained in lockstep, one per seed (see seeds)
+        self._replicas = None
+        self._replica_tag = replica_tag
+        self._rng_state = None
+        # edge aggregators the clients are grouped under (see num_edges)
+        self._edges = None
+        if num_edges > 0:
+            self._edges = EdgeAggregation(num_edges, edge_rounds)
 
         self.user_methods = dict(
             init=self.__class__.init,
@@ -285,6 +776,7 @@ class CentralFLAlgorithm(object):
             receive_from_client=self.__class__.receive_from_client,
             send_to_client=self.__class__.send_to_client,
             send_to_server=self.__class__.send_to_server,
+            send_to_server_stacked=self.__class__.send_to_server_stacked,
         )
         for key, value in self.user_methods.items():
             sig = inspect.signature(value)
@@ -294,7 +786,41 @@ class CentralFLAlgorithm(object):
                     "All user methods should be static!"
                 )
 
-        self.user_methods["init"](self._server_memory, *args, **kwargs)
+        if seeds is None:
+            self.user_methods["init"](self._server_memory, *args, **kwargs)
+            return
+
+        with fork_rng(seed):
+            self.user_methods["init"](self._server_memory, *args, **kwargs)
+            self._rng_state = get_rng_state()
+        self._replicas = [self]
+        arg_names = list(inspect.signature(CentralFLAlgorithm.__init__).parameters)
+        for replica_seed in seeds[1:]:
+            tag = f"seed_{replica_seed}"
+            replica_args.update(
+                seed=replica_seed,
+                seeds=None,
+                metric_logger=None
+                if replica_args["metric_logger"] is None
+                else _TaggedLogger(replica_args["metric_logger"], tag),
+                system_simulator=copy.deepcopy(system_simulator),
+                early_stopping=copy.deepcopy(early_stopping),
+                checkpoint_dir=None
+                if replica_args["checkpoint_dir"] is None
+                else os.path.join(replica_args["checkpoint_dir"], tag),
+            )
+            with fork_rng(replica_seed):
+                replica = self.__class__(
+                    *[replica_args[name] for name in arg_names[1:-2]],
+                    *args,
+                    **kwargs,
+                )
+                replica._rng_state = get_rng_state()
+            replica._replica_tag = tag
+            # the scores hooked to the first replica are hooked to all
+            replica._server_scores = self._server_scores
+            replica._client_scores = self._client_scores
+            self._replicas.append(replica)
 
     def _sample_clients(self):
         sample_scheme = self._server_memory.read("sample_scheme", silent=True)
@@ -304,7 +830,22 @@ class CentralFLAlgorithm(object):
             "last_client_sampled", silent=True
         )
         if sample_scheme == "uniform":
-            clients = random.sample(range(num_clients), sample_count)
+            rng = self._get_sampling_rng()
+            clients = rng.sample(range(num_clients), sample_count)
+        elif sample_scheme == "stratified":
+            rng = self._get_sampling_rng()
+            clients = self._get_stratified_sampler().sample(sample_count, rng)
+        elif sample_scheme == "power_of_choice":
+            num_candidates = self._server_memory.read("num_candidates", silent=True)
+            rng = self._get_sampling_rng()
+            candidates = rng.sample(range(num_clients), num_candidates)
+            losses = self._server_memory.read("client_losses", silent=True)
+            self._probe_losses(
+                [client_id for client_id in candidates if losses[client_id].isnan()]
+            )
+            clients = select_highest_losses(
+                candidates, losses[candidates].tolist(), sample_count
+            )
         elif sample_scheme == "sequential":
             last_sampled = -1 if last_client_sampled is None else last_client_sampled
             clients = [
@@ -316,62 +857,279 @@ class CentralFLAlgorithm(object):
             raise NotImplementedError
         return clients
 
-    def _send_to_client(self, client_id):
-        return self.user_methods["send_to_client"](
-            self._server_memory, client_id=client_id
+    def _get_sampling_rng(self):
+        # given the seed, each sampling step draws from a generator of its own
+        seed = self._server_memory.read("seed", silent=True)
+        if seed is None:
+            return random
+        sampling_step = self._server_memory.read("sampling_step", silent=True)
+        self._server_memory.write("sampling_step", sampling_step + 1, silent=True)
+        return random.Random(derive_seed(seed, sampling_step))
+
+    def _get_stratified_sampler(self):
+        # the strata are found once, from the partitions of the data manager
+        if self._stratified_sampler is None:
+            data_manager = self._server_memory.read("data_manager", silent=True)
+            num_clients = self._server_memory.read("num_clients", silent=True)
+            sample_count = self._server_memory.read("sample_count", silent=True)
+            seed = self._server_memory.read("seed", silent=True)
+            histograms = data_manager.get_label_histograms(self.get_train_split_name())
+            self._stratified_sampler = StratifiedSampler(
+                histograms[:num_clients], sample_count, seed=0 if seed is None else seed
+            )
+        return self._stratified_sampler
+
+    def _probe_losses(self, client_ids):
+        # loss of the cloud model on the first batch of each client, by one forward
+        # pass over the batches of all clients
+        cloud_params = self._server_memory.read("cloud_params", silent=True)
+        if len(client_ids) == 0 or cloud_params is None:
+            return
+        device = self._server_memory.read("device", silent=True)
+        batch_size = self._local_cfg.read("batch_size")
+        criterion_def = self._local_cfg.read("criterion_def")
+        train_split_name = self.get_train_split_name()
+        # the probe leaves the random generators of the training untouched
+        with fork_rng():
+            batches = []
+            for client_id in client_ids:
+                dataset = self._get_local_dataset(client_id)[train_split_name]
+                batches.append(
+                    default_collate(
+                        [dataset[i] for i in range(min(batch_size, len(dataset)))]
+                    )
+                )
+            if self._probe_model is None:
+                self._probe_model = self.get_model_def()().to(device)
+            model = self._probe_model
+            copy_vector_to_module(model, cloud_params.to(device))
+            model.eval()
+            with torch.no_grad():
+                outputs = model(torch.cat([inputs for inputs, _ in batches]).to(device))
+        losses = self._server_memory.read("client_losses", silent=True)
+        offset = 0
+        for client_id, (_, targets) in zip(client_ids, batches):
+            targets = targets.reshape(-1).long().to(device)
+            client_outputs = outputs[offset : offset + len(targets)]
+            offset += len(targets)
+            losses[client_id] = float(criterion_def()(client_outputs, targets))
+
+    def _record_loss(self, client_msg):
+        # keeps the train loss a client reports for the power of choice sampling
+        losses = self._server_memory.read("client_losses", silent=True)
+        if losses is None:
+            return
+        if self._criterion_name is None:
+            self._criterion_name = self._local_cfg.read("criterion_def")().get_name()
+        metrics = client_msg.get("metrics", dict()).get(self.get_train_split_name())
+        if metrics is not None and self._criterion_name in metrics:
+            losses[client_msg["client_id"]] = float(metrics[self._criterion_name])
+
+    def _schedule_clients(self, client_ids):
+        simulator = self._server_memory.read("system_simulator", silent=True)
+        if simulator is None:
+            self._scheduled_steps = dict()
+            return client_ids
+        epochs = self._local_cfg.read("epochs")
+        batch_size = self._local_cfg.read("batch_size")
+        train_split_name = self.get_train_split_name()
+        num_steps = [
+            epochs
+            * math.ceil(
+                len(self._get_local_dataset(client_id)[train_split_name]) / batch_size
+            )
+            for client_id in client_ids
+        ]
+        client_ids, max_steps = simulator.schedule(
+            client_ids, num_steps, self._model_bytes
         )
+        client_ids = client_ids.tolist()
+        self._scheduled_steps = dict(zip(client_ids, max_steps.tolist()))
+        return client_ids
+
+    def _simulation_record(self, client_msg):
+        # what the simulator needs to know about a client that took part in a round
+        client_id = client_msg["client_id"]
+        num_steps = client_msg.get("num_steps", self._scheduled_steps[client_id])
+        return client_id, num_steps, message_size(client_msg)
+
+    def _recorded(self, client_msgs, records):
+        # passes the messages on while keeping their simulation records
+        for client_msg in client_msgs:
+            records.append(self._simulation_record(client_msg))
+            yield client_msg
+
+    def _end_simulated_round(self, records):
+        simulator = self._server_memory.read("system_simulator", silent=True)
+        stats = simulator.end_round(
+            [client_id for client_id, _, _ in records],
+            [num_steps for _, num_steps, _ in records],
+            [up_bytes for _, _, up_bytes in records],
+        )
+        self._server_memory.write("virtual_time", simulator.virtual_time, silent=True)
+        return stats
 
-    def _send_to_server(self, client_id):
-        r2r_local_lr_scheduler = self._server_memory.read("r2r_local_lr_scheduler")
+    def _send_to_client(self, client_id):
+        server_storage = self._server_memory
+        if self._edges is not None:
+            num_clients = server_storage.read("num_clients", silent=True)
+            server_storage = self._edges.get_storage(
+                server_storage, client_id, num_clients
+            )
+        return self.user_methods["send_to_client"](server_storage, client_id=client_id)
+
+    def _get_local_dataset(self, client_id):
+        if self._dataset_provider is not None:
+            return self._dataset_provider(client_id)
         data_manager = self._server_memory.read("data_manager", silent=True)
-        rounds = self._server_memory.read("rounds")
+        return data_manager.get_local_dataset(client_id)
 
+    def _get_client_work(self, client_id):
+        # number of samples the client trains on in a round
         epochs = self._local_cfg.read("epochs")
-        batch_size = self._local_cfg.read("batch_size")
-        test_batch_size = self._local_cfg.read("test_batch_size")
+        datasets = self._get_local_dataset(client_id)
+        return epochs * len(datasets[self.get_train_split_name()])
+
+    def _make_client_task(self, client_id):
+        # everything the client side needs from the server at the current round
+        r2r_local_lr_scheduler = self._server_memory.read("r2r_local_lr_scheduler")
+        rounds = self._server_memory.read("rounds")
         local_optimizer_def = self._local_cfg.read("local_optimizer_def")
-        criterion_def = self._local_cfg.read("criterion_def")
-        local_lr_scheduler_def = self._local_cfg.read("local_lr_scheduler_def")
-        device = self._local_cfg.read("device")
 
-        if r2r_local_lr_scheduler is None:
-            local_optimizer_def = local_optimizer_def
-        else:
+        if r2r_local_lr_scheduler is not None:
             local_optimizer_def = partial(
                 local_optimizer_def,
                 lr=r2r_local_lr_scheduler.get_last_lr()[0],
             )
-
-        datasets = data_manager.get_local_dataset(client_id)
-        round_scores = self.get_local_scores()
-        storage = self._client_memory[client_id]
-        train_split_name = self.get_train_split_name()
-
-        client_ctx = self.user_methods["send_to_server"](
-            client_id,
-            rounds,
-            storage,
-            datasets,
-            train_split_name,
-            round_scores,
-            epochs,
-            criterion_def(),
-            batch_size,
-            test_batch_size,
-            local_optimizer_def,
-            local_lr_scheduler_def,
-            device,
+        simulator = self._server_memory.read("system_simulator", silent=True)
+        max_steps = None
+        if simulator is not None and simulator.policy == "truncate":
+            max_steps = self._scheduled_steps[client_id]
+        # the storage of the client is to be saved in the next checkpoint
+        self._dirty_clients.add(client_id)
+        seed = derive_seed(
+            self._server_memory.read("client_seed", silent=True), rounds, client_id
+        )
+        if self._edges is not None and self._edges.edge_round > 0:
+            seed = derive_seed(seed, self._edges.edge_round)
+        return dict(
+            client_id=client_id,
+            rounds=rounds,
+            seed=seed,
+            max_steps=max_steps,
+            train_split_name=self.get_train_split_name(),
+            scores=self.get_local_scores(),
+            optimizer_def=local_optimizer_def,
             ctx=self._send_to_client(client_id),
         )
+
+    def _run_client_task(self, task, storage):
+        # this is the client side of _send_to_server. It only touches the data
+        # manager and the private client configs so it could as well run on a copy
+        # of the algorithm living in a worker process.
+        epochs = self._local_cfg.read("epochs")
+        batch_size = self._local_cfg.read("batch_size")
+        test_batch_size = self._local_cfg.read("test_batch_size")
+        criterion_def = self._local_cfg.read("criterion_def")
+        local_lr_scheduler_def = self._local_cfg.read("local_lr_scheduler_def")
+        device = self._local_cfg.read("device")
+
+        client_id = task["client_id"]
+        datasets = self._get_local_dataset(client_id)
+
+        # the client draws from its own stream and leaves the others untouched
+        rng_ctx = fork_rng(task["seed"])
+        precision = local_precision(self._local_cfg.read("precision"))
+        with rng_ctx, limit_steps(task["max_steps"]), precision:
+            client_ctx = self.user_methods["send_to_server"](
+                client_id,
+                task["rounds"],
+                storage,
+                datasets,
+                task["train_split_name"],
+                task["scores"],
+                epochs,
+                criterion_def(),
+                batch_size,
+                test_batch_size,
+                task["optimizer_def"],
+                local_lr_scheduler_def,
+                device,
+                ctx=task["ctx"],
+            )
         if not isinstance(client_ctx, dict):
             raise Exception("client should only return a dict!")
         return {**client_ctx, "client_id": client_id}
 
-    def _receive_from_client(self, client_msg, serial_aggregator, appendix_aggregator):
+    def _send_to_server(self, client_id):
+        task = self._make_client_task(client_id)
+        return self._run_client_task(task, self._client_memory[client_id])
+
+    def _run_client_tasks_stacked(self, tasks, storages):
+        # stacked counterpart of _run_client_task, the tasks belong to the same round
+        epochs = self._local_cfg.read("epochs")
+        batch_size = self._local_cfg.read("batch_size")
+        test_batch_size = self._local_cfg.read("test_batch_size")
+        criterion_def = self._local_cfg.read("criterion_def")
+        local_lr_scheduler_def = self._local_cfg.read("local_lr_scheduler_def")
+        device = self._local_cfg.read("device")
+
+        client_ids = [task["client_id"] for task in tasks]
+        datasets = [self._get_local_dataset(client_id) for client_id in client_ids]
+        # the clients draw from their own streams, as they do when run alone
+        seeds = [task["seed"] for task in tasks]
+        with fork_rng(), local_precision(self._local_cfg.read("precision")):
+            client_ctxs = self.user_methods["send_to_server_stacked"](
+                client_ids,
+                tasks[0]["rounds"],
+                storages,
+                datasets,
+                tasks[0]["train_split_name"],
+                [task["scores"] for task in tasks],
+                epochs,
+                [criterion_def() for _ in tasks],
+                batch_size,
+                test_batch_size,
+                tasks[0]["optimizer_def"],
+                local_lr_scheduler_def,
+                device,
+                ctxs=[task["ctx"] for task in tasks],
+                seeds=seeds,
+            )
+        if not all(isinstance(client_ctx, dict) for client_ctx in client_ctxs):
+            raise Exception("client should only return a dict!")
+        return [
+            {**client_ctx, "client_id": client_id}
+            for client_id, client_ctx in zip(client_ids, client_ctxs)
+        ]
+
+    def _make_executor(self):
+        workers = self._server_memory.read("workers", silent=True)
+        if self._server_memory.read("stack_clients", silent=True):
+            return StackedClientExecutor(self)
+        if workers > 0:
+            shared_memory = self._server_memory.read("shared_memory", silent=True)
+            scheduling = self._server_memory.read("client_scheduling", silent=True)
+            affinity = self._server_memory.read("client_affinity", silent=True)
+            return ProcessPoolClientExecutor(
+                self,
+                workers,
+                shared_memory=shared_memory,
+                scheduling=scheduling,
+                affinity=affinity,
+            )
+        return SerialClientExecutor(self)
+
+    def _receive_from_client(
+        self, client_msg, serial_aggregator, appendix_aggregator, server_storage=None
+    ):
+        if server_storage is None:
+            server_storage = self._server_memory
+        self._record_loss(client_msg)
         client_id = client_msg.pop("client_id")
         train_split_name = self.get_train_split_name()
         return self.user_methods["receive_from_client"](
-            self._server_memory,
+            server_storage,
             client_id,
             client_msg,
             train_split_name,
@@ -387,69 +1145,471 @@ class CentralFLAlgorithm(object):
         del serial_aggregator
         return reports
 
-    def _report(self, round_scores, optimize_reports=None, deployment_points=None):
-        global_dataloaders = self._server_memory.read("global_dataloaders", silent=True)
-        metric_logger = self._server_memory.read("metric_logger")
-        rounds = self._server_memory.read("rounds")
-        device = self._server_memory.read("device")
-
-        report_metrics = self.user_methods["report"](
-            self._server_memory,
-            global_dataloaders,
-            rounds,
-            round_scores,
-            metric_logger,
-            device,
-            optimize_reports,
-            deployment_points,
-        )
+    def _report(
+        self,
+        round_scores,
+        optimize_reports=None,
+        deployment_points=None,
+        server_storage=None,
+    ):
+        if server_storage is None:
+            server_storage = self._server_memory
+        global_dataloaders = server_storage.read("global_dataloaders", silent=True)
+        metric_logger = server_storage.read("metric_logger")
+        rounds = server_storage.read("rounds")
+        device = server_storage.read("device")
+
+        with local_precision(self._local_cfg.read("precision")):
+            report_metrics = self.user_methods["report"](
+                server_storage,
+                global_dataloaders,
+                rounds,
+                round_scores,
+                metric_logger,
+                device,
+                optimize_reports,
+                deployment_points,
+            )
         if metric_logger is not None:
             log_fn = metric_logger.log_scalar
             apply_on_dict(report_metrics, log_fn, step=rounds)
+            virtual_time = server_storage.read("virtual_time")
+            if virtual_time is not None:
+                # the same reports against the simulated time in milliseconds. The
+                # step is kept increasing so that rounds ending within the same
+                # millisecond do not overwrite each other.
+                vtime_step = max(int(virtual_time * 1000), self._last_vtime_step + 1)
+                self._last_vtime_step = vtime_step
+                vtime_metrics = {
+                    f"vtime.{key}": value for key, value in report_metrics.items()
+                }
+                apply_on_dict(vtime_metrics, log_fn, step=vtime_step)
         return report_metrics
 
+    def _make_report_pool(self):
+        if self._server_memory.read("overlap_report", silent=True):
+            return ThreadPoolExecutor(max_workers=1)
+        return None
+
+    def _snapshot_server_storage(self):
+        # the report of a round runs next to the following round, so it gets a
+        # storage of its own with private copies of the modules
+        snapshot = Storage()
+        for key in self._server_memory.get_all_keys():
+            obj = self._server_memory.read(key, silent=True)
+            if isinstance(obj, nn.Module):
+                obj = copy.deepcopy(obj)
+            elif key == "global_dataloaders":
+                # data loaders draw from the global generator each time they are
+                # iterated, which would race with the training in the main thread
+                obj = {
+                    split_name: DataLoader(
+                        loader.dataset,
+                        batch_size=loader.batch_size,
+                        pin_memory=loader.pin_memory,
+                        generator=torch.Generator(),
+                    )
+                    for split_name, loader in obj.items()
+                }
+            read_p, write_p = self._server_memory.get_protection_status(key)
+            snapshot.write(key, obj, read_p, write_p, silent=True)
+        return snapshot
+
+    def _deploy_and_report(
+        self, opt_reports, score_aggregator, step, report_pool, pending_reports
+    ):
+        deploy_poiont = self.user_methods["deploy"](self._server_memory)
+        round_scores = self.get_global_scores()
+        if report_pool is None:
+            score_dict = self._report(round_scores, opt_reports, deploy_poiont)
+            self._append_report(score_aggregator, score_dict, step)
+            return
+        if deploy_poiont is not None:
+            deploy_poiont = {
+                name: point.detach().clone() if torch.is_tensor(point) else point
+                for name, point in deploy_poiont.items()
+            }
+        pending_reports.append(
+            report_pool.submit(
+                self._report,
+                round_scores,
+                opt_reports,
+                deploy_poiont,
+                self._snapshot_server_storage(),
+            )
+        )
+        self._collect_reports(score_aggregator, step, pending_reports)
+
+    def _collect_reports(self, score_aggregator, step, pending_reports, wait=False):
+        # reports finish in the same order they are submitted
+        while len(pending_reports) > 0 and (wait or pending_reports[0].done()):
+            self._append_report(
+                score_aggregator, pending_reports.popleft().result(), step
+            )
+
+    def _append_report(self, score_aggregator, score_dict, step):
+        score_aggregator.append_all(score_dict, step=step)
+        early_stopping = self._server_memory.read("early_stopping", silent=True)
+        if early_stopping is not None:
+            early_stopping.update(score_dict)
+
+    def _start_early_stopping(self):
+        early_stopping = self._server_memory.read("early_stopping", silent=True)
+        if early_stopping is not None:
+            early_stopping.start()
+
+    def _summarize(self, score_aggregator):
+        # the collected reports, and where and why the training stopped early
+        summary = score_aggregator.pop_all()
+        early_stopping = self._server_memory.read("early_stopping", silent=True)
+        if early_stopping is not None and early_stopping.reason is not None:
+            summary["stop.round"] = early_stopping.stop_round
+            summary["stop.reason"] = early_stopping.reason
+        return summary
+
+    def _make_score_aggregator(self, num_score_report_point):
+        if self._resumed_scores is not None:
+            # continue the reports of the run the checkpoint was saved from
+            score_aggregator = self._resumed_scores
+            self._resumed_scores = None
+        else:
+            score_aggregator = AppendixAggregator(
+                max_deque_lenght=num_score_report_point
+            )
+        self._score_aggregator = score_aggregator
+        return score_aggregator
+
     def _train(self, rounds, num_score_report_point=None):
-        diverged = False
+        if self._server_memory.read("async_buffer_size", silent=True) > 0:
+            return self._train_async(rounds, num_score_report_point)
+        if self._replicas is not None:
+            return self._train_replicas(rounds, num_score_report_point)
+        if self._server_memory.read("distributed", silent=True):
+            return self._train_distributed(rounds, num_score_report_point)
+        executor = self._make_executor()
+        steps = self._train_steps(rounds, num_score_report_point)
+        try:
+            client_ids = next(steps)
+            while True:
+                client_ids = steps.send(executor.map(client_ids))
+        except StopIteration as stop:
+            return stop.value
+        finally:
+            executor.close()
+
+    def _round_loop(self, rounds, num_score_report_point, collect_round, progress=True):
+        # the rounds shared by all modes of training, as a generator. collect_round
+        # takes the aggregators of a round, fills them with the messages of the
+        # clients and returns whether all clients were accepted together with the
+        # reports it adds to those of optimize. It could be a generator that
+        # yields the ids of the clients to be run by the caller of the loop and
+        # takes back an iterable of their messages. Returns the collected reports.
+        checkpoint_dir = self._server_memory.read("checkpoint_dir", silent=True)
+        checkpoint_freq = self._server_memory.read("checkpoint_freq", silent=True)
         cur_round = self._server_memory.read("rounds")
-        score_aggregator = AppendixAggregator(max_deque_lenght=num_score_report_point)
-        for round_num in trange(rounds + 1):
-            self._at_round_start()
-            round_serial_aggregator = SerialAggregator()
-            round_appendix_aggregator = AppendixAggregator()
-            for client_id in self._sample_clients():
-                client_msg = self._send_to_server(client_id)
+        score_aggregator = self._make_score_aggregator(num_score_report_point)
+        self._start_early_stopping()
+        report_pool = self._make_report_pool()
+        pending_reports = collections.deque()
+        try:
+            for round_num in trange(rounds + 1, disable=not progress):
+                self._at_round_start()
+                round_serial_aggregator = SerialAggregator()
+                round_appendix_aggregator = AppendixAggregator()
+                collected = collect_round(
+                    round_serial_aggregator, round_appendix_aggregator
+                )
+                if inspect.isgenerator(collected):
+                    collected = yield from collected
+                success, round_reports = collected
+                # check for divergence, early return
+                if not success:
+                    break
+                # optimzie
+                opt_reports = self._optimize(
+                    round_serial_aggregator, round_appendix_aggregator
+                )
+                if round_reports:
+                    opt_reports = {**(opt_reports or dict()), **round_reports}
+                self._deploy_and_report(
+                    opt_reports,
+                    score_aggregator,
+                    cur_round,
+                    report_pool,
+                    pending_reports,
+                )
+                stop = self._at_round_end(score_aggregator)
+                self._server_memory.write(
+                    "rounds", cur_round + round_num + 1, silent=True
+                )
+                if checkpoint_freq > 0 and (
+                    (cur_round + round_num + 1) % checkpoint_freq == 0
+                    or round_num == rounds
+                    or stop
+                ):
+                    # the reports of the round are part of the checkpoint
+                    self._collect_reports(
+                        score_aggregator, cur_round, pending_reports, wait=True
+                    )
+                    self._save_checkpoint(checkpoint_dir)
+                if stop:
+                    break
+        finally:
+            if report_pool is not None:
+                report_pool.shutdown()
+        self._collect_reports(score_aggregator, cur_round, pending_reports, wait=True)
+        self._score_aggregator = None
+        return self._summarize(score_aggregator)
+
+    @staticmethod
+    def _run_round_loop(steps):
+        # drives a round loop that runs the clients on its own
+        try:
+            next(steps)
+        except StopIteration as stop:
+            return stop.value
+        raise Exception("the round loop has no clients runner")
+
+    def _train_steps(
+        self, rounds, num_score_report_point=None, progress=True, sample_clients=None
+    ):
+        # synchronous rounds as a generator, so that the clients could be run by the
+        # caller. Each round yields the ids of the clients to run and takes back an
+        # iterable of their messages. Returns the collected reports. sample_clients
+        # could replace the sampling of the algorithm.
+        if sample_clients is None:
+            sample_clients = self._sample_clients
+        simulator = self._server_memory.read("system_simulator", silent=True)
+
+        def collect_round(serial_aggregator, appendix_aggregator):
+            client_ids = self._schedule_clients(sample_clients())
+            records = []
+            client_msgs = yield client_ids
+            round_reports = dict()
+            if self._edges is not None:
+                self._edges.start_round()
+                # the edges average their clients before the last edge round
+                for _ in range(1, self._edges.edge_rounds):
+                    if not self._edges.step(self, client_msgs):
+                        return False, None
+                    client_msgs = yield client_ids
+            if simulator is not None:
+                client_msgs = self._recorded(client_msgs, records)
+            if self._edges is None:
+                for client_msg in client_msgs:
+                    success = self._receive_from_client(
+                        client_msg, serial_aggregator, appendix_aggregator
+                    )
+                    # signal divergence
+                    if not success:
+                        return False, None
+            else:
+                success, edge_stats = self._edges.aggregate(
+                    self, client_msgs, serial_aggregator, appendix_aggregator
+                )
+                if not success:
+                    return False, None
+                round_reports.update(edge_stats)
+            if simulator is not None:
+                round_reports.update(self._end_simulated_round(records))
+            if self._schedule_stats is not None:
+                round_reports.update(self._schedule_stats)
+                self._schedule_stats = None
+            return True, round_reports
+
+        try:
+            return (
+                yield from self._round_loop(
+                    rounds, num_score_report_point, collect_round, progress
+                )
+            )
+        finally:
+            if self._edges is not None:
+                self._edges.close()
+
+    @contextlib.contextmanager
+    def _replica_rng(self):
+        # each seed replica keeps its own state of the default random generators
+        state = get_rng_state()
+        set_rng_state(self._rng_state)
+        try:
+            yield
+        finally:
+            self._rng_state = get_rng_state()
+            set_rng_state(state)
+
+    def _train_replicas(self, rounds, num_score_report_point=None):
+        # advances the seed replicas together, round by round
+        replicas = self._replicas
+        executors = []
+        steps = []
+        for i, replica in enumerate(replicas):
+            replica._train_split_name = self._train_split_name
+            executors.append(replica._make_executor())
+            steps.append(
+                replica._train_steps(rounds, num_score_report_point, progress=i == 0)
+            )
+        stack_clients = self._server_memory.read("stack_clients", silent=True)
+        # ids of the clients to run of each replica still training
+        client_ids = dict()
+        reports = dict()
+
+        def advance(i, client_msgs):
+            with replicas[i]._replica_rng():
+                try:
+                    client_ids[i] = steps[i].send(client_msgs)
+                except StopIteration as stop:
+                    client_ids.pop(i, None)
+                    reports[i] = stop.value
+
+        try:
+            for i in range(len(replicas)):
+                advance(i, None)
+            while len(client_ids) > 0:
+                if stack_clients:
+                    # the clients of all replicas are trained in one stack
+                    tasks = dict()
+                    for i, ids in client_ids.items():
+                        with replicas[i]._replica_rng():
+                            tasks[i] = executors[i].make_tasks(ids)
+                    client_msgs = run_stacked(
+                        [executors[i] for i in tasks], list(tasks.values())
+                    )
+                    client_msgs = dict(zip(tasks, client_msgs))
+                else:
+                    client_msgs = {
+                        i: executors[i].map(ids) for i, ids in client_ids.items()
+                    }
+                for i in list(client_ids):
+                    advance(i, client_msgs[i])
+        finally:
+            for executor in executors:
+                executor.close()
+        return {
+            f"{replicas[i]._replica_tag}.{key}": value
+            for i in range(len(replicas))
+            for key, value in (reports.get(i) or dict()).items()
+        }
+
+    def _apply_staleness(self, client_msg, start_params, weight):
+        # move the scaled update of the client on top of the current cloud params,
+        # so optimize sees it as an update made against the current model
+        cloud_params = self._server_memory.read("cloud_params", silent=True)
+        if start_params is None or cloud_params is None:
+            return
+        if "local_params" in client_msg:
+            client_msg["local_params"] = cloud_params.detach() + weight * (
+                client_msg["local_params"] - start_params
+            )
+
+    def _train_async(self, rounds, num_score_report_point=None):
+        buffer_size = self._server_memory.read("async_buffer_size", silent=True)
+        exponent = self._server_memory.read("staleness_exponent", silent=True)
+        # keep as many clients running as would be sampled in a synchronous round
+        concurrency = self._server_memory.read("sample_count", silent=True)
+        executor = self._make_executor()
+        # round each running client started at, and cloud params of those rounds
+        started = dict()
+        start_params = dict()
+        candidates = []
+
+        def collect_round(serial_aggregator, appendix_aggregator):
+            staleness = []
+            while len(staleness) < buffer_size:
+                while executor.num_pending() < concurrency:
+                    if len(candidates) == 0:
+                        candidates.extend(self._sample_clients())
+                    client_id = candidates.pop(0)
+                    if client_id in started:
+                        continue
+                    start_round = self._server_memory.read("rounds")
+                    if start_round not in start_params:
+                        cloud_params = self._server_memory.read(
+                            "cloud_params", silent=True
+                        )
+                        if cloud_params is not None:
+                            cloud_params = cloud_params.detach().clone()
+                        start_params[start_round] = cloud_params
+                    started[client_id] = start_round
+                    executor.submit(client_id)
+                client_id, client_msg = executor.next_result()
+                start_round = started.pop(client_id)
+                tau = self._server_memory.read("rounds") - start_round
+                self._apply_staleness(
+                    client_msg, start_params[start_round], (1 + tau) ** -exponent
+                )
+                if start_round not in started.values():
+                    del start_params[start_round]
+                staleness.append(tau)
                 success = self._receive_from_client(
-                    client_msg,
-                    round_serial_aggregator,
-                    round_appendix_aggregator,
+                    client_msg, serial_aggregator, appendix_aggregator
                 )
                 # signal divergence
                 if not success:
-                    diverged = True
-                    break
-            # check for divergence, early return
-            if diverged:
-                return score_aggregator.pop_all()
-            # optimzie
-            opt_reports = self._optimize(
-                round_serial_aggregator, round_appendix_aggregator
+                    return False, None
+            return True, {"server.staleness": sum(staleness) / len(staleness)}
+
+        try:
+            return self._run_round_loop(
+                self._round_loop(rounds, num_score_report_point, collect_round)
             )
-            deploy_poiont = self.user_methods["deploy"](self._server_memory)
-            round_scores = self.get_global_scores()
-            score_dict = self._report(round_scores, opt_reports, deploy_poiont)
-            score_aggregator.append_all(score_dict, step=cur_round)
-            self._at_round_end(score_aggregator)
-            self._server_memory.write("rounds", cur_round + round_num + 1, silent=True)
-        return score_aggregator.pop_all()
+        finally:
+            # clients still running are discarded
+            executor.close()
+
+    def _train_distributed(self, rounds, num_score_report_point=None):
+        # model replicas of the rank to load the contexts of its clients into
+        replicas = dict()
+        if dist.get_rank() != 0:
+            # run the clients of the rank until rank 0 is done
+            while True:
+                tasks = broadcast_tasks()
+                if tasks is None:
+                    return None
+                reduce_round(
+                    self,
+                    run_tasks(self, tasks, replicas),
+                    SerialAggregator(),
+                    AppendixAggregator(),
+                )
+
+        def collect_round(serial_aggregator, appendix_aggregator):
+            tasks = broadcast_tasks(
+                [
+                    self._make_client_task(client_id)
+                    for client_id in self._sample_clients()
+                ]
+            )
+            success = reduce_round(
+                self,
+                run_tasks(self, tasks, replicas),
+                serial_aggregator,
+                appendix_aggregator,
+            )
+            return success, None
+
+        try:
+            return self._run_round_loop(
+                self._round_loop(rounds, num_score_report_point, collect_round)
+            )
+        finally:
+            # stop the other ranks
+            broadcast_tasks(None)
 
     def _at_round_start(self) -> None:
         self.user_methods["at_round_start"](self._server_memory)
 
-    def _at_round_end(self, score_aggregator) -> None:
+    def _at_round_end(self, score_aggregator) -> bool:
+        # returns True if the training should stop
         r2r_local_lr_scheduler = self._server_memory.read("r2r_local_lr_scheduler")
         if r2r_local_lr_scheduler is not None:
             r2r_local_lr_scheduler.step()
         self.user_methods["at_round_end"](self._server_memory, score_aggregator)
+        early_stopping = self._server_memory.read("early_stopping", silent=True)
+        if early_stopping is None:
+            return False
+        rounds = self._server_memory.read("rounds", silent=True)
+        return early_stopping.check(rounds) is not None
 
     def _get_round_scores(self, score_def_deck):
         # filter out the scores that should not be present in the current round
@@ -497,6 +1657,124 @@ class CentralFLAlgorithm(object):
         self._train_split_name = default_split_name
         return ans
 
+    def save_checkpoint(self, path) -> None:
+        r"""saves the state of the simulation to resume it later by
+        ``load_checkpoint``. Checkpoints are incremental, the storage of a client is
+        only written if the client is run since the last checkpoint saved to the same
+        path.
+
+        .. note::
+            The server state is written last and replaces the previous one at once,
+            so an interrupted save leaves the previous checkpoint intact.
+
+        .. note::
+            If the algorithm is made with ``seeds``, each seed replica is saved to
+            its own sub-directory named ``seed_{seed}``.
+
+        Args:
+            path (str): directory of the checkpoint.
+        """
+        if self._replicas is None:
+            return self._save_checkpoint(path)
+        for replica in self._replicas:
+            with replica._replica_rng():
+                replica._save_checkpoint(os.path.join(path, replica._replica_tag))
+
+    def _save_checkpoint(self, path) -> None:
+        os.makedirs(os.path.join(path, "clients"), exist_ok=True)
+        rounds = self._server_memory.read("rounds", silent=True)
+        if path == self._checkpoint_path:
+            client_ids = self._dirty_clients
+        else:
+            # a new location needs all the clients that have anything to save
+            self._client_files = dict()
+            client_ids = [
+                client_id
+                for client_id, storage in self._client_memory.items()
+                if len(storage.get_all_keys()) > 0
+            ]
+        replaced_files = []
+        for client_id in sorted(client_ids):
+            storage = self._client_memory[client_id]
+            if len(storage.get_all_keys()) == 0 and client_id not in self._client_files:
+                continue
+            file_name = os.path.join("clients", f"{client_id}.{rounds}.pt")
+            torch.save(storage.state_dict(), os.path.join(path, file_name))
+            old_file_name = self._client_files.get(client_id)
+            if old_file_name is not None and old_file_name != file_name:
+                replaced_files.append(old_file_name)
+            self._client_files[client_id] = file_name
+
+        r2r_local_lr_scheduler = self._server_memory.read(
+            "r2r_local_lr_scheduler", silent=True
+        )
+        server_keys = [
+            key
+            for key in self._server_memory.get_all_keys()
+            if key not in self._config_keys
+        ]
+        checkpoint = dict(
+            rounds=rounds,
+            server=self._server_memory.state_dict(server_keys),
+            # lr schedulers do not include the state of their optimizer
+            r2r_optimizer=None
+            if r2r_local_lr_scheduler is None
+            else r2r_local_lr_scheduler.optimizer.state_dict(),
+            client_files=dict(self._client_files),
+            scores=self._score_aggregator,
+            rng=get_rng_state(),
+        )
+        tmp_path = os.path.join(path, "server.pt.tmp")
+        torch.save(checkpoint, tmp_path)
+        os.replace(tmp_path, os.path.join(path, "server.pt"))
+        for file_name in replaced_files:
+            os.remove(os.path.join(path, file_name))
+        self._dirty_clients = set()
+        self._checkpoint_path = path
+
+    def load_checkpoint(self, path) -> None:
+        r"""loads a checkpoint saved by ``save_checkpoint``. The algorithm should be
+        made with the same arguments as the one the checkpoint is saved from. The
+        reports already collected are continued by the next call to ``train``.
+
+        .. note::
+            ``train`` continues from the round the checkpoint is saved at, so to
+            finish a run of ``rounds`` rounds call it with
+            ``rounds - get_round_number()``. If the algorithm is made with
+            ``seeds``, each seed replica is loaded from its own sub-directory (see
+            ``save_checkpoint``).
+
+        Args:
+            path (str): directory of the checkpoint.
+        """
+        if self._replicas is None:
+            return self._load_checkpoint(path)
+        for replica in self._replicas:
+            with replica._replica_rng():
+                replica._load_checkpoint(os.path.join(path, replica._replica_tag))
+
+    def _load_checkpoint(self, path) -> None:
+        checkpoint = torch.load(os.path.join(path, "server.pt"), weights_only=False)
+        self._server_memory.load_state_dict(checkpoint["server"])
+        if checkpoint["r2r_optimizer"] is not None:
+            r2r_local_lr_scheduler = self._server_memory.read(
+                "r2r_local_lr_scheduler", silent=True
+            )
+            r2r_local_lr_scheduler.optimizer.load_state_dict(
+                checkpoint["r2r_optimizer"]
+            )
+        for client_id, file_name in checkpoint["client_files"].items():
+            storage = Storage()
+            storage.load_state_dict(
+                torch.load(os.path.join(path, file_name), weights_only=False)
+            )
+            self._client_memory[client_id] = storage
+        self._client_files = dict(checkpoint["client_files"])
+        self._dirty_clients = set()
+        self._checkpoint_path = path
+        self._resumed_scores = checkpoint["scores"]
+        set_rng_state(checkpoint["rng"])
+
     def get_model_def(self):
         """To get the definition of the model so that one can instantiate it by
         calling.
@@ -738,6 +2016,61 @@ class CentralFLAlgorithm(object):
             "Algorithm is missing the required 'send_to_client' function"
         )
 
+    # optional methods
+    def send_to_server_stacked(
+        ids: List[int],
+        rounds: int,
+        storages: List[Dict[Hashable, Any]],
+        datasets: List[Dict[str, Iterable]],
+        train_split_name: str,
+        scores: List[Dict[str, Dict[str, Any]]],
+        epochs: int,
+        criteria: List[nn.Module],
+        train_batch_size: int,
+        inference_batch_size: int,
+        optimizer_def: Callable,
+        lr_scheduler_def: Optional[Callable] = None,
+        device: Union[int, str] = "cuda",
+        ctxs: Optional[List[Dict[Hashable, Any]]] = None,
+        seeds: Optional[List[int]] = None,
+    ) -> List[Mapping[str, Any]]:
+        """client operation of several clients of the same round at once (used when
+        the algorithm is made with ``stack_clients=True``). The outcome should match
+        calling ``send_to_server`` on each client.
+
+        Args:
+            ids (List[int]): ids of the clients
+            rounds (int): global round number
+            storages (List[Storage]): storage object of each client
+            datasets (List[Dict[str, Iterable]]): datasets of each client
+            train_split_name (str): string containing name of the training split
+            scores: List[Dict[str, Dict[str, Score]]]: scores of each client.
+            epochs (int): number of epochs to train
+            criteria (List[Score]): citerion of each client
+            train_batch_size (int): training batch_size
+            inference_batch_size (int): inference batch_size
+            optimizer_def (float): class for constructing the local optimizer
+            lr_scheduler_def (float): class for constructing the local lr scheduler
+            device (Union[int, str], optional): Defaults to 'cuda'.
+            ctxs (Optional[List[Dict[Hashable, Any]]], optional): context reveived
+                by each client.
+            seeds (Optional[List[int]], optional): seed of each client. Given when
+                the algorithm is made with a seed, in which case the randomness of
+                each client should be drawn from a stream of its own seeded by its
+                seed (e.g., by ``forked_iter``), as ``send_to_server`` does under
+                ``fork_rng(seed)``. Defaults to None.
+
+        Raises:
+            NotImplementedError: stacked clients are not supported by the algorithm
+
+        Returns:
+            List[Mapping[str, Any]]: client context of each client to be sent to the
+                server
+        """
+        raise NotImplementedError(
+            "Algorithm is missing the optional 'send_to_server_stacked' function"
+        )
+
     def receive_from_client(
         server_storage: Storage,
         client_id: int,
@@ -0,0 +1,237 @@
+r"""
+Lockstep Comparison
+-------------------
+"""
+import collections
+import contextlib
+import functools
+import time
+
+from torch.utils.data import TensorDataset
+from torch.utils.data import default_collate
+
+from fedsim.utils import apply_on_dict
+from fedsim.utils import derive_seed
+from fedsim.utils import fork_rng
+
+
+def materialize_dataset(dataset):
+    r"""decodes (and transforms) all the samples of a dataset once and keeps them
+    as tensors.
+
+    Args:
+        dataset (Dataset): a map-style dataset of (input, target) samples.
+
+    Returns:
+        TensorDataset: the materialized dataset.
+    """
+    if len(dataset) == 0:
+        return dataset
+    return TensorDataset(*default_collate([dataset[i] for i in range(len(dataset))]))
+
+
+def _timed(fn, times, name):
+    @functools.wraps(fn)
+    def timed(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            times[name] += time.perf_counter() - start
+
+    return timed
+
+
+class LockstepComparison(object):
+    r"""Trains several centralized algorithms side by side, round by round. In each
+    round all algorithms are given the same sampled clients and the local datasets of
+    those clients are materialized once (decoded and transformed) and fed to all
+    algorithms. The time each algorithm spends in each of its hooks is logged per
+    round under ``{name}.time.{hook}`` and the time spent on materializing the data
+    under ``data.time``.
+
+    .. note::
+        Give the algorithms the same ``seed`` so their clients also go through the
+        materialized samples in the same mini-batches. Random transforms of the
+        datasets are drawn once per client and round (not per epoch).
+
+    .. warning::
+        The algorithms must use the same data manager and number of clients, and run
+        in synchronous rounds in the main process (i.e., no ``workers``,
+        ``async_buffer_size`` or ``seeds``). The clients are sampled by the first
+        algorithm. The materialized datasets of the clients of a round are kept in
+        memory until all algorithms are done with the round.
+
+    Args:
+        algorithms (Dict[str, ``CentralFLAlgorithm``]): algorithms to compare by
+            their names.
+        metric_logger (``logall.Logger``, optional): logger of the hook times.
+            Defaults to None which does not log them.
+        materialize (bool, optional): whether to materialize the local datasets.
+            Defaults to True.
+    """
+
+    def __init__(self, algorithms, metric_logger=None, materialize=True) -> None:
+        if len(algorithms) == 0:
+            raise Exception("no algorithm to compare")
+        self.algorithms = dict(algorithms)
+        self.metric_logger = metric_logger
+        self.materialize = materialize
+
+        first = next(iter(self.algorithms.values()))
+        storage = first._server_memory
+        self._data_manager = storage.read("data_manager", silent=True)
+        self._seed = storage.read("seed", silent=True)
+        for name, algorithm in self.algorithms.items():
+            storage = algorithm._server_memory
+            if storage.read("data_manager", silent=True) is not self._data_manager:
+                raise Exception(f"{name} does not share the data manager")
+            if storage.read("num_clients", silent=True) != first._server_memory.read(
+                "num_clients", silent=True
+            ):
+                raise Exception(f"{name} has a different number of clients")
+            if storage.read("workers", silent=True) > 0:
+                raise Exception("compared algorithms should run in the main process")
+            if storage.read("async_buffer_size", silent=True) > 0:
+                raise Exception("compared algorithms need synchronous rounds")
+            if algorithm._replicas is not None:
+                raise Exception("seed replicas can not be compared")
+            if storage.read("seed", silent=True) != self._seed:
+                raise Exception("compared algorithms should have the same seed")
+
+        self._hook_times = {
+            name: collections.defaultdict(float) for name in self.algorithms
+        }
+        self._data_time = 0.0
+        self._rounds = 0
+        # clients sampled for each round and the datasets of the current round
+        self._samples = []
+        self._datasets = dict()
+
+    def _sample_clients(self, num_sampled):
+        # the k-th sampling of every algorithm gives the k-th sample of the first one
+        k = num_sampled[0]
+        num_sampled[0] += 1
+        if k == len(self._samples):
+            first = next(iter(self.algorithms.values()))
+            self._samples.append(list(first._sample_clients()))
+        return list(self._samples[k])
+
+    def _get_local_dataset(self, client_id):
+        datasets = self._datasets.get(client_id)
+        if datasets is None:
+            start = time.perf_counter()
+            datasets = self._data_manager.get_local_dataset(client_id)
+            if self.materialize:
+                rng_ctx = fork_rng()
+                if self._seed is not None:
+                    rng_ctx = fork_rng(derive_seed(self._seed, self._rounds, client_id))
+                with rng_ctx:
+                    datasets = {
+                        split_name: materialize_dataset(dataset)
+                        for split_name, dataset in datasets.items()
+                    }
+            self._datasets[client_id] = datasets
+            self._data_time += time.perf_counter() - start
+        return datasets
+
+    @contextlib.contextmanager
+    def _instrument(self, name, algorithm, train_split_name):
+        user_methods = algorithm.user_methods
+        default_split_name = algorithm._train_split_name
+        algorithm.user_methods = {
+            hook: _timed(fn, self._hook_times[name], hook)
+            for hook, fn in user_methods.items()
+        }
+        algorithm._dataset_provider = self._get_local_dataset
+        algorithm._train_split_name = train_split_name
+        try:
+            yield
+        finally:
+            algorithm.user_methods = user_methods
+            algorithm._dataset_provider = None
+            algorithm._train_split_name = default_split_name
+
+    def _log_times(self, last_times):
+        if self.metric_logger is None:
+            return
+        for name, times in self._hook_times.items():
+            report = {
+                f"{name}.time.{hook}": value - last_times[name].get(hook, 0.0)
+                for hook, value in times.items()
+            }
+            apply_on_dict(report, self.metric_logger.log_scalar, step=self._rounds)
+        self.metric_logger.log_scalar(
+            "data.time", self._data_time - last_times["data"], step=self._rounds
+        )
+
+    def train(self, rounds, num_score_report_point=None, train_split_name="train"):
+        r"""trains the algorithms in lockstep for the given number of rounds, see
+        ``CentralFLAlgorithm.train``.
+
+        Args:
+            rounds (int): number of rounds to train.
+            num_score_report_point (int): limits num of points to return reports.
+            train_split_name (str): local split name to perform training on. Defaults
+                to 'train'.
+
+        Returns:
+            Dict[str, Dict[str, float]]: collected score metrics of each algorithm.
+        """
+        names = list(self.algorithms)
+        executors = dict()
+        steps = dict()
+        client_ids = dict()
+        reports = dict()
+        self._samples = []
+        with contextlib.ExitStack() as stack:
+            for i, name in enumerate(names):
+                algorithm = self.algorithms[name]
+                stack.enter_context(self._instrument(name, algorithm, train_split_name))
+                executors[name] = algorithm._make_executor()
+                stack.callback(executors[name].close)
+                steps[name] = algorithm._train_steps(
+                    rounds,
+                    num_score_report_point,
+                    progress=i == 0,
+                    # each algorithm counts its own samplings
+                    sample_clients=functools.partial(self._sample_clients, [0]),
+                )
+
+            def advance(name, client_msgs):
+                try:
+                    client_ids[name] = steps[name].send(client_msgs)
+                except StopIteration as stop:
+                    client_ids.pop(name, None)
+                    reports[name] = stop.value
+
+            for name in names:
+                advance(name, None)
+            while len(client_ids) > 0:
+                last_times = {
+                    name: dict(times) for name, times in self._hook_times.items()
+                }
+                last_times["data"] = self._data_time
+                for name in list(client_ids):
+                    advance(name, executors[name].map(client_ids[name]))
+                self._datasets = dict()
+                self._log_times(last_times)
+                self._rounds += 1
+        return reports
+
+    def get_hook_times(self):
+        r"""total time each algorithm spent in each of its hooks so far.
+
+        Returns:
+            Dict[str, Dict[str, float]]: seconds spent in each hook by the name of
+                the algorithms.
+        """
+        return {name: dict(times) for name, times in self._hook_times.items()}
+
+    def get_data_time(self) -> float:
+        r"""total time spent on loading and materializing the local datasets so far.
+
+        Returns:
+            float: seconds spent on the data.
+        """
+        return self._data_time
@@ -0,0 +1,22 @@
+"""
+Client Execution
+----------------
+
+Executors that run the client side of centralized FL algorithms.
+"""
+
+from .process_pool import ProcessPoolClientExecutor
+from .scheduling import ClientCostModel
+from .scheduling import lpt_schedule
+from .serial import SerialClientExecutor
+from .stacked import StackedClientExecutor
+from .stacked import run_stacked
+
+__all__ = [
+    "SerialClientExecutor",
+    "ProcessPoolClientExecutor",
+    "StackedClientExecutor",
+    "run_stacked",
+    "ClientCostModel",
+    "lpt_schedule",
+]
@@ -0,0 +1,375 @@
+r"""
+Distributed Client Execution
+----------------------------
+
+Runs the clients of a centralized algorithm on the ranks of a ``torch.distributed``
+process group. Rank 0 keeps the server and every other rank runs its own slice of
+the clients, keeping their storages and loading only their datasets. Instead of
+sending the messages of the clients to rank 0, each rank aggregates the messages
+of its clients by ``receive_from_client`` and the weighted sums of the aggregators
+are added up across the ranks by bucketed all-reduce.
+"""
+import collections
+import os
+import socket
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+from fedsim.utils import SerialAggregator
+
+from ..hierarchy import merge_serial_aggregators
+from .process_pool import _ModuleState
+from .process_pool import pack_ctx
+from .process_pool import unpack_ctx
+
+# size of the buffers all-reduced at once
+BUCKET_BYTES = 25 * 2**20
+
+
+def client_owner(client_id, num_clients, world_size) -> int:
+    r"""rank that runs the given client. The clients are split into contiguous
+    slices, one per rank other than 0. With a single rank, rank 0 runs all clients.
+
+    Args:
+        client_id (int): id of the client.
+        num_clients (int): number of clients.
+        world_size (int): number of ranks.
+
+    Returns:
+        int: rank of the owner.
+    """
+    if world_size == 1:
+        return 0
+    return 1 + client_id * (world_size - 1) // num_clients
+
+
+def broadcast_tasks(tasks=None):
+    r"""sends the client tasks of a round from rank 0 to all ranks. Modules in the
+    contexts are packed (see ``pack_ctx``) and the ones with the same state are
+    sent once.
+
+    Args:
+        tasks (List[Dict[str, Any]], optional): tasks of the round on rank 0, or
+            None to stop the other ranks. Ignored on the other ranks.
+
+    Returns:
+        List[Dict[str, Any]]: the packed tasks on all ranks, None if stopped.
+    """
+    if dist.get_rank() == 0 and tasks is not None:
+        packed_tasks = []
+        for task in tasks:
+            previous = packed_tasks[-1]["ctx"] if len(packed_tasks) > 0 else None
+            packed_tasks.append({**task, "ctx": pack_ctx(task["ctx"], previous)})
+        tasks = packed_tasks
+    objects = [tasks]
+    dist.broadcast_object_list(objects, src=0)
+    return objects[0]
+
+
+def _unpack_shared(tasks, replicas, model_def, device):
+    # stacked clients hold their contexts together, so a replica is loaded for each
+    # distinct module state of the round and shared by the clients that have it
+    loaded = collections.defaultdict(dict)
+    for task in tasks:
+        if task["ctx"] is None:
+            continue
+        ctx = dict()
+        for key, value in task["ctx"].items():
+            if isinstance(value, _ModuleState):
+                modules = loaded[key]
+                if id(value) not in modules:
+                    replica_key = (key, len(modules))
+                    if replica_key not in replicas:
+                        replicas[replica_key] = model_def().to(device)
+                    replicas[replica_key].load_state_dict(value.state)
+                    modules[id(value)] = replicas[replica_key]
+                value = modules[id(value)]
+            ctx[key] = value
+        task["ctx"] = ctx
+
+
+def run_tasks(algorithm, tasks, replicas):
+    r"""runs the clients of the given tasks that are owned by the current rank.
+
+    Args:
+        algorithm (``CentralFLAlgorithm``): algorithm to run the clients of.
+        tasks (List[Dict[str, Any]]): packed tasks of the round, see
+            ``broadcast_tasks``.
+        replicas (Dict[Hashable, Module]): model replicas of the rank, reused from
+            round to round.
+
+    Returns:
+        List[Dict[str, Any]]: messages of the clients of the rank.
+    """
+    num_clients = algorithm._server_memory.read("num_clients", silent=True)
+    world_size = dist.get_world_size()
+    rank = dist.get_rank()
+    tasks = [
+        task
+        for task in tasks
+        if client_owner(task["client_id"], num_clients, world_size) == rank
+    ]
+    if len(tasks) == 0:
+        return []
+    model_def = algorithm.get_model_def()
+    device = algorithm._local_cfg.read("device")
+    storages = [algorithm._client_memory[task["client_id"]] for task in tasks]
+    if algorithm._server_memory.read("stack_clients", silent=True):
+        _unpack_shared(tasks, replicas, model_def, device)
+        return algorithm._run_client_tasks_stacked(tasks, storages)
+    client_msgs = []
+    for task, storage in zip(tasks, storages):
+        # the clients train the modules of their context in place
+        task["ctx"] = unpack_ctx(task["ctx"], replicas, model_def, device)
+        client_msgs.append(algorithm._run_client_task(task, storage))
+    return client_msgs
+
+
+def _entry_meta(value, weight):
+    if torch.is_tensor(value):
+        return ("tensor", tuple(value.shape), value.dtype, weight is not None)
+    return ("scalar", None, None, weight is not None)
+
+
+def _all_reduce_bucketed(tensors, bucket_bytes):
+    # tensors of the same dtype are flattened into buckets of at most bucket_bytes
+    # (or a single tensor if larger) and each bucket is summed in one call
+    reduced = []
+    bucket = []
+    bucket_size = 0
+
+    def flush():
+        flat = torch.cat([tensor.detach().reshape(-1).cpu() for tensor in bucket])
+        dist.all_reduce(flat)
+        offset = 0
+        for tensor in bucket:
+            reduced.append(
+                flat[offset : offset + tensor.nelement()]
+                .view(tensor.shape)
+                .to(tensor.device)
+            )
+            offset += tensor.nelement()
+
+    for tensor in tensors:
+        size = tensor.nelement() * tensor.element_size()
+        if len(bucket) > 0 and bucket_size + size > bucket_bytes:
+            flush()
+            bucket = []
+            bucket_size = 0
+        bucket.append(tensor)
+        bucket_size += size
+    if len(bucket) > 0:
+        flush()
+    return reduced
+
+
+def all_reduce_aggregators(aggregators, flags=(), bucket_bytes=BUCKET_BYTES):
+    r"""sums the entries of serial aggregators across all ranks in place. Entries
+    missing on some ranks count as zero there. Tensors are reduced in buckets of
+    the same dtype, the scalars and the weights are reduced together.
+
+    Args:
+        aggregators (List[SerialAggregator]): aggregators of the rank, the same
+            number on all ranks.
+        flags (Iterable[float], optional): numbers to sum across the ranks along
+            with the aggregators. Defaults to ().
+        bucket_bytes (int, optional): size of the buckets of tensors in bytes.
+            Defaults to ``BUCKET_BYTES``.
+
+    Returns:
+        List[float]: the summed flags.
+    """
+    metas = [
+        {key: _entry_meta(*aggregator._members[key]) for key in aggregator.keys()}
+        for aggregator in aggregators
+    ]
+    all_metas = [None] * dist.get_world_size()
+    dist.all_gather_object(all_metas, metas)
+    # entries of all ranks in the order they are first seen
+    entries = [dict() for _ in aggregators]
+    for rank_metas in all_metas:
+        for i, meta in enumerate(rank_metas):
+            for key, (kind, shape, dtype, weighted) in meta.items():
+                if key not in entries[i]:
+                    entries[i][key] = (kind, shape, dtype, weighted)
+                    continue
+                if entries[i][key][:3] != (kind, shape, dtype):
+                    raise Exception(f"{key} is aggregated differently across ranks")
+                # unweighted on any rank makes it unweighted
+                entries[i][key] = (kind, shape, dtype, entries[i][key][3] and weighted)
+
+    tensors = collections.defaultdict(list)
+    scalars = []
+    weights = []
+    for i, aggregator in enumerate(aggregators):
+        for key, (kind, shape, dtype, _) in entries[i].items():
+            value, weight = aggregator._members.get(key, (None, None))
+            if kind == "tensor":
+                if value is None:
+                    value = torch.zeros(shape, dtype=dtype)
+                tensors[dtype].append((i, key, value))
+            else:
+                scalars.append((i, key, 0.0 if value is None else float(value)))
+            weights.append(0.0 if weight is None else float(weight))
+    flags = list(flags)
+
+    numbers = torch.tensor(
+        [value for _, _, value in scalars] + weights + flags, dtype=torch.float64
+    )
+    dist.all_reduce(numbers)
+    numbers = numbers.tolist()
+    summed = dict()
+    for (i, key, _), value in zip(scalars, numbers):
+        summed[(i, key)] = value
+    for dtype_entries in tensors.values():
+        reduced = _all_reduce_bucketed(
+            [value for _, _, value in dtype_entries], bucket_bytes
+        )
+        for (i, key, _), value in zip(dtype_entries, reduced):
+            summed[(i, key)] = value
+
+    summed_weights = iter(numbers[len(scalars) : len(scalars) + len(weights)])
+    for i, aggregator in enumerate(aggregators):
+        for key, (_, _, _, weighted) in entries[i].items():
+            weight = next(summed_weights)
+            aggregator._members[key] = (summed[(i, key)], weight if weighted else None)
+    return numbers[len(numbers) - len(flags) :]
+
+
+def gather_appendix(appendix_aggregator):
+    r"""moves the entries of the appendix aggregators of all ranks to the one of
+    rank 0, in the order of the ranks.
+
+    Args:
+        appendix_aggregator (AppendixAggregator): aggregator of the rank.
+    """
+    members = {
+        key: [list(entries) for entries in value]
+        for key, value in appendix_aggregator._members.items()
+    }
+    gathered = [None] * dist.get_world_size() if dist.get_rank() == 0 else None
+    dist.gather_object(members, gathered, dst=0)
+    if dist.get_rank() != 0:
+        return
+    appendix_aggregator._members = dict()
+    for rank_members in gathered:
+        for key, (values, weights, steps) in rank_members.items():
+            for value, weight, step in zip(values, weights, steps):
+                appendix_aggregator.append(key, value, weight, step)
+
+
+def gather_losses(algorithm, client_ids) -> None:
+    r"""moves the train losses that the given clients of the rank reported in the
+    round (kept for the power of choice sampling, see ``client_losses``) to the server
+    storage of rank 0.
+
+    Args:
+        algorithm (``CentralFLAlgorithm``): the algorithm.
+        client_ids (List[int]): clients of the rank received in the round.
+    """
+    losses = algorithm._server_memory.read("client_losses", silent=True)
+    if losses is None:
+        return
+    reported = [(client_id, float(losses[client_id])) for client_id in client_ids]
+    gathered = [None] * dist.get_world_size() if dist.get_rank() == 0 else None
+    dist.gather_object(reported, gathered, dst=0)
+    if dist.get_rank() != 0:
+        return
+    for rank_reported in gathered:
+        for client_id, loss in rank_reported:
+            losses[client_id] = loss
+
+
+def reduce_round(algorithm, client_msgs, serial_aggregator, appendix_aggregator):
+    r"""aggregates the messages of the clients of the rank by ``receive_from_client``
+    and sums the aggregators across the ranks into the ones of rank 0. Serial
+    aggregators kept in the server storage (e.g., running statistics updated by
+    ``receive_from_client``) are summed as well; on the ranks other than 0 they
+    only hold the contribution of the current round. The train losses the clients
+    report for the power of choice sampling are gathered on rank 0.
+
+    Args:
+        algorithm (``CentralFLAlgorithm``): the algorithm.
+        client_msgs (Iterable[Dict[str, Any]]): messages of the clients of the rank.
+        serial_aggregator (SerialAggregator): serial aggregator of the round.
+        appendix_aggregator (AppendixAggregator): appendix aggregator of the round.
+
+    Returns:
+        bool: False if any client diverged.
+    """
+    storage = algorithm._server_memory
+    rank = dist.get_rank()
+    server_aggregators = dict()
+    for key in sorted(storage.get_all_keys()):
+        value = storage.read(key, silent=True)
+        if isinstance(value, SerialAggregator):
+            server_aggregators[key] = value
+            if rank != 0:
+                value._members = dict()
+    # rank 0 keeps the history of its server aggregators out of the sum
+    if rank == 0:
+        round_server_aggregators = {
+            key: SerialAggregator() for key in server_aggregators
+        }
+        if dist.get_world_size() == 1:
+            round_server_aggregators = server_aggregators
+    else:
+        round_server_aggregators = server_aggregators
+
+    diverged = 0
+    client_ids = []
+    for client_msg in client_msgs:
+        client_ids.append(client_msg["client_id"])
+        if not algorithm._receive_from_client(
+            client_msg, serial_aggregator, appendix_aggregator
+        ):
+            diverged = 1
+            break
+    gather_losses(algorithm, client_ids)
+    (num_diverged,) = all_reduce_aggregators(
+        [serial_aggregator, *round_server_aggregators.values()], flags=[diverged]
+    )
+    gather_appendix(appendix_aggregator)
+    if rank == 0 and round_server_aggregators is not server_aggregators:
+        for key, aggregator in round_server_aggregators.items():
+            merge_serial_aggregators(server_aggregators[key], aggregator)
+    return num_diverged == 0
+
+
+def _free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("localhost", 0))
+        return sock.getsockname()[1]
+
+
+def _run_local(rank, fn, world_size, port, backend, args):
+    os.environ["MASTER_ADDR"] = "localhost"
+    os.environ["MASTER_PORT"] = str(port)
+    dist.init_process_group(backend, rank=rank, world_size=world_size)
+    try:
+        fn(*args)
+    finally:
+        dist.destroy_process_group()
+
+
+def spawn_local(fn, world_size, args=(), backend="gloo"):
+    r"""runs a function on a process group of the given size on localhost, mostly
+    for testing. Each rank is a new process that initializes the process group,
+    calls ``fn(*args)`` and destroys the group.
+
+    Args:
+        fn (Callable): a picklable function, e.g., defined at the top level of a
+            module.
+        world_size (int): number of ranks.
+        args (Tuple, optional): arguments of the function. Defaults to ().
+        backend (str, optional): backend of the process group. Defaults to
+            ``'gloo'``.
+    """
+    mp.spawn(
+        _run_local,
+        args=(fn, world_size, _free_port(), backend, args),
+        nprocs=world_size,
+        join=True,
+    )
@@ -0,0 +1,652 @@
+r"""
+Process Pool Client Executor
+----------------------------
+"""
+import collections
+import queue
+import time
+import traceback
+
+import torch
+import torch.multiprocessing as mp
+from torch import nn
+
+from .scheduling import ClientCostModel
+from .scheduling import lpt_schedule
+from .transport import CloudRef
+from .transport import SharedMemoryTransport
+from .transport import load_cloud_ref
+from .transport import write_message
+
+
+class _ModuleState(object):
+    # placeholder for a module that is shipped to the workers as its state only
+    def __init__(self, state) -> None:
+        self.state = state
+
+
+def _same_state(state, module):
+    module_state = module.state_dict()
+    return state.keys() == module_state.keys() and all(
+        torch.equal(state[name], module_state[name]) for name in state
+    )
+
+
+def pack_ctx(ctx, previous=None):
+    r"""prepares the context of a client to be sent to another process. Modules in
+    the context are replaced by a detached copy of their state so that the server
+    can keep modifying its own module while the client is running.
+
+    Args:
+        ctx (Dict[Hashable, Any]): context returned by ``send_to_client``.
+        previous (Dict[Hashable, Any], optional): previously packed context. The
+            state of a module that did not change since then is shared with it
+            instead of copied again. Defaults to None.
+
+    Returns:
+        Dict[Hashable, Any]: packed context.
+    """
+    if ctx is None:
+        return None
+    packed = dict()
+    for key, value in ctx.items():
+        if isinstance(value, nn.Module):
+            if (
+                previous is not None
+                and isinstance(previous.get(key), _ModuleState)
+                and _same_state(previous[key].state, value)
+            ):
+                value = previous[key]
+            else:
+                value = _ModuleState(
+                    {
+                        name: tensor.detach().clone()
+                        for name, tensor in value.state_dict().items()
+                    }
+                )
+        packed[key] = value
+    return packed
+
+
+def unpack_ctx(packed, replicas, model_def, device, shared=None):
+    r"""inverse of ``pack_ctx``. Module states are loaded into model replicas that
+    are kept by the worker and reused from client to client.
+
+    Args:
+        packed (Dict[Hashable, Any]): packed context.
+        replicas (Dict[Hashable, Module]): model replicas of the worker. Missing
+            replicas are made by ``model_def`` and added to this dictionary.
+        model_def (Callable): definition of the model.
+        device (str): device to load the replicas on.
+        shared (Dict[Hashable, Any], optional): shared memory buffers registered to
+            the worker, to load the states packed by ``SharedMemoryTransport``.
+            Defaults to None.
+
+    Returns:
+        Dict[Hashable, Any]: unpacked context.
+    """
+    if packed is None:
+        return None
+    ctx = dict()
+    for key, value in packed.items():
+        if isinstance(value, (_ModuleState, CloudRef)):
+            if key not in replicas:
+                replicas[key] = model_def().to(device)
+            if isinstance(value, CloudRef):
+                load_cloud_ref(value, shared, replicas[key])
+            else:
+                replicas[key].load_state_dict(value.state)
+            value = replicas[key]
+        ctx[key] = value
+    return ctx
+
+
+def _to_private_memory(storage):
+    # tensors received from other processes live in shared memory and each holds a
+    # file descriptor. Client storages are kept for many rounds, so copy them out.
+    for key in list(storage.get_all_keys()):
+        obj = storage.read(key, silent=True)
+        if isinstance(obj, torch.Tensor) and obj.is_shared():
+            read_p, write_p = storage.get_protection_status(key)
+            storage.write(key, obj.clone(), read_p, write_p, silent=True)
+    return storage
+
+
+def _claim(claims, claim_slot, ticket):
+    # the first copy of a stolen client to start takes it, the other one is skipped
+    with claims.get_lock():
+        if claims[claim_slot] == ticket:
+            return False
+        claims[claim_slot] = ticket
+        return True
+
+
+def _cache_datasets(algorithm, cached_datasets):
+    # the local datasets of the clients are made once while they stay on the worker
+    get_local_dataset = algorithm._get_local_dataset
+
+    def provide(client_id):
+        if client_id not in cached_datasets:
+            cached_datasets[client_id] = get_local_dataset(client_id)
+        return cached_datasets[client_id]
+
+    algorithm._get_local_dataset = provide
+
+
+def _worker_loop(
+    algorithm, worker_id, num_threads, task_queue, result_queue, claims, affinity
+):
+    torch.set_num_threads(num_threads)
+    model_def = algorithm.get_model_def()
+    device = algorithm._local_cfg.read("device")
+    # each worker keeps its own model replicas
+    replicas = dict()
+    # shared memory buffers and slots of the transport, if any
+    shared = dict()
+    # storages and local datasets of the clients last run on this worker
+    cached_storages = dict()
+    cached_datasets = dict()
+    if affinity:
+        _cache_datasets(algorithm, cached_datasets)
+    while True:
+        item = task_queue.get()
+        if item is None:
+            break
+        if item[0] == "register":
+            shared[item[1]] = item[2]
+            continue
+        if item[0] == "drop":
+            # the client has moved to another worker
+            cached_storages.pop(item[1], None)
+            cached_datasets.pop(item[1], None)
+            continue
+        index, task, storage, slot_id, claim = item
+        if claim is not None and not _claim(claims, *claim):
+            result_queue.put((index, worker_id, None, None, None, None))
+            continue
+        client_id = task["client_id"]
+        if storage is None:
+            storage = cached_storages[client_id]
+        start = time.perf_counter()
+        try:
+            # the client is seeded by the task, after the replicas are made
+            task["ctx"] = unpack_ctx(task["ctx"], replicas, model_def, device, shared)
+            client_msg = algorithm._run_client_task(task, storage)
+            if affinity:
+                cached_storages[client_id] = storage
+            if slot_id is not None:
+                client_msg = write_message(client_msg, shared[("slot", slot_id)])
+            timing = (time.perf_counter() - start, time.time())
+            result = (index, worker_id, client_msg, storage, None, timing)
+        except Exception:
+            cached_storages.pop(client_id, None)
+            timing = (time.perf_counter() - start, time.time())
+            result = (index, worker_id, None, None, traceback.format_exc(), timing)
+        result_queue.put(result)
+
+
+class ProcessPoolClientExecutor(object):
+    r"""Runs the sampled clients on a pool of worker processes. Each worker keeps
+    its own model replica and the messages are yielded in the order of the given
+    client ids, so the aggregation on the server happens in the same order as in
+    the serial execution.
+
+    .. note::
+        Each client runs with its own seed. If the algorithm is not given a seed, it
+        is drawn from the global torch generator of the main process in the order
+        clients are sampled. Hence, given the seed runs are reproducible regardless
+        of the number of workers.
+
+    .. warning::
+        By default the workers are forked from the main process which is cheap and
+        shares the datasets of the data manager. If another start method is used
+        (which is the case when the device is cuda) the algorithm must be picklable.
+        Modules included in the context sent to the clients are assumed to be
+        instances of the model definition of the algorithm.
+
+    Args:
+        algorithm (``CentralFLAlgorithm``): algorithm to run the clients of.
+        workers (int): number of worker processes.
+        threads_per_worker (int, optional): number of torch intra-op threads of each
+            worker. Defaults to None which splits the current threads of the main
+            process among the workers.
+        start_method (str, optional): multiprocessing start method. Defaults to
+            None which uses ``'fork'`` if available and the device is not cuda.
+        max_pending (int, optional): maximum number of clients queued on each worker.
+            Defaults to 2.
+        shared_memory (bool, optional): sends the modules of the contexts and the
+            tensors of the messages through shared memory (see
+            ``SharedMemoryTransport``) instead of pickling a copy per client.
+            Defaults to False.
+        scheduling (str, optional): order the clients of ``map`` are dispatched
+            in. ``'fifo'`` dispatches them in the given order. ``'lpt'`` predicts
+            the cost of each client by ``ClientCostModel`` and dispatches the
+            largest first; once no client is left to dispatch, an idle worker
+            steals a client queued on another worker (whichever starts it first
+            runs it). The predicted and actual makespans of the round are reported
+            as ``schedule.predicted_makespan`` and ``schedule.makespan``. Defaults
+            to ``'fifo'``.
+        affinity (bool, optional): each worker keeps the storages and the local
+            datasets of the clients it runs. A client is sent back to the worker
+            that ran it last, without its storage, if that worker has room for it,
+            otherwise to the least busy worker. The share of the clients of a round
+            that find their worker is reported as ``affinity.hit_rate``. Defaults to
+            False.
+    """
+
+    def __init__(
+        self,
+        algorithm,
+        workers,
+        threads_per_worker=None,
+        start_method=None,
+        max_pending=2,
+        shared_memory=False,
+        scheduling="fifo",
+        affinity=False,
+    ) -> None:
+        if workers < 1:
+            raise Exception(f"invalid number of workers ({workers})")
+        if scheduling not in ("fifo", "lpt"):
+            raise Exception(f"invalid scheduling ({scheduling})")
+        self.algorithm = algorithm
+        self.workers = workers
+        if threads_per_worker is None:
+            threads_per_worker = max(1, torch.get_num_threads() // workers)
+        self.threads_per_worker = threads_per_worker
+        if start_method is None:
+            device = str(algorithm.get_device())
+            if "fork" in mp.get_all_start_methods() and not device.startswith("cuda"):
+                start_method = "fork"
+            else:
+                start_method = "spawn"
+        self.start_method = start_method
+        self.max_pending = max_pending
+        self.shared_memory = shared_memory
+        self.scheduling = scheduling
+        self.affinity = affinity
+
+        self._transport = None
+        # buffers and slot of the transport held by each submitted client
+        self._held = dict()
+        self._processes = None
+        self._task_queues = None
+        self._result_queue = None
+        self._pending = None
+        # clients submitted one by one (see submit)
+        self._next_index = 0
+        self._submitted = dict()
+        self._finished = dict()
+        # cost-aware scheduling: clients queued on each worker, the cost model, the
+        # claim slots of the dispatched clients and their number of copies
+        self._cost_model = ClientCostModel() if scheduling == "lpt" else None
+        self._queued = None
+        self._claims = None
+        self._free_claims = []
+        self._claimed = dict()
+        self._next_ticket = 0
+        self._works = dict()
+        self._last_finish = None
+        # client affinity: the worker holding each client, the client of each
+        # queued index and the number of dispatches that found their worker
+        self._holders = dict()
+        self._client_of = dict()
+        self._hits = 0
+        self._misses = 0
+
+    def _start(self) -> None:
+        mp_ctx = mp.get_context(self.start_method)
+        self._result_queue = mp_ctx.Queue()
+        self._task_queues = []
+        self._processes = []
+        if self.scheduling == "lpt":
+            # one claim slot per client on the workers, including stolen copies
+            num_claims = 2 * self.workers * self.max_pending
+            self._claims = mp_ctx.Array("q", [-1] * num_claims)
+            self._free_claims = list(range(num_claims))
+        for worker_id in range(self.workers):
+            task_queue = mp_ctx.Queue()
+            process = mp_ctx.Process(
+                target=_worker_loop,
+                args=(
+                    self.algorithm,
+                    worker_id,
+                    self.threads_per_worker,
+                    task_queue,
+                    self._result_queue,
+                    self._claims,
+                    self.affinity,
+                ),
+                daemon=True,
+            )
+            process.start()
+            self._task_queues.append(task_queue)
+            self._processes.append(process)
+        self._pending = [0] * self.workers
+        self._queued = [[] for _ in range(self.workers)]
+
+    def _make_transport(self):
+        # a slot fits the state of the model, e.g., the vector of its parameters
+        with torch.device("meta"):
+            state = self.algorithm.get_model_def()().state_dict()
+        slot_bytes = sum(
+            tensor.nelement() * tensor.element_size() + 8 for tensor in state.values()
+        )
+        return SharedMemoryTransport(slot_bytes)
+
+    def _prepare(self, index, client_id, previous=None):
+        # the task of a client, with its context packed to be sent to a worker
+        task = self.algorithm._make_client_task(client_id)
+        if self.shared_memory:
+            if self._transport is None:
+                self._transport = self._make_transport()
+            task["ctx"], buffer_ids = self._transport.pack_ctx(task["ctx"])
+            self._held[index] = (buffer_ids, None)
+        else:
+            task["ctx"] = pack_ctx(task["ctx"], previous)
+        return task
+
+    def _dispatch(self, index, task, worker_id, claim=None) -> None:
+        slot_id = None
+        if self.shared_memory:
+            buffer_ids, slot_id = self._held[index]
+            if slot_id is None:
+                slot_id = self._transport.acquire_slot()
+                self._held[index] = (buffer_ids, slot_id)
+            for item in self._transport.get_registrations(
+                worker_id, buffer_ids, slot_id
+            ):
+                self._task_queues[worker_id].put(item)
+        client_id = task["client_id"]
+        storage = None
+        if self._holders.get(client_id) == worker_id and not self._is_queued(
+            client_id
+        ):
+            # the worker has the latest storage of the client
+            self._hits += 1
+        else:
+            # stolen copies are not counted
+            if index not in self._client_of:
+                self._misses += 1
+            storage = self.algorithm._client_memory[client_id]
+        self._task_queues[worker_id].put((index, task, storage, slot_id, claim))
+        self._pending[worker_id] += 1
+        self._queued[worker_id].append(index)
+        self._client_of[index] = client_id
+
+    def _is_queued(self, client_id):
+        return any(
+            self._client_of[index] == client_id
+            for indices in self._queued
+            for index in indices
+        )
+
+    def _choose_worker(self, client_id):
+        # the worker holding the client if it has room, else the least busy one
+        holder = self._holders.get(client_id)
+        if holder is not None and self._pending[holder] < self.max_pending:
+            return holder
+        return self._pending.index(min(self._pending))
+
+    def _submit(self, index, client_id) -> None:
+        worker_id = self._choose_worker(client_id)
+        self._dispatch(index, self._prepare(index, client_id), worker_id)
+
+    def _add_stats(self, stats) -> None:
+        # stats of the round, reported by the algorithm
+        self.algorithm._schedule_stats = {
+            **(self.algorithm._schedule_stats or dict()),
+            **stats,
+        }
+
+    def _add_affinity_stats(self) -> None:
+        if self.affinity and self._hits + self._misses > 0:
+            self._add_stats(
+                {"affinity.hit_rate": self._hits / (self._hits + self._misses)}
+            )
+        self._hits = 0
+        self._misses = 0
+
+    def _get_claim(self, index):
+        # the claim shared by the copies of a client
+        if index not in self._claimed:
+            self._claimed[index] = [self._free_claims.pop(), self._next_ticket, 0]
+            self._next_ticket += 1
+        self._claimed[index][2] += 1
+        claim_slot, ticket, _ = self._claimed[index]
+        return claim_slot, ticket
+
+    def _collect(self, results) -> None:
+        while True:
+            try:
+                index, worker_id, msg, storage, error, timing = self._result_queue.get(
+                    timeout=1.0
+                )
+                break
+            except queue.Empty:
+                for process in self._processes:
+                    if not process.is_alive():
+                        raise Exception(
+                            f"worker process {process.pid} exited unexpectedly "
+                            f"with code {process.exitcode}"
+                        )
+        self._pending[worker_id] -= 1
+        self._queued[worker_id].remove(index)
+        client_id = self._client_of[index]
+        if all(index not in indices for indices in self._queued):
+            del self._client_of[index]
+        if index in self._claimed:
+            self._claimed[index][2] -= 1
+            if self._claimed[index][2] == 0:
+                self._free_claims.append(self._claimed.pop(index)[0])
+        if timing is None:
+            # the other copy of a stolen client is run
+            return
+        if self.affinity:
+            holder = self._holders.pop(client_id, None)
+            if holder is not None and holder != worker_id:
+                self._task_queues[holder].put(("drop", client_id))
+            if error is None:
+                self._holders[client_id] = worker_id
+        elapsed, finish_time = timing
+        if index in self._works:
+            _, work = self._works.pop(index)
+            self._cost_model.update(client_id, work, elapsed)
+            self._last_finish = max(self._last_finish or finish_time, finish_time)
+        if index in self._held:
+            buffer_ids, slot_id = self._held.pop(index)
+            self._transport.release(buffer_ids)
+            if error is None:
+                msg = self._transport.read_message(msg, slot_id)
+            else:
+                self._transport.discard_slot(slot_id)
+        results[index] = (msg, storage, error)
+
+    def _take(self, client_id, result):
+        msg, storage, error = result
+        if error is not None:
+            raise Exception(f"client {client_id} failed in worker:\n{error}")
+        self.algorithm._client_memory[client_id] = _to_private_memory(storage)
+        return msg
+
+    def map(self, client_ids):
+        r"""runs the given clients on the workers and yields their messages in the
+        same order as ``client_ids``.
+
+        Args:
+            client_ids (Iterable[int]): ids of the clients to run.
+
+        Yields:
+            Dict[str, Any]: message of each client to the server.
+        """
+        if self._processes is None:
+            self._start()
+        client_ids = list(client_ids)
+        if self.scheduling == "lpt":
+            yield from self._map_lpt(client_ids)
+            return
+        results = dict()
+        next_task = 0
+        next_result = 0
+        try:
+            while next_result < len(client_ids):
+                # keep the workers busy
+                while (
+                    next_task < len(client_ids)
+                    and min(self._pending) < self.max_pending
+                ):
+                    self._submit(next_task, client_ids[next_task])
+                    next_task += 1
+                while next_result not in results:
+                    self._collect(results)
+                msg = self._take(client_ids[next_result], results.pop(next_result))
+                next_result += 1
+                yield msg
+        finally:
+            # wait for the clients still running (e.g., when stopped at divergence)
+            while sum(self._pending) > 0:
+                self._collect(results)
+        self._add_affinity_stats()
+
+    def _steal(self, tasks, stolen) -> None:
+        # idle workers take a copy of the last client queued on the busiest worker
+        for worker_id in range(self.workers):
+            if self._pending[worker_id] > 0:
+                continue
+            victims = [
+                victim
+                for victim in range(self.workers)
+                if len(self._queued[victim]) > 1
+                and self._queued[victim][-1] not in stolen
+            ]
+            if len(victims) == 0:
+                return
+            victim = max(victims, key=lambda victim: len(self._queued[victim]))
+            index = self._queued[victim][-1]
+            stolen.add(index)
+            self._dispatch(index, tasks[index], worker_id, self._get_claim(index))
+
+    def _dispatch_lpt(self, to_dispatch, tasks, stolen) -> None:
+        while len(to_dispatch) > 0 and min(self._pending) < self.max_pending:
+            index = to_dispatch.popleft()
+            worker_id = self._choose_worker(tasks[index]["client_id"])
+            self._dispatch(index, tasks[index], worker_id, self._get_claim(index))
+        if len(to_dispatch) == 0:
+            self._steal(tasks, stolen)
+
+    def _map_lpt(self, client_ids):
+        # the tasks are made in the order of the clients, as with fifo, and are
+        # dispatched largest first
+        works = [self.algorithm._get_client_work(client_id) for client_id in client_ids]
+        calibrated = self._cost_model.is_calibrated()
+        order, predicted_makespan = lpt_schedule(
+            [
+                self._cost_model.predict(client_id, work)
+                for client_id, work in zip(client_ids, works)
+            ],
+            self.workers,
+        )
+        tasks = dict()
+        previous = None
+        for index, client_id in enumerate(client_ids):
+            tasks[index] = self._prepare(index, client_id, previous)
+            previous = tasks[index]["ctx"]
+            self._works[index] = (client_id, works[index])
+        to_dispatch = collections.deque(order)
+        stolen = set()
+        results = dict()
+        next_result = 0
+        start_time = time.time()
+        self._last_finish = None
+        try:
+            while next_result < len(client_ids):
+                # the next client in order could be among the last to dispatch, so
+                # the workers are refilled after each result
+                self._dispatch_lpt(to_dispatch, tasks, stolen)
+                while next_result not in results:
+                    self._collect(results)
+                    self._dispatch_lpt(to_dispatch, tasks, stolen)
+                msg = self._take(client_ids[next_result], results.pop(next_result))
+                tasks.pop(next_result)
+                next_result += 1
+                yield msg
+        finally:
+            while sum(self._pending) > 0:
+                self._collect(results)
+            # clients that are not dispatched (e.g., when stopped at divergence)
+            for index in to_dispatch:
+                if index in self._held:
+                    self._transport.release(self._held.pop(index)[0])
+            self._works = dict()
+        stats = {
+            "schedule.makespan": self._last_finish - start_time,
+            "schedule.stolen": len(stolen),
+        }
+        if calibrated:
+            stats["schedule.predicted_makespan"] = predicted_makespan
+        self._add_stats(stats)
+        self._add_affinity_stats()
+
+    def submit(self, client_id) -> None:
+        r"""makes the context of the given client from the current state of the
+        server and queues the client on the least busy worker.
+
+        Args:
+            client_id (int): id of the client to run.
+        """
+        if self._processes is None:
+            self._start()
+        self._submitted[self._next_index] = client_id
+        self._submit(self._next_index, client_id)
+        self._next_index += 1
+
+    def next_result(self):
+        r"""gives the message of the client that finished first among the submitted
+        ones, waiting for one to finish if none has. The clients are given in the
+        order they finish on the workers, which is not necessarily the order they are
+        submitted in.
+
+        Returns:
+            Tuple[int, Dict[str, Any]]: client id and its message to the server.
+        """
+        if len(self._finished) == 0:
+            self._collect(self._finished)
+        index = next(iter(self._finished))
+        client_id = self._submitted.pop(index)
+        return client_id, self._take(client_id, self._finished.pop(index))
+
+    def num_pending(self) -> int:
+        r"""number of submitted clients that are not taken by ``next_result`` yet.
+
+        Returns:
+            int: number of pending clients.
+        """
+        return len(self._submitted)
+
+    def close(self) -> None:
+        r"""stops the worker processes. Clients that are still running are
+        discarded."""
+        if self._processes is None:
+            return
+        for task_queue in self._task_queues:
+            task_queue.put(None)
+        timeout = 0 if sum(self._pending) > 0 else 10
+        for process in self._processes:
+            process.join(timeout=timeout)
+            if process.is_alive():
+                process.terminate()
+        self._processes = None
+        self._task_queues = None
+        self._result_queue = None
+        self._pending = None
+        self._submitted = dict()
+        self._finished = dict()
+        self._transport = None
+        self._held = dict()
+        self._queued = None
+        self._claims = None
+        self._free_claims = []
+        self._claimed = dict()
+        self._works = dict()
+        self._holders = dict()
+        self._client_of = dict()
@@ -0,0 +1,92 @@
+r"""
+Client Scheduling
+-----------------
+
+Cost-aware scheduling of the clients of a round onto parallel workers.
+"""
+
+
+def lpt_schedule(costs, workers):
+    r"""longest processing time first (LPT) schedule of the given costs on a number
+    of identical workers. Each cost, largest first, goes to the least loaded worker.
+
+    Args:
+        costs (Sequence[float]): predicted cost of each client.
+        workers (int): number of workers.
+
+    Returns:
+        Tuple[List[int], float]: indices of the costs in the order they are
+            dispatched and the makespan of the schedule (the largest load of a
+            worker).
+    """
+    order = sorted(range(len(costs)), key=lambda index: -costs[index])
+    loads = [0.0] * workers
+    for index in order:
+        worker_id = loads.index(min(loads))
+        loads[worker_id] += costs[index]
+    return order, max(loads)
+
+
+class ClientCostModel(object):
+    r"""predicts the time it takes to run a client as its work (number of training
+    samples times epochs) times its seconds per sample. The seconds per sample are
+    measured on the earlier runs of the client, or averaged over all measured
+    clients for the ones that are not run yet.
+
+    .. note::
+        Before any measurement, the predictions are the work of the clients which
+        only tells their relative costs (see ``is_calibrated``).
+
+    Args:
+        smoothing (float, optional): weight of a new measurement in the moving
+            averages of the seconds per sample. Defaults to 0.5.
+    """
+
+    def __init__(self, smoothing=0.5) -> None:
+        if not 0 < smoothing <= 1:
+            raise Exception(f"invalid smoothing ({smoothing})")
+        self.smoothing = smoothing
+        self._client_rates = dict()
+        self._rate = None
+
+    def _average(self, average, value):
+        if average is None:
+            return value
+        return (1 - self.smoothing) * average + self.smoothing * value
+
+    def is_calibrated(self) -> bool:
+        r"""whether the predictions are in seconds, i.e., any client is measured.
+
+        Returns:
+            bool: True once a client is measured.
+        """
+        return self._rate is not None
+
+    def predict(self, client_id, work) -> float:
+        r"""predicted cost of a client.
+
+        Args:
+            client_id (int): id of the client.
+            work (int): number of samples the client trains on over all epochs.
+
+        Returns:
+            float: the cost in seconds if calibrated, the work otherwise.
+        """
+        rate = self._client_rates.get(client_id, self._rate)
+        if rate is None:
+            return float(work)
+        return work * rate
+
+    def update(self, client_id, work, elapsed) -> None:
+        r"""takes a measured run of a client into account.
+
+        Args:
+            client_id (int): id of the client.
+            work (int): number of samples the client trained on over all epochs.
+            elapsed (float): seconds the client took.
+        """
+        rate = elapsed / max(work, 1)
+        self._client_rates[client_id] = self._average(
+            self._client_rates.get(client_id), rate
+        )
+        self._rate = self._average(self._rate, rate)
@@ -0,0 +1,60 @@
+r"""
+Serial Client Executor
+----------------------
+"""
+import collections
+
+
+class SerialClientExecutor(object):
+    r"""Runs the sampled clients one after another in the main process. This is the
+    default executor of centralized FL algorithms.
+
+    Args:
+        algorithm (``CentralFLAlgorithm``): algorithm to run the clients of.
+    """
+
+    def __init__(self, algorithm) -> None:
+        self.algorithm = algorithm
+        self._done = collections.deque()
+
+    def map(self, client_ids):
+        r"""runs the given clients and yields their messages in the same order.
+
+        Args:
+            client_ids (Iterable[int]): ids of the clients to run.
+
+        Yields:
+            Dict[str, Any]: message of each client to the server.
+        """
+        for client_id in client_ids:
+            yield self.algorithm._send_to_server(client_id)
+
+    def submit(self, client_id) -> None:
+        r"""runs the given client against the current state of the server. Its
+        message is kept until it is taken by ``next_result``.
+
+        Args:
+            client_id (int): id of the client to run.
+        """
+        self._done.append((client_id, self.algorithm._send_to_server(client_id)))
+
+    def next_result(self):
+        r"""gives the message of the client that finished first among the submitted
+        ones.
+
+        Returns:
+            Tuple[int, Dict[str, Any]]: client id and its message to the server.
+        """
+        return self._done.popleft()
+
+    def num_pending(self) -> int:
+        r"""number of submitted clients that are not taken by ``next_result`` yet.
+
+        Returns:
+            int: number of pending clients.
+        """
+        return len(self._done)
+
+    def close(self) -> None:
+        r"""releases the resources held by the executor."""
+        pass
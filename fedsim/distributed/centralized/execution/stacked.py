@@ -0,0 +1,198 @@
+r"""
+Stacked Client Executor
+-----------------------
+"""
+import collections
+import copy
+
+import torch
+from torch import nn
+
+
+def _same_state(module_a, module_b):
+    state_a = module_a.state_dict()
+    state_b = module_b.state_dict()
+    return state_a.keys() == state_b.keys() and all(
+        torch.equal(state_a[key], state_b[key]) for key in state_a
+    )
+
+
+def snapshot_ctx(ctx, previous=None):
+    r"""copies the modules of the context sent to a client so that the server can
+    keep modifying its own modules before the client is run. A module that did not
+    change since the previous snapshot is not copied again but shared with it.
+
+    Args:
+        ctx (Dict[Hashable, Any]): context returned by ``send_to_client``.
+        previous (Dict[Hashable, Any], optional): previous snapshot. Defaults to
+            None.
+
+    Returns:
+        Dict[Hashable, Any]: the snapshot.
+    """
+    if ctx is None:
+        return None
+    snapshot = dict()
+    for key, value in ctx.items():
+        if isinstance(value, nn.Module):
+            if (
+                previous is not None
+                and isinstance(previous.get(key), nn.Module)
+                and _same_state(previous[key], value)
+            ):
+                value = previous[key]
+            else:
+                value = copy.deepcopy(value)
+        snapshot[key] = value
+    return snapshot
+
+
+def run_stacked(executors, tasks, max_stack=None):
+    r"""trains the clients of several algorithms together (e.g., the seed replicas
+    of the same algorithm) through the ``send_to_server_stacked`` method of the
+    first one. The algorithms must share the model definition and the local training
+    setup; each client keeps reading from and writing to the storage of its own
+    algorithm.
+
+    Args:
+        executors (List[StackedClientExecutor]): executor of each algorithm.
+        tasks (List[List[Dict[str, Any]]]): tasks of each algorithm, see
+            ``StackedClientExecutor.make_tasks``.
+        max_stack (int, optional): maximum number of clients trained together.
+            Defaults to None which trains all given clients together.
+
+    Returns:
+        List[List[Dict[str, Any]]]: messages of the clients of each algorithm in
+            the order of their tasks.
+    """
+    flat_tasks = []
+    storages = []
+    for executor, executor_tasks in zip(executors, tasks):
+        for task in executor_tasks:
+            flat_tasks.append(task)
+            storages.append(executor.algorithm._client_memory[task["client_id"]])
+    if max_stack is None:
+        max_stack = max(len(flat_tasks), 1)
+    algorithm = executors[0].algorithm
+    flat_msgs = []
+    for start in range(0, len(flat_tasks), max_stack):
+        flat_msgs.extend(
+            algorithm._run_client_tasks_stacked(
+                flat_tasks[start : start + max_stack],
+                storages[start : start + max_stack],
+            )
+        )
+    msgs = []
+    for executor_tasks in tasks:
+        msgs.append(flat_msgs[: len(executor_tasks)])
+        flat_msgs = flat_msgs[len(executor_tasks) :]
+    return msgs
+
+
+class StackedClientExecutor(object):
+    r"""Runs the sampled clients of a round together through the
+    ``send_to_server_stacked`` method of the algorithm, which vectorizes the local
+    training over the clients.
+
+    .. note::
+        All contexts are collected from the server before any client is run. The
+        modules in the contexts are copied (once for as long as they are not changed)
+        so each client receives the state the server had when its context was made.
+
+    Args:
+        algorithm (``CentralFLAlgorithm``): algorithm to run the clients of.
+        max_stack (int, optional): maximum number of clients trained together.
+            Defaults to None which trains all sampled clients of a round together.
+    """
+
+    def __init__(self, algorithm, max_stack=None) -> None:
+        if max_stack is not None and max_stack < 1:
+            raise Exception(f"invalid stack size ({max_stack})")
+        self.algorithm = algorithm
+        self.max_stack = max_stack
+        self._queued = []
+        self._done = collections.deque()
+
+    def _make_task(self, client_id, previous_task=None):
+        task = self.algorithm._make_client_task(client_id)
+        previous = None if previous_task is None else previous_task["ctx"]
+        task["ctx"] = snapshot_ctx(task["ctx"], previous)
+        return task
+
+    def _run_tasks(self, tasks):
+        storages = [self.algorithm._client_memory[task["client_id"]] for task in tasks]
+        return self.algorithm._run_client_tasks_stacked(tasks, storages)
+
+    def make_tasks(self, client_ids):
+        r"""collects the contexts of the given clients from the current state of the
+        server without running them.
+
+        Args:
+            client_ids (Iterable[int]): ids of the clients.
+
+        Returns:
+            List[Dict[str, Any]]: task of each client.
+        """
+        tasks = []
+        for client_id in client_ids:
+            tasks.append(self._make_task(client_id, tasks[-1] if tasks else None))
+        return tasks
+
+    def _run_stack(self, client_ids):
+        return self._run_tasks(self.make_tasks(client_ids))
+
+    def map(self, client_ids):
+        r"""runs the given clients stacked and yields their messages in the same order
+        as ``client_ids``.
+
+        Args:
+            client_ids (Iterable[int]): ids of the clients to run.
+
+        Yields:
+            Dict[str, Any]: message of each client to the server.
+        """
+        client_ids = list(client_ids)
+        max_stack = self.max_stack
+        if max_stack is None:
+            max_stack = max(len(client_ids), 1)
+        for start in range(0, len(client_ids), max_stack):
+            for msg in self._run_stack(client_ids[start : start + max_stack]):
+                yield msg
+
+    def submit(self, client_id) -> None:
+        r"""makes the context of the given client from the current state of the
+        server. The client is trained together with the other queued clients when a
+        result is asked for by ``next_result``.
+
+        Args:
+            client_id (int): id of the client to run.
+        """
+        previous = self._queued[-1] if len(self._queued) > 0 else None
+        self._queued.append(self._make_task(client_id, previous))
+
+    def next_result(self):
+        r"""gives the message of the next finished client. If none is finished the
+        queued clients are trained stacked.
+
+        Returns:
+            Tuple[int, Dict[str, Any]]: client id and its message to the server.
+        """
+        if len(self._done) == 0:
+            max_stack = self.max_stack or len(self._queued)
+            tasks = self._queued[:max_stack]
+            self._queued = self._queued[max_stack:]
+            for task, msg in zip(tasks, self._run_tasks(tasks)):
+                self._done.append((task["client_id"], msg))
+        return self._done.popleft()
+
+    def num_pending(self) -> int:
+        r"""number of submitted clients that are not taken by ``next_result`` yet.
+
+        Returns:
+            int: number of pending clients.
+        """
+        return len(self._queued) + len(self._done)
+
+    def close(self) -> None:
+        r"""nothing to release."""
+        pass
@@ -0,0 +1,298 @@
+r"""
+Shared Memory Transport
+-----------------------
+
+Moves the messages between the server and the worker processes through shared
+memory. The state of each module sent to the clients is published once into a
+versioned flat buffer that the workers only read, and the tensors sent back by the
+clients are written by the workers into preallocated slots taken from a ring. Only
+small references to the buffers and slots are pickled.
+"""
+import torch
+from torch import nn
+
+# offsets in the buffers are aligned to this many bytes
+ALIGNMENT = 8
+# bytes at the start of each cloud buffer holding its version
+HEADER_BYTES = 8
+
+
+def _align(num_bytes):
+    return (num_bytes + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _nbytes(tensor):
+    return tensor.nelement() * tensor.element_size()
+
+
+def _view(buffer, offset, dtype, shape):
+    num_bytes = torch.Size(shape).numel() * torch.empty(0, dtype=dtype).element_size()
+    return buffer[offset : offset + num_bytes].view(dtype).view(shape)
+
+
+def _make_layout(state):
+    # name -> (offset, dtype, shape) of the entries of a state in a flat buffer
+    layout = dict()
+    offset = HEADER_BYTES
+    for name, tensor in state.items():
+        layout[name] = (offset, tensor.dtype, tuple(tensor.shape))
+        offset += _align(_nbytes(tensor))
+    return layout, offset
+
+
+def _layout_of(state):
+    return tuple(
+        (name, tensor.dtype, tuple(tensor.shape)) for name, tensor in state.items()
+    )
+
+
+class CloudRef(object):
+    r"""reference to a version of a module state published in a cloud buffer.
+
+    Args:
+        buffer_id (int): id of the buffer.
+        version (int): version of the buffer the state is published at.
+    """
+
+    __slots__ = ("buffer_id", "version")
+
+    def __init__(self, buffer_id, version) -> None:
+        self.buffer_id = buffer_id
+        self.version = version
+
+    def __getstate__(self):
+        return (self.buffer_id, self.version)
+
+    def __setstate__(self, state):
+        self.buffer_id, self.version = state
+
+
+class SlotRef(object):
+    r"""reference to a tensor written in an uplink slot.
+
+    Args:
+        offset (int): offset of the tensor in the slot in bytes.
+        dtype (torch.dtype): type of the tensor.
+        shape (Tuple[int]): shape of the tensor.
+        requires_grad (bool): whether the tensor requires gradient.
+    """
+
+    __slots__ = ("offset", "dtype", "shape", "requires_grad")
+
+    def __init__(self, offset, dtype, shape, requires_grad=False) -> None:
+        self.offset = offset
+        self.dtype = dtype
+        self.shape = shape
+        self.requires_grad = requires_grad
+
+    def __getstate__(self):
+        return (self.offset, self.dtype, self.shape, self.requires_grad)
+
+    def __setstate__(self, state):
+        self.offset, self.dtype, self.shape, self.requires_grad = state
+
+
+class SharedMemoryTransport(object):
+    r"""server side of the shared memory transport. Buffers and slots are made on
+    demand; a cloud buffer is only overwritten by a new version once no client
+    that is given one of its versions is pending.
+
+    .. note::
+        The workers get the buffers and slots once, by their ids, through the
+        ``register`` items made by ``get_registrations``. Tensors read from the
+        slots are copied out, so a slot can be reused as soon as it is read.
+
+    Args:
+        slot_bytes (int): size of each uplink slot in bytes. Tensors of a message
+            are written to the slot as long as they fit, the rest are pickled.
+    """
+
+    def __init__(self, slot_bytes) -> None:
+        self.slot_bytes = _align(slot_bytes)
+        # [buffer, layout, layout key, version, number of pending readers]
+        self._buffers = []
+        self._slots = []
+        self._free_slots = []
+        # buffers and slots each worker is given
+        self._registered = dict()
+
+    def _publish(self, state):
+        layout_key = _layout_of(state)
+        latest = None
+        for buffer_id, entry in enumerate(self._buffers):
+            if entry[2] == layout_key and (latest is None or entry[3] > latest[1][3]):
+                latest = (buffer_id, entry)
+        if latest is not None:
+            buffer_id, entry = latest
+            buffer, layout = entry[0], entry[1]
+            if all(
+                torch.equal(_view(buffer, *layout[name]), tensor.detach())
+                for name, tensor in state.items()
+            ):
+                entry[4] += 1
+                return CloudRef(buffer_id, entry[3])
+        # a buffer of the same layout that no pending client reads
+        buffer_id = next(
+            (
+                buffer_id
+                for buffer_id, entry in enumerate(self._buffers)
+                if entry[2] == layout_key and entry[4] == 0
+            ),
+            None,
+        )
+        if buffer_id is None:
+            layout, num_bytes = _make_layout(state)
+            buffer = torch.zeros(num_bytes, dtype=torch.uint8).share_memory_()
+            self._buffers.append([buffer, layout, layout_key, 0, 0])
+            buffer_id = len(self._buffers) - 1
+        entry = self._buffers[buffer_id]
+        buffer, layout = entry[0], entry[1]
+        for name, tensor in state.items():
+            _view(buffer, *layout[name]).copy_(tensor.detach())
+        entry[3] = max(other[3] for other in self._buffers) + 1
+        _view(buffer, 0, torch.int64, ()).fill_(entry[3])
+        entry[4] += 1
+        return CloudRef(buffer_id, entry[3])
+
+    def pack_ctx(self, ctx):
+        r"""replaces the modules of the context of a client by references to their
+        published states.
+
+        Args:
+            ctx (Dict[Hashable, Any]): context returned by ``send_to_client``.
+
+        Returns:
+            Tuple[Dict[Hashable, Any], List[int]]: packed context and the ids of the
+                buffers it refers to, to be released when the client is done.
+        """
+        if ctx is None:
+            return None, []
+        packed = dict()
+        buffer_ids = []
+        for key, value in ctx.items():
+            if isinstance(value, nn.Module):
+                value = self._publish(value.state_dict())
+                buffer_ids.append(value.buffer_id)
+            packed[key] = value
+        return packed, buffer_ids
+
+    def release(self, buffer_ids) -> None:
+        r"""lets the transport know a client is done with the given buffers.
+
+        Args:
+            buffer_ids (Iterable[int]): ids returned by ``pack_ctx``.
+        """
+        for buffer_id in buffer_ids:
+            self._buffers[buffer_id][4] -= 1
+
+    def acquire_slot(self) -> int:
+        r"""takes a free uplink slot from the ring, a new slot is made if none is
+        free.
+
+        Returns:
+            int: id of the slot.
+        """
+        if len(self._free_slots) == 0:
+            slot = torch.zeros(self.slot_bytes, dtype=torch.uint8).share_memory_()
+            self._slots.append(slot)
+            return len(self._slots) - 1
+        return self._free_slots.pop()
+
+    def read_message(self, msg, slot_id):
+        r"""replaces the slot references of a message by copies of the tensors and
+        puts the slot back in the ring.
+
+        Args:
+            msg (Dict[str, Any]): message written by ``write_message``.
+            slot_id (int): id of the slot of the message.
+
+        Returns:
+            Dict[str, Any]: the message.
+        """
+        slot = self._slots[slot_id]
+        if msg is not None:
+            for key, value in msg.items():
+                if isinstance(value, SlotRef):
+                    tensor = _view(slot, value.offset, value.dtype, value.shape).clone()
+                    msg[key] = tensor.requires_grad_(value.requires_grad)
+        self._free_slots.append(slot_id)
+        return msg
+
+    def discard_slot(self, slot_id) -> None:
+        r"""puts a slot back in the ring without reading it.
+
+        Args:
+            slot_id (int): id of the slot.
+        """
+        self._free_slots.append(slot_id)
+
+    def get_registrations(self, worker_id, buffer_ids, slot_id):
+        r"""items to send to a worker before a task that uses the given buffers and
+        slot, for the ones the worker does not have yet.
+
+        Args:
+            worker_id (int): id of the worker.
+            buffer_ids (Iterable[int]): ids of the buffers of the task.
+            slot_id (int): id of the slot of the task.
+
+        Returns:
+            List[Tuple]: the registration items.
+        """
+        registered = self._registered.setdefault(worker_id, set())
+        items = []
+        for buffer_id in buffer_ids:
+            if ("buffer", buffer_id) not in registered:
+                buffer, layout = self._buffers[buffer_id][:2]
+                items.append(("register", ("buffer", buffer_id), (buffer, layout)))
+                registered.add(("buffer", buffer_id))
+        if ("slot", slot_id) not in registered:
+            items.append(("register", ("slot", slot_id), self._slots[slot_id]))
+            registered.add(("slot", slot_id))
+        return items
+
+
+def load_cloud_ref(ref, shared, module):
+    r"""loads a published module state into a module on a worker.
+
+    Args:
+        ref (CloudRef): reference to the state.
+        shared (Dict[Hashable, Any]): buffers and slots registered to the worker.
+        module (Module): module to load the state into.
+    """
+    buffer, layout = shared[("buffer", ref.buffer_id)]
+    version = int(_view(buffer, 0, torch.int64, ()).item())
+    if version != ref.version:
+        raise Exception(
+            f"cloud buffer {ref.buffer_id} is at version {version} instead of "
+            f"{ref.version}"
+        )
+    module.load_state_dict(
+        {name: _view(buffer, *entry) for name, entry in layout.items()}
+    )
+
+
+def write_message(msg, slot):
+    r"""writes the tensors of a message into an uplink slot on a worker, in order,
+    as long as they fit. The written tensors are replaced by ``SlotRef``.
+
+    Args:
+        msg (Dict[str, Any]): message of a client.
+        slot (Tensor): the slot.
+
+    Returns:
+        Dict[str, Any]: the message with references to the slot.
+    """
+    offset = 0
+    written = dict()
+    for key, value in msg.items():
+        if not torch.is_tensor(value) or value.device.type != "cpu":
+            continue
+        num_bytes = _nbytes(value)
+        if offset + num_bytes > slot.nelement():
+            continue
+        _view(slot, offset, value.dtype, value.shape).copy_(value.detach())
+        written[key] = SlotRef(
+            offset, value.dtype, tuple(value.shape), value.requires_grad
+        )
+        offset += _align(num_bytes)
+    return {**msg, **written}
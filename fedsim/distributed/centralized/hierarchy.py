@@ -0,0 +1,265 @@
+r"""
+Hierarchical Aggregation
+------------------------
+
+Groups the clients under simulated edge aggregators. Each edge aggregates the
+messages of its own clients by ``receive_from_client`` in a thread of its own and the
+server only combines the aggregators of the edges.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+from fedsim.utils import AppendixAggregator
+from fedsim.utils import SerialAggregator
+from fedsim.utils import Storage
+
+from .simulation import message_size
+
+
+def edge_of(client_id, num_clients, num_edges) -> int:
+    r"""edge that the given client is connected to. The clients are split into
+    contiguous slices, one per edge.
+
+    Args:
+        client_id (int): id of the client.
+        num_clients (int): number of clients.
+        num_edges (int): number of edges.
+
+    Returns:
+        int: id of the edge.
+    """
+    return client_id * num_edges // num_clients
+
+
+def merge_serial_aggregators(target, source) -> None:
+    r"""adds the weighted sums of the entries of a serial aggregator to another one,
+    as if the entries of both were added to the target.
+
+    Args:
+        target (SerialAggregator): aggregator to add to.
+        source (SerialAggregator): aggregator to add.
+    """
+    for key, (value, weight) in source._members.items():
+        if key not in target._members:
+            target._members[key] = (value, weight)
+            continue
+        target_value, target_weight = target._members[key]
+        target._members[key] = (
+            target_value + value,
+            None if weight is None or target_weight is None else target_weight + weight,
+        )
+
+
+def _merge_appendix_aggregators(target, source):
+    for key, (values, weights, steps) in source._members.items():
+        for value, weight, step in zip(values, weights, steps):
+            target.append(key, value, weight, step)
+
+
+class EdgeAggregation(object):
+    r"""aggregates the messages of the clients of a round through edge aggregators.
+    Each edge keeps its own serial and appendix aggregators (and its own copies of
+    the serial aggregators of the server storage) which are summed into the ones of
+    the server once all clients are received. The result is the same as aggregating
+    all messages on the server, up to the order of the floating point additions.
+
+    With more than one edge round, the clients of each round are first trained
+    ``edge_rounds - 1`` times against the models of their edges, after each time the
+    edge averages the ``local_params`` of its clients into its model (as in
+    hierarchical FedAvg). Only the messages of the last edge round reach the server.
+
+    .. note::
+        Edge rounds assume the model is kept under ``cloud_params`` in the server
+        storage, as done by the algorithms of ``fedsim``. What
+        ``receive_from_client`` writes to the server storage on the edges in the last
+        edge round is written back to the server storage once all clients are
+        received (the write of the last edge is kept if several edges write the same
+        entry), while the additions to its serial aggregators are summed. Like the
+        messages, the writes of the intermediate edge rounds stay on the edges.
+
+    Args:
+        num_edges (int): number of edges.
+        edge_rounds (int, optional): rounds the edges run with their clients in each
+            round of the server. Defaults to 1.
+    """
+
+    def __init__(self, num_edges, edge_rounds=1) -> None:
+        if num_edges < 1:
+            raise Exception("number of edges should be positive")
+        if edge_rounds < 1:
+            raise Exception("number of edge rounds should be positive")
+        self.num_edges = num_edges
+        self.edge_rounds = edge_rounds
+        # one thread per edge, so that the messages of each edge are added in order
+        self._pools = None
+        # models of the edges in the current round and the storages made for them
+        self._edge_params = dict()
+        self._client_storages = dict()
+        self.edge_round = 0
+
+    def _get_pools(self):
+        if self._pools is None:
+            self._pools = [
+                ThreadPoolExecutor(max_workers=1) for _ in range(self.num_edges)
+            ]
+        return self._pools
+
+    def start_round(self) -> None:
+        r"""resets the models of the edges to the one of the server."""
+        self._edge_params = dict()
+        self._client_storages = dict()
+        self.edge_round = 0
+
+    def get_storage(self, server_storage, client_id, num_clients):
+        r"""server storage as seen by a client, in which the model is the one of its
+        edge.
+
+        Args:
+            server_storage (Storage): storage of the server.
+            client_id (int): id of the client.
+            num_clients (int): number of clients.
+
+        Returns:
+            Storage: the storage.
+        """
+        edge = edge_of(client_id, num_clients, self.num_edges)
+        if edge not in self._edge_params:
+            return server_storage
+        if edge not in self._client_storages:
+            self._client_storages[edge] = self._make_edge_storage(
+                server_storage, cloud_params=self._edge_params[edge]
+            )
+        return self._client_storages[edge]
+
+    def _make_edge_storage(
+        self, server_storage, cloud_params=None, fresh_aggregators=False
+    ):
+        # entries of the server storage are shared, except optionally for the model
+        # and for its serial aggregators which are made fresh for the edge to sum
+        # its own clients
+        storage = Storage()
+        for key in server_storage.get_all_keys():
+            obj = server_storage.read(key, silent=True)
+            if fresh_aggregators and isinstance(obj, SerialAggregator):
+                obj = SerialAggregator()
+            elif key == "cloud_params" and cloud_params is not None:
+                obj = cloud_params
+            read_p, write_p = server_storage.get_protection_status(key)
+            storage.write(key, obj, read_p, write_p, silent=True)
+        return storage
+
+    @staticmethod
+    def _merge_edge_storage(server_storage, edge_storage) -> None:
+        # sums the serial aggregators of an edge into the ones of the server and
+        # writes back the entries the edge replaced or added
+        for key in edge_storage.get_all_keys():
+            obj = edge_storage.read(key, silent=True)
+            target = server_storage.read(key, silent=True)
+            if isinstance(target, SerialAggregator):
+                if obj is not target and isinstance(obj, SerialAggregator):
+                    merge_serial_aggregators(target, obj)
+                    continue
+            if obj is target:
+                continue
+            read_p, write_p = edge_storage.get_protection_status(key)
+            server_storage.write(key, obj, read_p, write_p, silent=True)
+
+    def _receive(self, algorithm, client_msgs, edge_storages):
+        # adds each message to the aggregators of its edge in the thread of the edge
+        num_clients = algorithm._server_memory.read("num_clients", silent=True)
+        pools = self._get_pools()
+        aggregators = [
+            (SerialAggregator(), AppendixAggregator()) for _ in range(self.num_edges)
+        ]
+
+        def receive(edge, client_msg):
+            serial_aggregator, appendix_aggregator = aggregators[edge]
+            return algorithm._receive_from_client(
+                client_msg,
+                serial_aggregator,
+                appendix_aggregator,
+                server_storage=edge_storages[edge],
+            )
+
+        futures = []
+        active = set()
+        for client_msg in client_msgs:
+            edge = edge_of(client_msg["client_id"], num_clients, self.num_edges)
+            futures.append(pools[edge].submit(receive, edge, client_msg))
+            active.add(edge)
+        success = all([future.result() for future in futures])
+        return success, aggregators, sorted(active)
+
+    def step(self, algorithm, client_msgs) -> bool:
+        r"""runs an intermediate edge round: each edge averages the ``local_params``
+        of its clients into its model.
+
+        Args:
+            algorithm (``CentralFLAlgorithm``): the algorithm.
+            client_msgs (Iterable[Dict[str, Any]]): messages of the clients.
+
+        Returns:
+            bool: False if any client diverged.
+        """
+        server_storage = algorithm._server_memory
+        edge_storages = [
+            self._make_edge_storage(server_storage, fresh_aggregators=True)
+            for _ in range(self.num_edges)
+        ]
+        success, aggregators, active = self._receive(
+            algorithm, client_msgs, edge_storages
+        )
+        for edge in active:
+            serial_aggregator, _ = aggregators[edge]
+            if "local_params" in serial_aggregator:
+                self._edge_params[edge] = serial_aggregator.get("local_params")
+        self._client_storages = dict()
+        self.edge_round += 1
+        return success
+
+    def aggregate(self, algorithm, client_msgs, serial_aggregator, appendix_aggregator):
+        r"""aggregates the messages of the clients of the last edge round by
+        ``receive_from_client`` on their edges and combines the edges into the
+        aggregators of the server.
+
+        Args:
+            algorithm (``CentralFLAlgorithm``): the algorithm.
+            client_msgs (Iterable[Dict[str, Any]]): messages of the clients.
+            serial_aggregator (SerialAggregator): serial aggregator of the round.
+            appendix_aggregator (AppendixAggregator): appendix aggregator of the round.
+
+        Returns:
+            Tuple[bool, Dict[str, float]]: False if any client diverged and the
+                stats of the edges.
+        """
+        server_storage = algorithm._server_memory
+        edge_storages = [
+            self._make_edge_storage(server_storage, fresh_aggregators=True)
+            for _ in range(self.num_edges)
+        ]
+        success, aggregators, active = self._receive(
+            algorithm, client_msgs, edge_storages
+        )
+        backhaul_bytes = 0
+        for edge in active:
+            edge_serial_aggregator, edge_appendix_aggregator = aggregators[edge]
+            backhaul_bytes += message_size(
+                [value for value, _ in edge_serial_aggregator._members.values()]
+            )
+            backhaul_bytes += message_size(
+                [values for values, _, _ in edge_appendix_aggregator._members.values()]
+            )
+            merge_serial_aggregators(serial_aggregator, edge_serial_aggregator)
+            _merge_appendix_aggregators(appendix_aggregator, edge_appendix_aggregator)
+            self._merge_edge_storage(server_storage, edge_storages[edge])
+        stats = {
+            "edge.active": len(active),
+            "edge.backhaul_bytes": backhaul_bytes,
+        }
+        return success, stats
+
+    def close(self) -> None:
+        r"""stops the threads of the edges."""
+        if self._pools is not None:
+            for pool in self._pools:
+                pool.shutdown()
+        self._pools = None
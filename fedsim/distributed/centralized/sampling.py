@@ -0,0 +1,134 @@
+r"""
+Client Sampling
+---------------
+
+Samplers of the clients of a round other than uniform and sequential. Stratified
+sampling draws proportionally from strata of clients with similar data, found once
+by clustering their label histograms and partition sizes. Power of choice trains
+the candidates of the highest local losses.
+"""
+import math
+
+import numpy as np
+
+
+def _squared_distances(features, centers):
+    distances = (
+        (features**2).sum(1)[:, None]
+        - 2 * features @ centers.T
+        + (centers**2).sum(1)[None]
+    )
+    return np.maximum(distances, 0)
+
+
+def _kmeans(features, num_clusters, seed, iterations=50):
+    # k-means with k-means++ initialization, deterministic given the seed
+    rng = np.random.default_rng(seed)
+    num_points = len(features)
+    centers = np.empty((num_clusters, features.shape[1]))
+    centers[0] = features[rng.integers(num_points)]
+    distances = _squared_distances(features, centers[:1])[:, 0]
+    for cluster in range(1, num_clusters):
+        if distances.sum() > 0:
+            point = rng.choice(num_points, p=distances / distances.sum())
+        else:
+            point = rng.integers(num_points)
+        centers[cluster] = features[point]
+        new_distances = _squared_distances(features, centers[cluster : cluster + 1])
+        distances = np.minimum(distances, new_distances[:, 0])
+    labels = None
+    for _ in range(iterations):
+        new_labels = _squared_distances(features, centers).argmin(1)
+        if labels is not None and np.array_equal(labels, new_labels):
+            break
+        labels = new_labels
+        for cluster in range(num_clusters):
+            members = features[labels == cluster]
+            if len(members) > 0:
+                centers[cluster] = members.mean(0)
+    return labels
+
+
+class StratifiedSampler(object):
+    r"""groups the clients into strata by k-means over their label distributions
+    and the (log) sizes of their partitions, and samples each round from every
+    stratum in proportion to its size. Clients of a stratum hold similar data, so
+    the aggregate of a round varies less than under uniform sampling.
+
+    Args:
+        label_histograms (np.ndarray): a (number of clients, number of labels)
+            array of counts, e.g., from ``DataManager.get_label_histograms``.
+        num_strata (int): number of strata.
+        seed (int, optional): seed of the clustering. Defaults to 0.
+    """
+
+    def __init__(self, label_histograms, num_strata, seed=0) -> None:
+        histograms = np.asarray(label_histograms, dtype=np.float64)
+        num_clients = len(histograms)
+        if not 1 <= num_strata <= num_clients:
+            raise Exception(f"invalid number of strata ({num_strata})")
+        sizes = histograms.sum(1)
+        proportions = histograms / np.maximum(sizes, 1)[:, None]
+        log_sizes = np.log1p(sizes)
+        features = np.concatenate(
+            [proportions, (log_sizes / max(log_sizes.max(), 1e-12))[:, None]], axis=1
+        )
+        labels = _kmeans(features, num_strata, seed)
+        self.strata = [
+            np.flatnonzero(labels == stratum).tolist()
+            for stratum in range(num_strata)
+            if (labels == stratum).any()
+        ]
+        self.num_clients = num_clients
+
+    def get_allocation(self, sample_count):
+        r"""number of clients to sample from each stratum, proportional to the
+        sizes of the strata (largest remainders take the rounded off clients).
+
+        Args:
+            sample_count (int): number of clients to sample.
+
+        Returns:
+            List[int]: number of clients of each stratum.
+        """
+        quotas = np.array([len(stratum) for stratum in self.strata], dtype=np.float64)
+        quotas *= sample_count / self.num_clients
+        allocation = np.floor(quotas).astype(np.int64)
+        remainders = quotas - allocation
+        # stable, so that ties go to the first strata
+        order = np.argsort(-remainders, kind="stable")
+        allocation[order[: sample_count - allocation.sum()]] += 1
+        return allocation.tolist()
+
+    def sample(self, sample_count, rng):
+        r"""samples clients without replacement.
+
+        Args:
+            sample_count (int): number of clients to sample.
+            rng (random.Random): random generator to sample with, e.g., the
+                ``random`` module.
+
+        Returns:
+            List[int]: ids of the sampled clients.
+        """
+        clients = []
+        for stratum, count in zip(self.strata, self.get_allocation(sample_count)):
+            clients.extend(rng.sample(stratum, count))
+        return clients
+
+
+def select_highest_losses(candidates, losses, sample_count):
+    r"""power of choice selection: the candidates of the highest losses. Ties keep
+    the order of the candidates and unknown (nan) losses come first.
+
+    Args:
+        candidates (Sequence[int]): ids of the candidate clients.
+        losses (Sequence[float]): last known loss of each candidate.
+        sample_count (int): number of clients to select.
+
+    Returns:
+        List[int]: ids of the selected clients.
+    """
+    keys = [math.inf if math.isnan(loss) else loss for loss in losses]
+    order = sorted(range(len(candidates)), key=lambda index: -keys[index])
+    return [candidates[index] for index in order[:sample_count]]
@@ -0,0 +1,13 @@
+r"""
+Centralized Simulation
+----------------------
+
+Simulation of the system side of centralized FL (e.g., heterogeneous clients) and
+estimation of the cost of a run before it starts.
+"""
+
+from .estimation import estimate_run
+from .system import SystemSimulator
+from .system import message_size
+
+__all__ = ["SystemSimulator", "message_size", "estimate_run"]
@@ -0,0 +1,224 @@
+r"""
+Run Estimation
+--------------
+
+Estimates the time and memory of training a centralized algorithm before it is
+trained ("dry run"), from a few timed steps of local training and inference.
+"""
+import itertools
+import resource
+import time
+
+import torch
+from torch.utils.data import DataLoader
+from torch.utils.flop_counter import FlopCounterMode
+
+from fedsim.local.training import local_inference
+from fedsim.local.training import local_precision
+from fedsim.local.training.step_closures import default_step_closure
+from fedsim.utils import Storage
+from fedsim.utils import fork_rng
+
+from .system import message_size
+
+
+def _object_bytes(obj):
+    # like message_size, counting the state of the optimizers as well
+    if isinstance(obj, torch.optim.Optimizer):
+        return message_size(list(obj.state.values()))
+    if isinstance(obj, torch.nn.Module):
+        return message_size(list(obj.state_dict().values()))
+    return message_size(obj)
+
+
+def _storage_bytes(storage):
+    return sum(
+        _object_bytes(storage.read(key, silent=True))
+        for key in storage.get_all_keys()
+    )
+
+
+def _dataset_bytes(dataset):
+    # size of the samples a dataset keeps in memory, if it tells
+    data = getattr(dataset, "data", None)
+    if torch.is_tensor(data):
+        return data.nelement() * data.element_size()
+    return int(getattr(data, "nbytes", 0))
+
+
+def _cycle(loader):
+    while True:
+        for batch in loader:
+            yield batch
+
+
+def _time_per_batch(fn, batches, num_batches):
+    # the first batch warms up (e.g., allocations), the rest are timed
+    fn(*next(batches))
+    start = time.perf_counter()
+    for x, y in itertools.islice(batches, num_batches):
+        fn(x, y)
+    return (time.perf_counter() - start) / num_batches
+
+
+def _min_log_freq(score_defs):
+    log_freqs = [score_def().log_freq for score_def in score_defs.values()]
+    return min(log_freqs) if len(log_freqs) > 0 else None
+
+
+def estimate_run(algorithm, rounds, num_steps=5, num_eval_batches=3):
+    r"""estimates the time and the memory it takes to train the given algorithm for
+    a number of rounds. A few steps of local training (by
+    ``default_step_closure``) and of inference (by ``local_inference``) are timed
+    and extrapolated by the sizes of the partitions of the data manager, the
+    epochs, the batch sizes, the sample rate and the log frequencies of the hooked
+    scores. The size of the state a client keeps is measured by running one client
+    for a single step against a throwaway storage.
+
+    .. note::
+        The estimates assume one deployment point per round, the clients of a round
+        split evenly over the workers and sampled uniformly. The random generators
+        are left untouched but the algorithm is only meant to be trained or
+        discarded afterwards.
+
+    Args:
+        algorithm (``CentralFLAlgorithm``): the algorithm, with its scores hooked.
+        rounds (int): number of rounds to train.
+        num_steps (int, optional): number of timed steps of local training.
+            Defaults to 5.
+        num_eval_batches (int, optional): number of timed batches of inference.
+            Defaults to 3.
+
+    Returns:
+        Dict[str, float]: the estimates, times in seconds and memory in bytes.
+    """
+    server_storage = algorithm._server_memory
+    data_manager = server_storage.read("data_manager", silent=True)
+    num_clients = server_storage.read("num_clients", silent=True)
+    sample_count = server_storage.read("sample_count", silent=True)
+    workers = server_storage.read("workers", silent=True)
+    global_dataloaders = server_storage.read("global_dataloaders", silent=True)
+    client_memory_budget = algorithm._client_memory.max_bytes
+    epochs = algorithm._local_cfg.read("epochs")
+    batch_size = algorithm._local_cfg.read("batch_size")
+    test_batch_size = algorithm._local_cfg.read("test_batch_size")
+    criterion_def = algorithm._local_cfg.read("criterion_def")
+    local_optimizer_def = algorithm._local_cfg.read("local_optimizer_def")
+    device = algorithm._local_cfg.read("device")
+    precision = algorithm._local_cfg.read("precision")
+    train_split_name = algorithm.get_train_split_name()
+
+    # partition sizes of all clients at once
+    sizes = data_manager.get_label_histograms(train_split_name)[:num_clients].sum(1)
+    mean_steps = float((epochs * torch.tensor(sizes / batch_size).ceil()).mean())
+
+    with fork_rng(0), local_precision(precision):
+        model = algorithm.get_model_def()().to(device)
+        optimizer = local_optimizer_def(model.parameters())
+        criterion = criterion_def()
+        dataset = algorithm._get_local_dataset(int(sizes.argmax()))[train_split_name]
+        batches = _cycle(DataLoader(dataset, batch_size=batch_size, shuffle=True))
+
+        x, _ = next(batches)
+        model.eval()
+        with torch.no_grad(), FlopCounterMode(display=False) as flop_counter:
+            model(x.to(device))
+        model.train()
+        flops_per_sample = flop_counter.get_total_flops() / len(x)
+
+        step_time = _time_per_batch(
+            lambda x, y: default_step_closure(
+                x, y, model, criterion, optimizer, None, device=device
+            ),
+            batches,
+            num_steps,
+        )
+        train_bytes = _object_bytes(model) + _object_bytes(optimizer)
+        # the gradients are set to None after each step, so count the parameters
+        train_bytes += message_size(
+            [param for param in model.parameters() if param.requires_grad]
+        )
+        inference_time = _time_per_batch(
+            lambda x, y: local_inference(model, [(x, y)], dict(), device=device),
+            _cycle(DataLoader(dataset, batch_size=test_batch_size)),
+            num_eval_batches,
+        )
+
+        # server side evaluation of the splits with hooked scores
+        eval_time = 0.0
+        eval_batch_bytes = 0
+        for split_name, loader in global_dataloaders.items():
+            log_freq = _min_log_freq(algorithm._server_scores.get(split_name, {}))
+            if log_freq is None or len(loader) == 0:
+                continue
+            scores = {
+                name: score_def()
+                for name, score_def in algorithm._server_scores[split_name].items()
+            }
+            batch_time = _time_per_batch(
+                lambda x, y: local_inference(model, [(x, y)], scores, device=device),
+                _cycle(loader),
+                num_eval_batches,
+            )
+            eval_time += batch_time * len(loader) / log_freq
+            x, _ = next(iter(loader))
+            eval_batch_bytes = max(eval_batch_bytes, message_size(x))
+
+        # client side evaluation of the other splits with hooked scores
+        client_eval_time = 0.0
+        for split_name, score_defs in algorithm._client_scores.items():
+            log_freq = _min_log_freq(score_defs)
+            if split_name == train_split_name or log_freq is None:
+                continue
+            split_sizes = data_manager.get_label_histograms(split_name)[:num_clients]
+            mean_batches = float(
+                torch.tensor(split_sizes.sum(1) / test_batch_size).ceil().mean()
+            )
+            client_eval_time += mean_batches * inference_time / log_freq
+
+        # state kept by a client, from one client trained for a single step
+        simulator = server_storage.read("system_simulator", silent=True)
+        if simulator is not None and simulator.policy == "truncate":
+            algorithm._scheduled_steps.setdefault(0, 1)
+        task = algorithm._make_client_task(0)
+        task["max_steps"] = 1
+        client_storage = Storage()
+        client_msg = algorithm._run_client_task(task, client_storage)
+
+    client_time = mean_steps * step_time + client_eval_time
+    round_time = sample_count * client_time / max(workers, 1) + eval_time
+    client_state_bytes = _storage_bytes(client_storage)
+    client_storages_bytes = client_state_bytes * num_clients
+    if client_memory_budget is not None:
+        client_storages_bytes = min(client_storages_bytes, client_memory_budget)
+    server_bytes = _storage_bytes(server_storage)
+    datasets_bytes = _dataset_bytes(data_manager.local_data)
+    datasets_bytes += _dataset_bytes(data_manager.global_data)
+    return {
+        "model.parameters": sum(param.numel() for param in model.parameters()),
+        "model.flops_per_sample": flops_per_sample,
+        "time.step": step_time,
+        "time.inference": inference_time,
+        "time.client": client_time,
+        "time.eval": eval_time,
+        "time.round": round_time,
+        "time.total": round_time * rounds,
+        "memory.server": server_bytes,
+        "memory.client_state": client_state_bytes,
+        "memory.client_storages": client_storages_bytes,
+        "memory.message": message_size(client_msg),
+        "memory.datasets": datasets_bytes,
+        "memory.eval_batch": eval_batch_bytes,
+        "memory.train": train_bytes,
+        "memory.peak": server_bytes
+        + client_storages_bytes
+        + datasets_bytes
+        + eval_batch_bytes
+        + max(workers, 1) * (train_bytes + message_size(client_msg)),
+        # resident set size reached so far, in kilobytes on linux
+        "memory.process_peak": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        * 1024,
+        "rounds": rounds,
+        "clients_per_round": sample_count,
+        "mean_steps_per_client": mean_steps,
+    }
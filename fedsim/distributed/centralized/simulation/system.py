@@ -0,0 +1,221 @@
+r"""
+System Simulator
+----------------
+"""
+import numpy as np
+import torch
+from torch import nn
+
+
+def message_size(obj) -> int:
+    r"""number of bytes of the tensors in a message. Modules count as their
+    parameters and containers are searched recursively.
+
+    Args:
+        obj (Any): the message.
+
+    Returns:
+        int: size of the message in bytes.
+    """
+    if torch.is_tensor(obj):
+        return obj.nelement() * obj.element_size()
+    if isinstance(obj, nn.Module):
+        return sum(message_size(param) for param in obj.parameters())
+    if isinstance(obj, dict):
+        return sum(message_size(value) for value in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return sum(message_size(value) for value in obj)
+    return 0
+
+
+class SystemSimulator(object):
+    r"""Discrete-event simulation of heterogeneous clients. Nothing is slept, each
+    client is given a virtual finish time
+
+    .. math::
+        t_i = \frac{b_{down}}{w_i} + \frac{s_i}{v_i} + \frac{b_{up}}{w_i}
+
+    where :math:`s_i` is the number of optimization steps of the client,
+    :math:`v_i` its speed, :math:`w_i` its bandwidth and :math:`b` the size of the
+    messages. A round lasts until its last participant finishes, or until the
+    deadline if some sampled client could not make it. The profiles are numpy
+    tables indexed by client id, so millions of clients are cheap to simulate.
+
+    Args:
+        speed (ArrayLike): compute speed of each client in optimization steps per
+            second.
+        bandwidth (ArrayLike): bandwidth of each client in bytes per second.
+        availability (ArrayLike, optional): probability of each client to be online
+            when it is sampled. Defaults to None which keeps all clients online.
+        deadline (float, optional): deadline of the rounds in seconds. Defaults to
+            None which waits for all the online clients.
+        policy (str, optional): what happens to the clients that would miss the
+            deadline. ``'drop'`` leaves them out of the round and ``'truncate'``
+            stops their local training at the last step that fits before the
+            deadline. Defaults to ``'drop'``.
+        server_time (float, optional): virtual seconds spent on the server side of
+            each round. Defaults to 0.
+        seed (int, optional): seed of the availability draws. Defaults to None.
+    """
+
+    def __init__(
+        self,
+        speed,
+        bandwidth,
+        availability=None,
+        deadline=None,
+        policy="drop",
+        server_time=0.0,
+        seed=None,
+    ) -> None:
+        self.speed = np.asarray(speed, dtype=np.float64)
+        self.bandwidth = np.asarray(bandwidth, dtype=np.float64)
+        if availability is None:
+            availability = np.ones_like(self.speed)
+        self.availability = np.asarray(availability, dtype=np.float64)
+        if not self.speed.shape == self.bandwidth.shape == self.availability.shape:
+            raise Exception("system profiles of the clients have different shapes")
+        if policy not in ("drop", "truncate"):
+            raise Exception(f"unknown deadline policy {policy}")
+        if deadline is not None and deadline <= 0:
+            raise Exception(f"invalid round deadline ({deadline})")
+        self.deadline = deadline
+        self.policy = policy
+        self.server_time = server_time
+        self.rng = np.random.default_rng(seed)
+
+        self.virtual_time = 0.0
+        self.round_times = []
+        self._round = None
+
+    @classmethod
+    def from_lognormal(
+        cls,
+        num_clients,
+        speed=10.0,
+        bandwidth=1e6,
+        sigma=1.0,
+        availability=1.0,
+        seed=None,
+        **kwargs,
+    ):
+        r"""makes the profiles of the clients by scaling the given speed and
+        bandwidth with log-normal factors of median 1.
+
+        Args:
+            num_clients (int): number of clients.
+            speed (float, optional): median speed in steps per second. Defaults to
+                10.
+            bandwidth (float, optional): median bandwidth in bytes per second.
+                Defaults to 1e6.
+            sigma (float, optional): standard deviation of the log of the factors.
+                Defaults to 1.
+            availability (float, optional): probability of the clients to be online.
+                Defaults to 1.
+            seed (int, optional): seed of the profiles and the availability draws.
+                Defaults to None.
+            **kwargs: forwarded to the constructor (e.g., deadline and policy).
+
+        Returns:
+            SystemSimulator: the simulator.
+        """
+        rng = np.random.default_rng(seed)
+        return cls(
+            speed * rng.lognormal(0.0, sigma, num_clients),
+            bandwidth * rng.lognormal(0.0, sigma, num_clients),
+            np.full(num_clients, availability, dtype=np.float64),
+            seed=None if seed is None else seed + 1,
+            **kwargs,
+        )
+
+    def schedule(self, client_ids, num_steps, message_bytes):
+        r"""decides which of the sampled clients take part in the round.
+
+        Args:
+            client_ids (ArrayLike): ids of the sampled clients.
+            num_steps (ArrayLike): expected number of local steps of each client.
+            message_bytes (int): expected size of the messages in each direction.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: ids of the participating clients and the
+                maximum number of steps each of them is allowed to take.
+        """
+        client_ids = np.asarray(client_ids, dtype=np.int64)
+        num_steps = np.asarray(num_steps, dtype=np.int64)
+        online = self.rng.random(len(client_ids)) < self.availability[client_ids]
+        comm_time = 2 * message_bytes / self.bandwidth[client_ids]
+        max_steps = num_steps.copy()
+        if self.deadline is not None:
+            if self.policy == "drop":
+                finish = comm_time + num_steps / self.speed[client_ids]
+                online &= finish <= self.deadline
+            else:
+                budget = np.floor((self.deadline - comm_time) * self.speed[client_ids])
+                max_steps = np.minimum(num_steps, np.maximum(budget, 0)).astype(
+                    np.int64
+                )
+                online &= max_steps > 0
+        self._round = dict(
+            num_sampled=len(client_ids),
+            num_truncated=int(np.sum(online & (max_steps < num_steps))),
+            message_bytes=message_bytes,
+        )
+        return client_ids[online], max_steps[online]
+
+    def end_round(self, client_ids, num_steps, up_bytes):
+        r"""advances the virtual clock by the duration of the current round.
+
+        Args:
+            client_ids (ArrayLike): ids of the clients that took part in the round.
+            num_steps (ArrayLike): number of local steps each of them took.
+            up_bytes (ArrayLike): size of the message each of them sent back.
+
+        Returns:
+            Dict[str, float]: statistics of the round to report.
+        """
+        client_ids = np.asarray(client_ids, dtype=np.int64)
+        bandwidth = self.bandwidth[client_ids]
+        finish = (
+            self._round["message_bytes"] / bandwidth
+            + np.asarray(num_steps, dtype=np.float64) / self.speed[client_ids]
+            + np.asarray(up_bytes, dtype=np.float64) / bandwidth
+        )
+        duration = float(finish.max()) if len(finish) > 0 else 0.0
+        num_missing = self._round["num_sampled"] - len(client_ids)
+        if self.deadline is not None and num_missing > 0:
+            # the server waits until the deadline for the clients that never answer
+            duration = max(duration, self.deadline)
+        self.virtual_time += duration + self.server_time
+        self.round_times.append(self.virtual_time)
+        stats = {
+            "system.virtual_time": self.virtual_time,
+            "system.round_time": duration,
+            "system.participants": len(client_ids),
+            "system.dropped": num_missing,
+            "system.truncated": self._round["num_truncated"],
+        }
+        self._round = None
+        return stats
+
+    def state_dict(self):
+        r"""state of the simulation, i.e., the virtual clock and the availability
+        draws. The profiles of the clients are not included.
+
+        Returns:
+            Dict[str, Any]: the state.
+        """
+        return dict(
+            rng=self.rng.bit_generator.state,
+            virtual_time=self.virtual_time,
+            round_times=list(self.round_times),
+        )
+
+    def load_state_dict(self, state_dict) -> None:
+        r"""loads the state of the simulation, inverse of ``state_dict``.
+
+        Args:
+            state_dict (Dict[str, Any]): the state.
+        """
+        self.rng.bit_generator.state = state_dict["rng"]
+        self.virtual_time = state_dict["virtual_time"]
+        self.round_times = list(state_dict["round_times"])
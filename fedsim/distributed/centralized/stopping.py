@@ -0,0 +1,161 @@
+r"""
+Early Stopping
+--------------
+"""
+import math
+import time
+
+
+class EarlyStopping(object):
+    r"""stops the training of a centralized algorithm before the given number of
+    rounds once a reported metric reaches a target, once the metric does not improve
+    in a number of reports, or once a wall-clock time budget is spent. The rules are
+    checked at the end of each round (after ``at_round_end``) against the reports
+    collected so far.
+
+    .. note::
+        The metric is looked up in the reports of the rounds by its full name, e.g.,
+        ``server.avg.test.accuracy``. Rounds that do not report the metric (see
+        ``log_freq`` of the scores) do not count towards the patience.
+
+    Args:
+        metric (str, optional): name of the reported metric to watch. Defaults to
+            None which only checks the time budget.
+        target (float, optional): stops once the metric reaches this value.
+            Defaults to None.
+        mode (str, optional): ``'max'`` if higher values of the metric are better,
+            ``'min'`` otherwise. Defaults to ``'max'``.
+        patience (int, optional): stops once this many reports of the metric in a
+            row do not improve on the best one. Defaults to None.
+        min_delta (float, optional): minimum change of the metric that counts as an
+            improvement. Defaults to 0.
+        time_budget (float, optional): stops once this many seconds of wall-clock
+            time are spent in a call to ``train``. Defaults to None.
+    """
+
+    def __init__(
+        self,
+        metric=None,
+        target=None,
+        mode="max",
+        patience=None,
+        min_delta=0.0,
+        time_budget=None,
+    ) -> None:
+        if mode not in ("max", "min"):
+            raise Exception(f"invalid mode ({mode})")
+        if metric is None and (target is not None or patience is not None):
+            raise Exception("a metric is needed to check a target or patience")
+        if patience is not None and patience < 1:
+            raise Exception(f"invalid patience ({patience})")
+        if target is None and patience is None and time_budget is None:
+            raise Exception("no stopping rule is given")
+        self.metric = metric
+        self.target = target
+        self.mode = mode
+        self.patience = patience
+        self.min_delta = min_delta
+        self.time_budget = time_budget
+
+        self._start_time = None
+        self._last = None
+        self._best = None
+        self._num_bad_reports = 0
+        self.stop_round = None
+        self.reason = None
+
+    def _improves(self, value, reference):
+        if self.mode == "max":
+            return value > reference + self.min_delta
+        return value < reference - self.min_delta
+
+    def _reaches(self, value, target):
+        if self.mode == "max":
+            return value >= target
+        return value <= target
+
+    def start(self) -> None:
+        r"""starts the clock of the time budget, called at the start of training."""
+        self._start_time = time.monotonic()
+        self.stop_round = None
+        self.reason = None
+
+    def get_elapsed_time(self) -> float:
+        r"""seconds passed since ``start``.
+
+        Returns:
+            float: the elapsed time.
+        """
+        if self._start_time is None:
+            return 0.0
+        return time.monotonic() - self._start_time
+
+    def update(self, report) -> None:
+        r"""takes a report of a round into account.
+
+        Args:
+            report (Dict[str, Any]): the report.
+        """
+        if self.metric is None or self.metric not in report:
+            return
+        value = float(report[self.metric])
+        if math.isnan(value):
+            self._num_bad_reports += 1
+            return
+        self._last = value
+        if self._best is None or self._improves(value, self._best):
+            self._best = value
+            self._num_bad_reports = 0
+        else:
+            self._num_bad_reports += 1
+
+    def check(self, rounds):
+        r"""checks the stopping rules at the end of a round.
+
+        Args:
+            rounds (int): the round.
+
+        Returns:
+            Optional[str]: the reason to stop or None to continue.
+        """
+        reason = None
+        if (
+            self.target is not None
+            and self._last is not None
+            and self._reaches(self._last, self.target)
+        ):
+            reason = f"{self.metric} reached {self.target}"
+        elif self.patience is not None and self._num_bad_reports >= self.patience:
+            reason = f"{self.metric} did not improve in {self.patience} reports"
+        elif (
+            self.time_budget is not None
+            and self.get_elapsed_time() >= self.time_budget
+        ):
+            reason = f"time budget of {self.time_budget} seconds is spent"
+        if reason is not None:
+            self.stop_round = rounds
+            self.reason = reason
+        return reason
+
+    def state_dict(self):
+        r"""state of the rules over the reports seen so far. The clock of the time
+        budget is not included.
+
+        Returns:
+            Dict[str, Any]: the state.
+        """
+        return dict(
+            last=self._last,
+            best=self._best,
+            num_bad_reports=self._num_bad_reports,
+        )
+
+    def load_state_dict(self, state_dict) -> None:
+        r"""loads the state of the rules, inverse of ``state_dict``.
+
+        Args:
+            state_dict (Dict[str, Any]): the state.
+        """
+        self._last = state_dict["last"]
+        self._best = state_dict["best"]
+        self._num_bad_reports = state_dict["num_bad_reports"]
@@ -2,13 +2,11 @@ r"""
 AdaBest
 -------
 """
-from functools import partial
-
 import torch
 
-from fedsim.local.training.step_closures import default_step_closure
+from fedsim.local.training import GradientAnchor
+from fedsim.local.training import anchored
 from fedsim.utils import SerialAggregator
-from fedsim.utils import vector_to_parameters_like
 from fedsim.utils import vectorize_module
 
 from .fedavg import FedAvg
@@ -25,8 +23,8 @@ class AdaBest(FedAvg):
         data_manager (``distributed.data_management.DataManager``): data manager
         metric_logger (``logall.Logger``): metric logger for tracking.
         num_clients (int): number of clients
-        sample_scheme (``str``): mode of sampling clients. Options are ``'uniform'``
-            and ``'sequential'``
+        sample_scheme (``str``): mode of sampling clients. Options are ``'uniform'``,
+            ``'sequential'``, ``'stratified'`` and ``'power_of_choice'``
         sample_rate (``float``): rate of sampling clients
         model_def (``torch.Module``): definition of for constructing the model
         epochs (``int``): number of local epochs
@@ -45,6 +43,11 @@ class AdaBest(FedAvg):
         mu (float): AdaBest's :math:`\mu` hyper-parameter for local regularization
         beta (float): AdaBest's :math:`\beta` hyper-parameter for global regularization
 
+    .. note::
+        The options of the simulation engine (e.g., ``workers``, ``seed`` and
+        ``distributed``) are taken by all algorithms and documented on
+        ``CentralFLAlgorithm``.
+
     .. note::
         definition of
             * learning rate schedulers, could be any of the ones defined at
@@ -103,35 +106,28 @@ class AdaBest(FedAvg):
         h = storage.read("h")
         mu_adaptive = mu / len(datasets[train_split_name]) * average_sample * epochs
 
-        def transform_grads_fn(model):
-            if h is not None:
-                grad_additive = -h
-                grad_additive_list = vector_to_parameters_like(
-                    mu_adaptive * grad_additive, model.parameters()
-                )
-                for p, g_a in zip(model.parameters(), grad_additive_list):
-                    p.grad += g_a
-
-        step_closure_ = partial(
-            default_step_closure, transform_grads=transform_grads_fn
-        )
-        opt_res = FedAvg.send_to_server(
-            id,
-            rounds,
-            storage,
-            datasets,
-            train_split_name,
-            scores,
-            epochs,
-            criterion,
-            train_batch_size,
-            inference_batch_size,
-            optimizer_def,
-            lr_scheduler_def,
-            device,
-            ctx,
-            step_closure=step_closure_,
-        )
+        # grad -= mu * h
+        anchor = None
+        if h is not None:
+            anchor = GradientAnchor(params_init, bias=h, bias_coef=-mu_adaptive)
+        with anchored(anchor):
+            opt_res = FedAvg.send_to_server(
+                id,
+                rounds,
+                storage,
+                datasets,
+                train_split_name,
+                scores,
+                epochs,
+                criterion,
+                train_batch_size,
+                inference_batch_size,
+                optimizer_def,
+                lr_scheduler_def,
+                device,
+                ctx,
+                step_closure=step_closure,
+            )
 
         # update local h
         pseudo_grads = params_init - vectorize_module(model, clone=True, detach=True)
@@ -141,7 +137,9 @@ class AdaBest(FedAvg):
         else:
             if last_round is None:
                 last_round = rounds - 1
-            new_h = 1 / (rounds - last_round) * h + pseudo_grads
+            # a client trained again in the same round (e.g., by edge rounds) does
+            # not decay its h
+            new_h = 1 / max(rounds - last_round, 1) * h + pseudo_grads
 
         storage.write("h", new_h)
         storage.write("last_round", rounds)
@@ -4,12 +4,17 @@ FedAvg
 """
 import math
 
+import torch
 from torch.utils.data import DataLoader
 from torch.utils.data import RandomSampler
 
+from fedsim.local.training import OptimizerPool
 from fedsim.local.training import local_inference
 from fedsim.local.training import local_train
+from fedsim.local.training import stacked_local_train
+from fedsim.local.training.stacked_training import stack_module_parameters
 from fedsim.local.training.step_closures import default_step_closure
+from fedsim.utils import copy_vector_to_module
 from fedsim.utils import initialize_module
 from fedsim.utils import vectorize_module
 
@@ -18,6 +23,57 @@ from .utils import serial_aggregation
 
 # from ._shared_docs import doc_args, doc_arc, doc_note
 
+# local optimizers of the models the clients of this process train
+_optimizer_pool = OptimizerPool()
+
+
+def _make_train_loader(dataset, train_batch_size):
+    # draw from the default generator itself, so that the stream the client is run in
+    # (e.g., by fork_rng or forked_iter) decides both its batches and augmentations
+    generator = torch.default_generator
+    # create a random sampler with replacement so that
+    # stochasticity is maximiazed and privacy is not compromized
+    sampler = RandomSampler(
+        dataset,
+        replacement=True,
+        num_samples=math.ceil(len(dataset) / train_batch_size) * train_batch_size,
+        generator=generator,
+    )
+    # # create train data loader
+    return DataLoader(
+        dataset, batch_size=train_batch_size, sampler=sampler, generator=generator
+    )
+
+
+def _evaluate_other_splits(
+    model,
+    datasets,
+    train_split_name,
+    scores,
+    inference_batch_size,
+    device,
+    metrics_dict,
+    num_samples_dict,
+):
+    for split_name, split in datasets.items():
+        if split_name != train_split_name and split_name in scores:
+            o_scores = scores[split_name]
+            split_loader = DataLoader(
+                split,
+                batch_size=inference_batch_size,
+                shuffle=False,
+            )
+            num_samples = local_inference(
+                model,
+                split_loader,
+                scores=o_scores,
+                device=device,
+            )
+            metrics_dict[split_name] = {
+                name: score.get_score() for name, score in o_scores.items()
+            }
+            num_samples_dict[split_name] = num_samples
+
 
 class FedAvg(CentralFLAlgorithm):
     r"""
@@ -29,8 +85,8 @@ class FedAvg(CentralFLAlgorithm):
         data_manager (``distributed.data_management.DataManager``): data manager
         metric_logger (``logall.Logger``): metric logger for tracking.
         num_clients (int): number of clients
-        sample_scheme (``str``): mode of sampling clients. Options are ``'uniform'``
-            and ``'sequential'``
+        sample_scheme (``str``): mode of sampling clients. Options are ``'uniform'``,
+            ``'sequential'``, ``'stratified'`` and ``'power_of_choice'``
         sample_rate (``float``): rate of sampling clients
         model_def (``torch.Module``): definition of for constructing the model
         epochs (``int``): number of local epochs
@@ -47,6 +103,11 @@ class FedAvg(CentralFLAlgorithm):
         test_batch_size (int): inference time batch size
         device (str): cpu, cuda, or gpu number
 
+    .. note::
+        The options of the simulation engine (e.g., ``workers``, ``seed`` and
+        ``distributed``) are taken by all algorithms and documented on
+        ``CentralFLAlgorithm``.
+
     .. note::
         definition of
             * learning rate schedulers, could be any of the ones defined at
@@ -80,7 +141,7 @@ class FedAvg(CentralFLAlgorithm):
         cloud_params = server_storage.read("cloud_params")
         model = server_storage.read("model")
         # copy cloud params to cloud model to send to the client
-        initialize_module(model, cloud_params, clone=True, detach=True)
+        copy_vector_to_module(model, cloud_params)
         # return a copy of the cloud model
         return dict(model=model)
 
@@ -102,21 +163,10 @@ class FedAvg(CentralFLAlgorithm):
         ctx=None,
         step_closure=None,
     ):
-        # create a random sampler with replacement so that
-        # stochasticity is maximiazed and privacy is not compromized
-        sampler = RandomSampler(
-            datasets[train_split_name],
-            replacement=True,
-            num_samples=math.ceil(len(datasets[train_split_name]) / train_batch_size)
-            * train_batch_size,
-        )
-        # # create train data loader
-        train_loader = DataLoader(
-            datasets[train_split_name], batch_size=train_batch_size, sampler=sampler
-        )
+        train_loader = _make_train_loader(datasets[train_split_name], train_batch_size)
 
         model = ctx["model"]
-        optimizer = optimizer_def(model.parameters())
+        optimizer = _optimizer_pool.get(model, optimizer_def)
 
         if lr_scheduler_def is not None:
             lr_scheduler = lr_scheduler_def(optimizer=optimizer)
@@ -151,24 +201,16 @@ class FedAvg(CentralFLAlgorithm):
             metrics_dict[train_split_name][criterion.get_name()] = criterion.get_score()
         num_samples_dict = {train_split_name: num_train_samples}
         # other splits
-        for split_name, split in datasets.items():
-            if split_name != train_split_name and split_name in scores:
-                o_scores = scores[split_name]
-                split_loader = DataLoader(
-                    split,
-                    batch_size=inference_batch_size,
-                    shuffle=False,
-                )
-                num_samples = local_inference(
-                    model,
-                    split_loader,
-                    scores=o_scores,
-                    device=device,
-                )
-                metrics_dict[split_name] = {
-                    name: score.get_score() for name, score in o_scores.items()
-                }
-                num_samples_dict[split_name] = num_samples
+        _evaluate_other_splits(
+            model,
+            datasets,
+            train_split_name,
+            scores,
+            inference_batch_size,
+            device,
+            metrics_dict,
+            num_samples_dict,
+        )
         # return optimized model parameters and number of train samples
         return dict(
             local_params=vectorize_module(model),
@@ -178,6 +220,87 @@ class FedAvg(CentralFLAlgorithm):
             metrics=metrics_dict,
         )
 
+    def send_to_server_stacked(
+        ids,
+        rounds,
+        storages,
+        datasets,
+        train_split_name,
+        scores,
+        epochs,
+        criteria,
+        train_batch_size,
+        inference_batch_size,
+        optimizer_def,
+        lr_scheduler_def=None,
+        device="cuda",
+        ctxs=None,
+        seeds=None,
+    ):
+        models = [ctx["model"] for ctx in ctxs]
+        # all clients share the architecture, one of them serves as the template
+        model = models[0]
+        params = stack_module_parameters(models, device)
+        train_loaders = [
+            _make_train_loader(client_datasets[train_split_name], train_batch_size)
+            for client_datasets in datasets
+        ]
+        train_scores = [
+            client_scores.get(train_split_name, dict()) for client_scores in scores
+        ]
+        params, num_train_samples, num_steps, diverged = stacked_local_train(
+            model,
+            params,
+            train_loaders,
+            epochs,
+            criteria,
+            optimizer_def,
+            lr_scheduler_def,
+            device,
+            scores=train_scores,
+            seeds=seeds,
+        )
+        client_msgs = []
+        for i in range(len(ids)):
+            metrics_dict = {
+                train_split_name: {
+                    name: score.get_score() for name, score in train_scores[i].items()
+                }
+            }
+            if rounds % criteria[i].log_freq == 0:
+                metrics_dict[train_split_name][
+                    criteria[i].get_name()
+                ] = criteria[i].get_score()
+            num_samples_dict = {train_split_name: num_train_samples[i]}
+            local_params = torch.cat(
+                [params[name][i].reshape(-1) for name, _ in model.named_parameters()]
+            )
+            if any(
+                split_name != train_split_name and split_name in scores[i]
+                for split_name in datasets[i]
+            ):
+                initialize_module(model, local_params, clone=True, detach=True)
+                _evaluate_other_splits(
+                    model,
+                    datasets[i],
+                    train_split_name,
+                    scores[i],
+                    inference_batch_size,
+                    device,
+                    metrics_dict,
+                    num_samples_dict,
+                )
+            client_msgs.append(
+                dict(
+                    local_params=local_params,
+                    num_steps=num_steps[i],
+                    diverged=diverged[i],
+                    num_samples=num_samples_dict,
+                    metrics=metrics_dict,
+                )
+            )
+        return client_msgs
+
     def receive_from_client(
         server_storage,
         client_id,
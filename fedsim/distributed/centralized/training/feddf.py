@@ -25,8 +25,8 @@ class FedDF(FedAvg):
         data_manager (``distributed.data_management.DataManager``): data manager
         metric_logger (``logall.Logger``): metric logger for tracking.
         num_clients (int): number of clients
-        sample_scheme (``str``): mode of sampling clients. Options are ``'uniform'``
-            and ``'sequential'``
+        sample_scheme (``str``): mode of sampling clients. Options are ``'uniform'``,
+            ``'sequential'``, ``'stratified'`` and ``'power_of_choice'``
         sample_rate (``float``): rate of sampling clients
         model_def (``torch.Module``): definition of for constructing the model
         epochs (``int``): number of local epochs
@@ -45,6 +45,11 @@ class FedDF(FedAvg):
         global_train_split (str): the name of train split to be used on server
         global_epochs (int): number of training epochs on the server
 
+    .. note::
+        The options of the simulation engine (e.g., ``workers``, ``seed`` and
+        ``distributed``) are taken by all algorithms and documented on
+        ``CentralFLAlgorithm``.
+
     .. note::
         definition of
             * learning rate schedulers, could be any of the ones defined at
@@ -2,12 +2,10 @@ r"""
 FedDyn
 -------
 """
-from functools import partial
-
 import torch
 
-from fedsim.local.training.step_closures import default_step_closure
-from fedsim.utils import vector_to_parameters_like
+from fedsim.local.training import GradientAnchor
+from fedsim.local.training import anchored
 from fedsim.utils import vectorize_module
 
 from .fedavg import FedAvg
@@ -24,8 +22,8 @@ class FedDyn(FedAvg):
         data_manager (``distributed.data_management.DataManager``): data manager
         metric_logger (``logall.Logger``): metric logger for tracking.
         num_clients (int): number of clients
-        sample_scheme (``str``): mode of sampling clients. Options are ``'uniform'``
-            and ``'sequential'``
+        sample_scheme (``str``): mode of sampling clients. Options are ``'uniform'``,
+            ``'sequential'``, ``'stratified'`` and ``'power_of_choice'``
         sample_rate (``float``): rate of sampling clients
         model_def (``torch.Module``): definition of for constructing the model
         epochs (``int``): number of local epochs
@@ -43,6 +41,11 @@ class FedDyn(FedAvg):
         device (str): cpu, cuda, or gpu number
         alpha (float): FedDyn's :math:`\alpha` hyper-parameter for local regularization
 
+    .. note::
+        The options of the simulation engine (e.g., ``workers``, ``seed`` and
+        ``distributed``) are taken by all algorithms and documented on
+        ``CentralFLAlgorithm``.
+
     .. note::
         definition of
             * learning rate schedulers, could be any of the ones defined at
@@ -109,38 +112,31 @@ class FedDyn(FedAvg):
 
         alpha_adaptive = alpha / len(datasets[train_split_name]) * average_sample
 
-        def transform_grads_fn(model):
-            params = vectorize_module(model)
-            grad_additive = 0.5 * (params - params_init)
-            if h is not None:
-                grad_additive -= h
-            grad_additive_list = vector_to_parameters_like(
-                alpha_adaptive * grad_additive, model.parameters()
-            )
-
-            for p, g_a in zip(model.parameters(), grad_additive_list):
-                p.grad += g_a
-
-        step_closure_ = partial(
-            default_step_closure, transform_grads=transform_grads_fn
-        )
-        opt_res = FedAvg.send_to_server(
-            id,
-            rounds,
-            storage,
-            datasets,
-            train_split_name,
-            metrics,
-            epochs,
-            criterion,
-            train_batch_size,
-            inference_batch_size,
-            optimizer_def,
-            lr_scheduler_def,
-            device,
-            ctx,
-            step_closure=step_closure_,
+        # grad += alpha * (0.5 * (params - params_init) - h)
+        anchor = GradientAnchor(
+            params_init,
+            anchor_coef=0.5 * alpha_adaptive,
+            bias=h,
+            bias_coef=-alpha_adaptive,
         )
+        with anchored(anchor):
+            opt_res = FedAvg.send_to_server(
+                id,
+                rounds,
+                storage,
+                datasets,
+                train_split_name,
+                metrics,
+                epochs,
+                criterion,
+                train_batch_size,
+                inference_batch_size,
+                optimizer_def,
+                lr_scheduler_def,
+                device,
+                ctx,
+                step_closure=step_closure,
+            )
 
         # update local h
         pseudo_grads = params_init - vectorize_module(model, clone=True, detach=True)
@@ -16,8 +16,8 @@ class FedNova(FedAvg):
         data_manager (``distributed.data_management.DataManager``): data manager
         metric_logger (``logall.Logger``): metric logger for tracking.
         num_clients (int): number of clients
-        sample_scheme (``str``): mode of sampling clients. Options are ``'uniform'``
-            and ``'sequential'``
+        sample_scheme (``str``): mode of sampling clients. Options are ``'uniform'``,
+            ``'sequential'``, ``'stratified'`` and ``'power_of_choice'``
         sample_rate (``float``): rate of sampling clients
         model_def (``torch.Module``): definition of for constructing the model
         epochs (``int``): number of local epochs
@@ -34,6 +34,11 @@ class FedNova(FedAvg):
         test_batch_size (int): inference time batch size
         device (str): cpu, cuda, or gpu number
 
+    .. note::
+        The options of the simulation engine (e.g., ``workers``, ``seed`` and
+        ``distributed``) are taken by all algorithms and documented on
+        ``CentralFLAlgorithm``.
+
     .. note::
         definition of
             * learning rate schedulers, could be any of the ones defined at
@@ -2,12 +2,8 @@ r"""
 FedProx
 -------
 """
-from functools import partial
-
-from torch.nn.utils import parameters_to_vector
-
-from fedsim.local.training.step_closures import default_step_closure
-from fedsim.utils import vector_to_parameters_like
+from fedsim.local.training import GradientAnchor
+from fedsim.local.training import anchored
 from fedsim.utils import vectorize_module
 
 from .fedavg import FedAvg
@@ -23,8 +19,8 @@ class FedProx(FedAvg):
         data_manager (``distributed.data_management.DataManager``): data manager
         metric_logger (``logall.Logger``): metric logger for tracking.
         num_clients (int): number of clients
-        sample_scheme (``str``): mode of sampling clients. Options are ``'uniform'``
-            and ``'sequential'``
+        sample_scheme (``str``): mode of sampling clients. Options are ``'uniform'``,
+            ``'sequential'``, ``'stratified'`` and ``'power_of_choice'``
         sample_rate (``float``): rate of sampling clients
         model_def (``torch.Module``): definition of for constructing the model
         epochs (``int``): number of local epochs
@@ -42,6 +38,11 @@ class FedProx(FedAvg):
         device (str): cpu, cuda, or gpu number
         mu (float): FedProx's :math:`\mu` hyper-parameter for local regularization
 
+    .. note::
+        The options of the simulation engine (e.g., ``workers``, ``seed`` and
+        ``distributed``) are taken by all algorithms and documented on
+        ``CentralFLAlgorithm``.
+
     .. note::
         definition of
             * learning rate schedulers, could be any of the ones defined at
@@ -86,33 +87,23 @@ class FedProx(FedAvg):
         mu = ctx["mu"]
         params_init = vectorize_module(model, clone=True, detach=True)
 
-        def transform_grads_fn(model):
-            params = parameters_to_vector(model.parameters())
-            grad_additive = 0.5 * (params - params_init)
-            grad_additive_list = vector_to_parameters_like(
-                mu * grad_additive, model.parameters()
+        # grad += mu * 0.5 * (params - params_init)
+        anchor = GradientAnchor(params_init, anchor_coef=0.5 * mu)
+        with anchored(anchor):
+            return FedAvg.send_to_server(
+                id,
+                rounds,
+                storage,
+                datasets,
+                train_split_name,
+                scores,
+                epochs,
+                criterion,
+                train_batch_size,
+                inference_batch_size,
+                optimizer_def,
+                lr_scheduler_def,
+                device,
+                ctx,
+                step_closure=step_closure,
             )
-
-            for p, g_a in zip(model.parameters(), grad_additive_list):
-                p.grad += g_a
-
-        step_closure_ = partial(
-            default_step_closure, transform_grads=transform_grads_fn
-        )
-        return FedAvg.send_to_server(
-            id,
-            rounds,
-            storage,
-            datasets,
-            train_split_name,
-            scores,
-            epochs,
-            criterion,
-            train_batch_size,
-            inference_batch_size,
-            optimizer_def,
-            lr_scheduler_def,
-            device,
-            ctx,
-            step_closure=step_closure_,
-        )
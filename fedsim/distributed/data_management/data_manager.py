@@ -170,6 +170,31 @@ class DataManager(object):
             ids=range(len(self._local_parition_indices["train"]))
         )
 
+    def get_label_histograms(self, split_name: str = "train") -> np.ndarray:
+        """returns the number of samples of each label in each partition of a local
+        split, counted at once over the partition indices.
+
+        Args:
+            split_name (str, optional): name of the local split. Defaults to
+                ``'train'``.
+
+        Returns:
+            np.ndarray: a (number of partitions, number of labels) array of counts
+        """
+        partitions = self._local_parition_indices[split_name]
+        targets = np.asarray(self.local_data.targets)
+        sizes = np.array([len(indices) for indices in partitions], dtype=np.int64)
+        indices = np.concatenate(
+            [np.asarray(indices, dtype=np.int64) for indices in partitions]
+        )
+        partition_ids = np.repeat(np.arange(len(partitions)), sizes)
+        num_labels = int(targets.max()) + 1
+        histograms = np.bincount(
+            partition_ids * num_labels + targets[indices],
+            minlength=len(partitions) * num_labels,
+        )
+        return histograms.reshape(len(partitions), num_labels)
+
     def get_global_dataset(self) -> Dict[str, Dataset]:
         """returns the global dataset
 
@@ -5,8 +5,26 @@ Local Training and Inference
 Provides the basic definitions for local trainign and inference.
 """
 
+from .anchor import GradientAnchor
+from .compilation import compile_module
 from .inference import local_inference
+from .optimizer_pool import OptimizerPool
+from .precision import local_precision
+from .stacked_training import stacked_local_train
 from .step_closures import default_step_closure
+from .training import anchored
+from .training import limit_steps
 from .training import local_train
 
-__all__ = ["local_train", "local_inference", "default_step_closure"]
+__all__ = [
+    "local_train",
+    "local_inference",
+    "default_step_closure",
+    "stacked_local_train",
+    "limit_steps",
+    "anchored",
+    "GradientAnchor",
+    "compile_module",
+    "local_precision",
+    "OptimizerPool",
+]
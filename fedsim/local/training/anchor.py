@@ -0,0 +1,84 @@
+r"""
+Anchored Optimization
+---------------------
+
+Corrections of the local gradients toward an anchor (e.g., the parameters a
+client starts from) applied inside the step of any local optimizer.
+"""
+import torch
+
+from fedsim.utils import vector_to_parameters_like
+
+
+class GradientAnchor(object):
+    r"""adds ``anchor_coef * (param - anchor) + bias_coef * bias`` to the gradients
+    of the parameters of an optimizer right before each of its steps, e.g., the
+    proximal term of FedProx or the dynamic regularizer of FedDyn. The constant
+    part is computed once when the anchor is attached and split into views of the
+    parameters, so a step only takes two multi-tensor (``torch._foreach_*``) ops
+    and no vector of all parameters is made.
+
+    .. note::
+        The correction is applied to the gradients after ``default_step_closure``
+        clips them. Parameters without a gradient are left out.
+
+    Args:
+        anchor (Tensor): 1-D vector of the anchor parameters.
+        anchor_coef (float, optional): coefficient of the distance to the anchor.
+            Defaults to 0.0.
+        bias (Tensor, optional): 1-D vector added to the gradients. Defaults to
+            None.
+        bias_coef (float, optional): coefficient of the bias. Defaults to 0.0.
+    """
+
+    def __init__(self, anchor, anchor_coef=0.0, bias=None, bias_coef=0.0) -> None:
+        self.anchor = anchor
+        self.anchor_coef = anchor_coef
+        self.bias = bias
+        self.bias_coef = bias_coef
+
+    def _get_constant(self):
+        constant = self.anchor * -self.anchor_coef
+        if self.bias is not None:
+            constant.add_(self.bias, alpha=self.bias_coef)
+        return constant
+
+    def attach(self, optimizer):
+        r"""corrects the gradients of the optimizer before each of its steps until
+        the returned handle is removed.
+
+        Args:
+            optimizer (Optimizer): the local optimizer.
+
+        Returns:
+            torch.utils.hooks.RemovableHandle: handle to detach the anchor by its
+                ``remove`` method.
+        """
+        params = [
+            param for group in optimizer.param_groups for param in group["params"]
+        ]
+        if sum(param.numel() for param in params) != len(self.anchor):
+            raise Exception("anchor does not match the parameters of the optimizer")
+        constants = vector_to_parameters_like(
+            self._get_constant().to(params[0].device), params
+        )
+        anchor_coef = self.anchor_coef
+
+        @torch.no_grad()
+        def correct_grads(optimizer, args, kwargs):
+            grads = [param.grad for param in params]
+            if any(grad is None for grad in grads):
+                indices = [i for i, grad in enumerate(grads) if grad is not None]
+                grads = [grads[i] for i in indices]
+                step_params = [params[i] for i in indices]
+                step_constants = [constants[i] for i in indices]
+            else:
+                step_params = params
+                step_constants = constants
+            if len(grads) == 0:
+                return
+            if anchor_coef != 0:
+                torch._foreach_add_(grads, step_params, alpha=anchor_coef)
+            torch._foreach_add_(grads, step_constants)
+
+        return optimizer.register_step_pre_hook(correct_grads)
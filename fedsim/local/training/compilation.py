@@ -0,0 +1,52 @@
+r"""
+Compilation
+-----------
+
+Compiles models for local training and inference with ``torch.compile``.
+"""
+import warnings
+
+
+def compile_module(module, **compile_kwargs):
+    r"""compiles the calls of a module in place by ``torch.compile``. The forward
+    and the backward passes are compiled the first time the module is called with
+    new input shapes or modes (train/eval) and reused for all the later calls, so
+    a module that is reused from client to client is compiled once. Compiled
+    artifacts are cached on disk (by the FX graph and the AOT autograd caches of
+    inductor) and reused by the next runs.
+
+    .. note::
+        If compiling fails, a warning is given and the module runs eagerly from
+        then on. Step closures and scores around the module are not compiled,
+        so any of them is supported.
+
+    Args:
+        module (Module): module to compile.
+        **compile_kwargs: forwarded to ``torch.compile``.
+
+    Returns:
+        Module: the same module.
+    """
+    # imported here, since they take a while and are only needed to compile
+    import torch._dynamo
+    import torch._functorch.config
+    import torch._inductor.config
+
+    torch._inductor.config.fx_graph_cache = True
+    torch._functorch.config.enable_autograd_cache = True
+    compiled_call = torch.compile(module._call_impl, **compile_kwargs)
+
+    def call(*args, **kwargs):
+        try:
+            return compiled_call(*args, **kwargs)
+        except torch._dynamo.exc.TorchDynamoException as e:
+            warnings.warn(
+                f"compiling {module.__class__.__name__} failed, running it "
+                f"eagerly: {e}",
+                RuntimeWarning,
+            )
+            module._compiled_call_impl = None
+            return module._call_impl(*args, **kwargs)
+
+    module._compiled_call_impl = call
+    return module
@@ -7,6 +7,9 @@ Inference for local client
 
 import torch
 
+from .precision import autocast_forward
+from .precision import to_full_precision
+
 
 def local_inference(
     model,
@@ -41,7 +44,9 @@ def local_inference(
             y = y.reshape(-1).long()
             y = y.to(device)
             X = X.to(device)
-            outputs = model(X)
+            with autocast_forward(device):
+                outputs = model(X)
+            outputs = to_full_precision(outputs)
             num_samples += len(y)
             for score in scores.values():
                 score(outputs, y)
@@ -0,0 +1,74 @@
+r"""
+Optimizer Pool
+--------------
+"""
+import weakref
+
+import torch
+
+
+class OptimizerPool(object):
+    r"""keeps the local optimizer made for each model and resets it in place for
+    the next client that trains the same model, instead of making a new one. The
+    reset optimizer has no state (e.g., momentum buffers), no gradients and the
+    hyper-parameters of a new optimizer made by the given definition, so training
+    with it is the same as training with a new one.
+
+    .. note::
+        Models are held by weak references, the optimizer of a model is dropped
+        once the model is. An optimizer is made again if its class or the
+        parameters of the model change.
+
+    """
+
+    def __init__(self) -> None:
+        self._optimizers = weakref.WeakKeyDictionary()
+        # hyper-parameters of the last definition seen
+        self._last_def = None
+        self._last_group = None
+
+    def _get_group(self, optimizer_def):
+        # hyper-parameters of a single param group made by the definition, from an
+        # optimizer of a placeholder parameter
+        if optimizer_def is not self._last_def:
+            reference = optimizer_def([torch.zeros(1, requires_grad=True)])
+            group = dict(reference.param_groups[0])
+            group.pop("params")
+            self._last_def = optimizer_def
+            self._last_group = (type(reference), group, reference.defaults)
+        return self._last_group
+
+    def get(self, model, optimizer_def):
+        r"""gives an optimizer of the parameters of the model as if it is made by
+        ``optimizer_def(model.parameters())``.
+
+        Args:
+            model (Module): model to optimize.
+            optimizer_def (Callable): definition of the optimizer.
+
+        Returns:
+            Optimizer: the optimizer.
+        """
+        params = list(model.parameters())
+        optimizer_type, group, defaults = self._get_group(optimizer_def)
+        optimizer = self._optimizers.get(model)
+        if (
+            optimizer is None
+            or type(optimizer) is not optimizer_type
+            or len(optimizer.param_groups) != 1
+            or len(optimizer.param_groups[0]["params"]) != len(params)
+            or any(
+                param is not pooled
+                for param, pooled in zip(params, optimizer.param_groups[0]["params"])
+            )
+        ):
+            optimizer = optimizer_def(params)
+            self._optimizers[model] = optimizer
+            return optimizer
+        optimizer.state.clear()
+        optimizer.defaults = defaults
+        param_group = optimizer.param_groups[0]
+        param_group.clear()
+        param_group.update(group, params=params)
+        optimizer.zero_grad(set_to_none=True)
+        return optimizer
@@ -0,0 +1,65 @@
+r"""
+Precision
+---------
+
+Mixed precision of the forward passes of local training and inference.
+"""
+import contextlib
+import contextvars
+
+import torch
+
+PRECISIONS = {"fp32": None, "bf16": torch.bfloat16}
+
+_autocast_dtype = contextvars.ContextVar("autocast_dtype", default=None)
+
+
+@contextlib.contextmanager
+def local_precision(precision):
+    """sets the precision of the forward passes of ``default_step_closure``,
+    ``local_inference`` and ``stacked_local_train`` calls made inside the context.
+    With ``'bf16'`` the forward passes and the losses run under ``torch.autocast``
+    with bfloat16, while the parameters, their gradients and the optimizers stay in
+    float32.
+
+    Args:
+        precision (str): one of ``'fp32'`` and ``'bf16'``.
+    """
+    if precision not in PRECISIONS:
+        raise Exception(f"invalid precision ({precision})")
+    token = _autocast_dtype.set(PRECISIONS[precision])
+    try:
+        yield
+    finally:
+        _autocast_dtype.reset(token)
+
+
+def autocast_forward(device):
+    """autocast context of a forward pass under the precision set by
+    ``local_precision``, a null context for float32.
+
+    Args:
+        device (str): device of the forward pass ("cpu", "cuda", or device ordinal
+            number).
+
+    Returns:
+        ContextManager: the context.
+    """
+    dtype = _autocast_dtype.get()
+    if dtype is None:
+        return contextlib.nullcontext()
+    return torch.autocast(torch.device(device).type, dtype=dtype)
+
+
+def to_full_precision(outputs):
+    """casts the outputs of an autocast forward pass back to float32 for the scores.
+
+    Args:
+        outputs (Tensor): the outputs.
+
+    Returns:
+        Tensor: the outputs in float32 if they are in a reduced precision.
+    """
+    if _autocast_dtype.get() is not None and outputs.dtype == _autocast_dtype.get():
+        return outputs.float()
+    return outputs
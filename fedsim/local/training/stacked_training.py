@@ -0,0 +1,224 @@
+"""
+Stacked Local Training
+----------------------
+
+Trains the same architecture for several clients at once. The parameters of the
+clients are stacked along a new leading dimension and the forward pass is vectorized
+over that dimension with ``torch.func.vmap`` so each step is a handful of large
+kernels instead of one small kernel per client.
+"""
+import inspect
+
+import torch
+from torch.func import functional_call
+from torch.func import vmap
+
+from fedsim.utils import forked_iter
+
+from .precision import autocast_forward
+from .precision import to_full_precision
+
+# optimizers whose update of every entry only depends on the same entry of the
+# parameters, gradients and states. Stepping them on stacked parameters is the same
+# as stepping each client on its own.
+ELEMENTWISE_OPTIMIZERS = (
+    torch.optim.SGD,
+    torch.optim.Adam,
+    torch.optim.AdamW,
+    torch.optim.Adamax,
+    torch.optim.Adagrad,
+    torch.optim.RMSprop,
+    torch.optim.NAdam,
+    torch.optim.RAdam,
+)
+
+
+def stack_module_parameters(modules, device="cpu"):
+    r"""stacks the parameters of modules with the same architecture.
+
+    Args:
+        modules (Iterable[Module]): modules to stack the parameters of.
+        device (str, optional): device to put the stacked parameters on. Defaults to
+            "cpu".
+
+    Returns:
+        Dict[str, Tensor]: mapping of parameter name to the stacked parameter whose
+            first dimension indexes the modules.
+    """
+    named_params = [dict(module.named_parameters()) for module in modules]
+    return {
+        name: torch.stack([params[name].detach() for params in named_params]).to(
+            device
+        )
+        for name in named_params[0]
+    }
+
+
+def _batches(data_loader, epochs):
+    for _ in range(epochs):
+        for batch in data_loader:
+            yield batch
+
+
+def _pad_to(tensor, size):
+    if tensor.shape[0] == size:
+        return tensor
+    pad = tensor.new_zeros((size - tensor.shape[0], *tensor.shape[1:]))
+    return torch.cat([tensor, pad])
+
+
+def stacked_local_train(
+    model,
+    params,
+    train_data_loaders,
+    epochs,
+    criteria,
+    optimizer_def,
+    lr_scheduler_def=None,
+    device="cpu",
+    scores=None,
+    max_grad_norm=1000,
+    seeds=None,
+):
+    """local training of several clients in lockstep. At each step one mini-batch is
+    taken from each client that still has data, the mini-batches are stacked and the
+    forward pass of all clients is done in one vectorized call. Clients that are done
+    are fed with zeros and their parameters are frozen at the step they finished.
+
+    .. note::
+        ``model`` is only used as a template (its parameters are not touched) and must
+        not have buffers (e.g., batch norm running stats). Only optimizers under
+        ``ELEMENTWISE_OPTIMIZERS`` and lr schedulers that do not take metrics are
+        supported.
+
+    Args:
+        model (Module): template model that defines the architecture.
+        params (Dict[str, Tensor]): stacked parameters of the clients, see
+            ``stack_module_parameters``.
+        train_data_loaders (List[Iterable]): trianing data loader of each client.
+        epochs (int): number of local epochs.
+        criteria (List[Callable]): loss criterion of each client.
+        optimizer_def (Callable): definition of the local optimizer.
+        lr_scheduler_def (Callable, optional): definition of the local lr scheduler.
+            Defaults to None.
+        device (str, optional): device to load the data into
+            ("cpu", "cuda", or device ordinal number). This must be the same device as
+            the one the stacked parameters are loaded into. Defaults to "cpu".
+        scores (List[Dict[str, Score]], optional): a dictionary of str:Score for each
+            client. Defaults to None.
+        max_grad_norm (int, optional): to clip the norm of the gradients of each
+            client. Defaults to 1000.
+        seeds (List[int], optional): seed of each client. If given, the batches of
+            each client (e.g., their sampling and augmentations) are drawn from the
+            default random generators in a stream of its own seeded by its seed, as
+            if the client was trained alone under ``fork_rng(seed)``. Defaults to
+            None which draws them from the default random generators in turns.
+
+    Returns:
+        Tuple[Dict[str, Tensor], List[int], List[int], List[bool]]: tuple of stacked
+            trained parameters, and lists of number of training samples, number of
+            optimization steps and divergence of each client.
+    """
+    if len(list(model.buffers())) > 0:
+        raise Exception("models with buffers can not be trained stacked")
+    num_clients = len(train_data_loaders)
+    names = list(params.keys())
+    params = {
+        name: param.detach().clone().requires_grad_(True)
+        for name, param in params.items()
+    }
+    optimizer = optimizer_def(list(params.values()))
+    if not isinstance(optimizer, ELEMENTWISE_OPTIMIZERS):
+        raise Exception(
+            f"{type(optimizer).__name__} can not be used for stacked training"
+        )
+    lr_scheduler = None
+    if lr_scheduler_def is not None:
+        lr_scheduler = lr_scheduler_def(optimizer=optimizer)
+        if "metrics" in inspect.signature(lr_scheduler.step).parameters:
+            raise Exception("metric based lr schedulers are not supported")
+
+    def forward(client_params, x):
+        return functional_call(model, client_params, (x,))
+
+    batched_forward = vmap(forward)
+
+    final_params = {name: torch.empty_like(param) for name, param in params.items()}
+    iterators = [_batches(loader, epochs) for loader in train_data_loaders]
+    if seeds is not None:
+        iterators = [forked_iter(it, seed) for it, seed in zip(iterators, seeds)]
+    active = [True] * num_clients
+    diverged = [False] * num_clients
+    num_steps = [0] * num_clients
+    num_train_samples = [0] * num_clients
+
+    def finish(i):
+        active[i] = False
+        for name in names:
+            final_params[name][i] = params[name][i].detach()
+
+    model.train()
+    while any(active):
+        batches = dict()
+        for i in range(num_clients):
+            if not active[i]:
+                continue
+            try:
+                x, y = next(iterators[i])
+            except StopIteration:
+                finish(i)
+                continue
+            batches[i] = (x.to(device), y.reshape(-1).long().to(device))
+        if len(batches) == 0:
+            break
+        batch_size = max(x.shape[0] for x, _ in batches.values())
+        x_template = next(iter(batches.values()))[0]
+        x_stacked = torch.stack(
+            [
+                _pad_to(batches[i][0], batch_size)
+                if i in batches
+                else x_template.new_zeros((batch_size, *x_template.shape[1:]))
+                for i in range(num_clients)
+            ]
+        )
+        with autocast_forward(device):
+            outputs = batched_forward(params, x_stacked)
+            losses = {
+                i: criteria[i](outputs[i, : y.shape[0]], y)
+                for i, (_, y) in batches.items()
+            }
+        loss_values = torch.stack(list(losses.values()))
+        finite = torch.isfinite(loss_values)
+        if not finite.all():
+            for i, is_finite in zip(list(losses.keys()), finite.tolist()):
+                if not is_finite:
+                    diverged[i] = True
+                    finish(i)
+                    del losses[i]
+                    del batches[i]
+            if len(losses) == 0:
+                continue
+        # clients do not share parameters, so the gradient of the sum is the stack of
+        # the gradients of each client
+        sum(losses.values()).backward()
+        # clip the gradients of each client separately
+        grads = [params[name].grad for name in names]
+        norms = torch.stack(
+            [grad.reshape(num_clients, -1).pow(2).sum(1) for grad in grads]
+        ).sum(0)
+        clip_coef = (max_grad_norm / (norms.sqrt() + 1e-6)).clamp(max=1.0)
+        for grad in grads:
+            grad.mul_(clip_coef.reshape(-1, *([1] * (grad.dim() - 1))))
+        optimizer.step()
+        optimizer.zero_grad()
+        if lr_scheduler is not None:
+            lr_scheduler.step()
+
+        for i, (_, y) in batches.items():
+            num_steps[i] += 1
+            num_train_samples[i] += y.shape[0]
+            if scores is not None:
+                for score in scores[i].values():
+                    score(to_full_precision(outputs[i, : y.shape[0]].detach()), y)
+
+    return final_params, num_train_samples, num_steps, diverged
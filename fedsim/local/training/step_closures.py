@@ -3,8 +3,14 @@ Step Closures
 -------------
 """
 
+import torch
 from torch.nn.utils import clip_grad_norm_
 
+from fedsim.utils import FlatModule
+
+from .precision import autocast_forward
+from .precision import to_full_precision
+
 
 def default_step_closure(
     x,
@@ -52,13 +58,16 @@ def default_step_closure(
     """
     if transform_y is not None:
         y = transform_y(y)
-    x = x.to(device)
+    x = x.to(device, non_blocking=True)
     y = y.reshape(-1).long()
-    y = y.to(device)
+    y = y.to(device, non_blocking=True)
     model.train()
-    outputs = model(x)
-    loss = criterion(outputs, y)
-    if loss.isnan() or loss.isinf():
+    with autocast_forward(device):
+        outputs = model(x)
+        loss = criterion(outputs, y)
+    # a non-finite loss is skipped right away where checking it does not wait for a
+    # device, elsewhere it is left to the caller (e.g., local_train)
+    if loss.device.type == "cpu" and not torch.isfinite(loss):
         return loss
     # backpropagation
     loss.backward()
@@ -68,9 +77,14 @@ def default_step_closure(
     clip_grad_norm_(parameters=model.parameters(), max_norm=max_grad_norm)
     # optimize
     optimizer.step()
-    optimizer.zero_grad()
+    if isinstance(model, FlatModule):
+        # keeps the gradients as views of the buffer of the flat module
+        model.zero_grad()
+    else:
+        optimizer.zero_grad()
 
     if scores is not None:
+        outputs = to_full_precision(outputs)
         for score in scores.values():
             score(outputs, y)
     return loss
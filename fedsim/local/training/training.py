@@ -4,10 +4,55 @@ Local Training
 
 Training for local client
 """
+import contextlib
+import contextvars
+import copy
 import inspect
+import itertools
+
+import torch
 
 from .step_closures import default_step_closure
 
+_max_steps = contextvars.ContextVar("max_steps", default=None)
+_anchor = contextvars.ContextVar("anchor", default=None)
+
+
+@contextlib.contextmanager
+def limit_steps(max_steps):
+    """limits the number of optimization steps taken by ``local_train`` calls made
+    inside the context (e.g., to simulate a client that is stopped at a deadline).
+
+    Args:
+        max_steps (int): maximum number of steps. None means no limit.
+    """
+    token = _max_steps.set(max_steps)
+    try:
+        yield
+    finally:
+        _max_steps.reset(token)
+
+
+@contextlib.contextmanager
+def anchored(anchor):
+    """attaches a gradient anchor to the optimizers of ``local_train`` calls made
+    inside the context for the duration of the calls (e.g., the proximal term of a
+    client).
+
+    Args:
+        anchor (GradientAnchor): the anchor. None means no anchor.
+    """
+    token = _anchor.set(anchor)
+    try:
+        yield
+    finally:
+        _anchor.reset(token)
+
+
+def _all_finite(pending):
+    # a single host sync for the losses of all the pending steps
+    return bool(torch.isfinite(torch.stack([loss for loss, _ in pending])).all())
+
 
 def local_train(
     model,
@@ -21,6 +66,7 @@ def local_train(
     step_closure=default_step_closure,
     scores=None,
     max_grad_norm=1000,
+    check_freq=10,
     **step_ctx,
 ):
     """local training
@@ -42,12 +88,26 @@ def local_train(
             Defaults to None.
         max_grad_norm (int, optional): to clip the norm of the gradients.
             Defaults to 1000.
+        check_freq (int, optional): number of steps between two checks of the losses
+            for divergence. The losses are kept on the device in between, so the
+            loop does not wait for the device on every step. Defaults to 10.
+
+    .. note::
+        Up to ``check_freq - 1`` steps may be taken after the loss diverges (at
+        most until the end of the epoch). On divergence the parameters and the
+        floating point buffers of the model and the states of the optimizer and
+        the lr scheduler are rolled back to where they were when the call started
+        (they are copied once per call) and no steps or samples are counted. A
+        metric based lr scheduler is stepped once per check, with the score at the
+        check.
 
     Returns:
         Tuple[int, int, bool]: tuple of number of training samples,
             number of optimization steps, divergence.
     """
 
+    max_steps = _max_steps.get()
+    anchor = _anchor.get()
     if steps > 0:
         # this is because we break out of the epoch loop, so we need an
         # additional iteration to go over extra steps
@@ -57,53 +117,96 @@ def local_train(
 
     diverged = False
 
-    all_loss = 0
     num_train_samples = 0
+    # steps taken since the last check, as (loss, number of samples)
+    pending = []
+    num_taken = 0
 
-    if train_data_loader is not None:
-        # iteration over epochs
-        for _ in range(epochs):
-            if diverged:
-                break
-            # iteration over mini-batches
-            epoch_step_cnt = 0
-            for x, y in train_data_loader:
-                # send the mini-batch to device
-                # calculate the local objective's loss
-                loss = step_closure(
-                    x,
-                    y,
-                    model,
-                    criterion,
-                    optimizer,
-                    scores,
-                    max_grad_norm,
-                    device=device,
-                    **step_ctx,
+    trigger_score = None
+    if lr_scheduler is not None:
+        # the scheduler is inspected once instead of on every step
+        if "metrics" in inspect.signature(lr_scheduler.step).parameters:
+            comb_scores = {
+                **scores,
+                **{criterion.get_name(): criterion},
+            }
+            trigger_metric = lr_scheduler.trigger_metric
+            if trigger_metric not in comb_scores:
+                raise Exception(
+                    f"{trigger_metric} not in local scores. "
+                    f"Possible options are {comb_scores.keys()}"
                 )
-                if loss.isnan() or loss.isinf():
-                    del loss
-                    diverged = True
-                    break
+            trigger_score = comb_scores[trigger_metric]
 
-                # update control variables
-                epoch_step_cnt += 1
-                num_steps += 1
-                num_train_samples += y.shape[0]
-                all_loss += loss.item()
-                if lr_scheduler is not None:
-                    step_args = inspect.signature(lr_scheduler.step).parameters
-                    if "metrics" in step_args:
-                        comb_scores = {**scores, **{criterion.get_name(): criterion}}
-                        trigger_metric = lr_scheduler.trigger_metric
-                        if trigger_metric not in comb_scores:
-                            raise Exception(
-                                f"{trigger_metric} not in local scores. "
-                                f"Possible options are {comb_scores.keys()}"
-                            )
-                        lr_scheduler.step(comb_scores[trigger_metric].get_score())
-                    else:
+    handle = None if anchor is None else anchor.attach(optimizer)
+    try:
+        if train_data_loader is not None:
+            # the state to roll back to on divergence
+            state = [
+                tensor
+                for tensor in itertools.chain(model.parameters(), model.buffers())
+                if tensor.is_floating_point()
+            ]
+            snapshot = [tensor.detach().clone() for tensor in state]
+            optimizer_snapshot = copy.deepcopy(optimizer.state_dict())
+            scheduler_snapshot = None
+            if lr_scheduler is not None:
+                scheduler_snapshot = copy.deepcopy(lr_scheduler.state_dict())
+            # iteration over epochs
+            for _ in range(epochs):
+                if diverged or (max_steps is not None and num_taken >= max_steps):
+                    break
+                # iteration over mini-batches
+                for x, y in train_data_loader:
+                    if max_steps is not None and num_taken >= max_steps:
+                        break
+                    # send the mini-batch to device
+                    # calculate the local objective's loss
+                    loss = step_closure(
+                        x,
+                        y,
+                        model,
+                        criterion,
+                        optimizer,
+                        scores,
+                        max_grad_norm,
+                        device=device,
+                        **step_ctx,
+                    )
+                    # update control variables
+                    pending.append((loss.detach(), y.shape[0]))
+                    num_taken += 1
+                    if len(pending) >= check_freq:
+                        diverged = not _all_finite(pending)
+                        if diverged:
+                            break
+                        num_steps += len(pending)
+                        num_train_samples += sum(n for _, n in pending)
+                        pending = []
+                        if trigger_score is not None:
+                            lr_scheduler.step(trigger_score.get_score())
+                    if lr_scheduler is not None and trigger_score is None:
                         lr_scheduler.step()
+                # check the rest of the epoch
+                if not diverged and len(pending) > 0:
+                    diverged = not _all_finite(pending)
+                    if not diverged:
+                        num_steps += len(pending)
+                        num_train_samples += sum(n for _, n in pending)
+                        pending = []
+                        if trigger_score is not None:
+                            lr_scheduler.step(trigger_score.get_score())
+            if diverged:
+                with torch.no_grad():
+                    torch._foreach_copy_(state, snapshot)
+                optimizer.load_state_dict(optimizer_snapshot)
+                if scheduler_snapshot is not None:
+                    lr_scheduler.load_state_dict(scheduler_snapshot)
+                num_steps = 0
+                num_train_samples = 0
+    finally:
+        if handle is not None:
+            handle.remove()
 
     return (
         num_train_samples,
@@ -157,17 +157,17 @@ class Accuracy(Score):
             )
         cur_sum = (input.argmax(dim=1) == target).sum()
         if self.reduction == "micro":
-            self._sum += cur_sum.item()
+            self._sum += cur_sum.detach()
             self._weight += input.shape[0]
         elif self.reduction == "macro":
-            self._sum += cur_sum.item() / input.shape[0]
+            self._sum += cur_sum.detach() / input.shape[0]
             self._weight += 1
         return cur_sum / input.shape[0]
 
     def get_score(self) -> float:
         if self._weight < 1:
             return 0
-        return self._sum / self._weight
+        return float(self._sum) / self._weight
 
     def reset(self) -> None:
         self._sum = 0
@@ -247,17 +247,17 @@ class CrossEntropyScore(Score):
         cur_sum = self._base_class(input, target)
 
         if self.reduction == "micro":
-            self._sum += cur_sum.item()
+            self._sum += cur_sum.detach()
             self._weight += input.shape[0]
         elif self.reduction == "macro":
-            self._sum += cur_sum.item() / input.shape[0]
+            self._sum += cur_sum.detach() / input.shape[0]
             self._weight += 1
         return cur_sum / input.shape[0]
 
     def get_score(self) -> float:
         if self._weight < 1:
             return 0
-        return self._sum / self._weight
+        return float(self._sum) / self._weight
 
     def reset(self) -> None:
         self._sum = 0
@@ -326,17 +326,17 @@ class KLDivScore(Score):
         cur_sum = self._base_class(input, target)
 
         if self.reduction == "micro":
-            self._sum += cur_sum.item()
+            self._sum += cur_sum.detach()
             self._weight += input.shape[0]
         elif self.reduction == "macro":
-            self._sum += cur_sum.item() / input.shape[0]
+            self._sum += cur_sum.detach() / input.shape[0]
             self._weight += 1
         return cur_sum / input.shape[0]
 
     def get_score(self) -> float:
         if self._weight < 1:
             return 0
-        return self._sum / self._weight
+        return float(self._sum) / self._weight
 
     def reset(self) -> None:
         self._sum = 0
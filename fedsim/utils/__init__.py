@@ -8,13 +8,22 @@ Small handy functions and classes used in FedSim package
 
 from .aggregators import AppendixAggregator
 from .aggregators import SerialAggregator
+from .convert_parameters import add_vector_to_module_grads
+from .convert_parameters import copy_vector_to_module
 from .convert_parameters import initialize_module
 from .convert_parameters import vector_to_named_parameters_like
 from .convert_parameters import vector_to_parameters_like
 from .convert_parameters import vectorize_module
 from .convert_parameters import vectorize_module_grads
 from .dict_ops import apply_on_dict
+from .flat_module import FlatModule
 from .import_utils import get_from_module
+from .lazy_storage import LazyStorageDict
+from .random_utils import derive_seed
+from .random_utils import fork_rng
+from .random_utils import forked_iter
+from .random_utils import get_rng_state
+from .random_utils import set_rng_state
 from .random_utils import set_seed
 from .storage import Storage
 
@@ -22,12 +31,21 @@ __all__ = [
     "vectorize_module",
     "vectorize_module_grads",
     "initialize_module",
+    "copy_vector_to_module",
+    "add_vector_to_module_grads",
+    "FlatModule",
     "vector_to_parameters_like",
     "vector_to_named_parameters_like",
     "apply_on_dict",
     "get_from_module",
     "set_seed",
+    "get_rng_state",
+    "set_rng_state",
+    "derive_seed",
+    "fork_rng",
+    "forked_iter",
     "SerialAggregator",
     "AppendixAggregator",
     "Storage",
+    "LazyStorageDict",
 ]
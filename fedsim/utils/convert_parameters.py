@@ -11,6 +11,8 @@ from torch.nn.utils import parameters_to_vector
 from torch.nn.utils import vector_to_parameters
 from torch.nn.utils.convert_parameters import _check_param_device
 
+from .flat_module import FlatModule
+
 
 def vector_to_parameters_like(vec, parameters_like):
     r"""Convert one vector to new parameters like the ones provided
@@ -84,9 +86,13 @@ def vectorize_module(module: Module, clone=True, detach=True):
         detach (bool, optional): detaches the output. Defaults to True.
 
     Returns:
-        Module: 1-D Tensor of all parameters in the module
+        Module: 1-D Tensor of all parameters in the module. For a ``FlatModule``
+            without clone, the buffer of its parameters.
     """
-    vec = parameters_to_vector(module.parameters())
+    if isinstance(module, FlatModule):
+        vec = module.flat_params
+    else:
+        vec = parameters_to_vector(module.parameters())
     if clone:
         vec = vec.clone()
     if detach:
@@ -104,8 +110,16 @@ def vectorize_module_grads(module: Module, clone=True, detach=True):
 
     Returns:
         Module: 1-D Tensor of gradients of all parameters in the module. None if at
-            least grad of one children deos not exist.
+            least grad of one children deos not exist. For a ``FlatModule`` without
+            clone, the buffer of its gradients.
     """
+    if isinstance(module, FlatModule):
+        vec = module.get_flat_grads()
+        if vec is None:
+            return None
+        if clone:
+            vec = vec.clone()
+        return vec
 
     param_device = None
 
@@ -137,12 +151,64 @@ def initialize_module(module: Module, vec: Tensor, clone=True, detach=True):
         detach (bool, optional): detaches the output before the initialization.
             Defaults to True.
     """
+    if sum(param.numel() for param in module.parameters()) != len(vec):
+        return False
+    if isinstance(module, FlatModule):
+        # the parameters stay views of the buffer
+        with torch.no_grad():
+            module.flat_params.copy_(vec)
+        return True
     if clone:
         vec = vec.clone()
     if detach:
         vec = vec.detach()
-    if len(vectorize_module(module)) != len(vec):
-        return False
 
     vector_to_parameters(vec, module.parameters())
     return True
+
+
+def copy_vector_to_module(module: Module, vec: Tensor):
+    r"""copies a 1-D vector into a module's parameters in place. Unlike
+    ``initialize_module``, the parameters keep their own memory, so nothing is
+    allocated and the vector is not referenced by the module afterwards.
+
+    Args:
+        module (Module): module to copy the weights into
+        vec (Tensor): a 1-D Tensor
+
+    Returns:
+        bool: False if the length of the vector does not match the parameters.
+    """
+    params = list(module.parameters())
+    if sum(param.numel() for param in params) != len(vec):
+        return False
+    with torch.no_grad():
+        if isinstance(module, FlatModule):
+            module.flat_params.copy_(vec)
+            return True
+        pointer = 0
+        for param in params:
+            num_param = param.numel()
+            param.copy_(vec[pointer : pointer + num_param].view_as(param))
+            pointer += num_param
+    return True
+
+
+def add_vector_to_module_grads(module: Module, vec: Tensor):
+    r"""adds a 1-D vector to the gradients of a module's parameters in place, e.g.,
+    to correct the gradients of a local objective. For a ``FlatModule`` this is a
+    single add to the buffer of its gradients.
+
+    Args:
+        module (Module): module of the gradients
+        vec (Tensor): a 1-D Tensor
+    """
+    if isinstance(module, FlatModule):
+        grads = module.get_flat_grads()
+        if grads is not None:
+            grads.add_(vec)
+            return
+    for param, grad_additive in zip(
+        module.parameters(), vector_to_parameters_like(vec, module.parameters())
+    ):
+        param.grad += grad_additive
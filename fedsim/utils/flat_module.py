@@ -0,0 +1,129 @@
+r"""
+Flat Module
+-----------
+"""
+import copy
+
+import torch
+from torch.nn import Module
+from torch.nn import Parameter
+
+
+class FlatModule(Module):
+    r"""wraps a module so that its parameters and their gradients are views into
+    two contiguous 1-D buffers. Then ``vectorize_module`` (without clone),
+    ``vectorize_module_grads`` (without clone) and ``add_vector_to_module_grads``
+    work on the buffers directly and ``initialize_module`` and
+    ``copy_vector_to_module`` are a single copy into them.
+
+    .. note::
+        The parameters must share a dtype and a device. Moving the module (e.g.,
+        by ``to``) allocates the buffers again. Gradients that are set to None
+        (e.g., by ``optimizer.zero_grad()``) and made again by the backward pass
+        are copied back into the buffer the next time it is read, so prefer
+        ``model.zero_grad()`` which zeros the buffer in place.
+
+    Args:
+        module (Module or Callable): the module to wrap or a definition that makes
+            it, e.g., ``partial(FlatModule, model_def)`` is a definition of the
+            flat model.
+    """
+
+    def __init__(self, module, *args, **kwargs) -> None:
+        super().__init__()
+        if not isinstance(module, Module):
+            module = module(*args, **kwargs)
+        self.module = module
+        self._flatten()
+
+    def _flatten(self) -> None:
+        params = list(self.module.parameters())
+        if len({(param.dtype, param.device) for param in params}) > 1:
+            raise Exception("parameters of a flat module must share dtype and device")
+        if len(params) > 0:
+            flat_params = torch.cat([param.detach().reshape(-1) for param in params])
+        else:
+            flat_params = torch.zeros(0)
+        flat_grads = torch.zeros_like(flat_params)
+        grad_views = []
+        pointer = 0
+        for param in params:
+            num_param = param.numel()
+            param.data = flat_params[pointer : pointer + num_param].view_as(param)
+            grad_view = flat_grads[pointer : pointer + num_param].view_as(param)
+            if param.grad is not None:
+                grad_view.copy_(param.grad)
+            if param.requires_grad:
+                param.grad = grad_view
+            grad_views.append(grad_view)
+            pointer += num_param
+        self.flat_params = flat_params
+        self.flat_grads = flat_grads
+        self._params = params
+        self._grad_views = grad_views
+
+    def _attach_grads(self, zero=False) -> bool:
+        # optimizers may set the gradients to None after which the backward pass
+        # makes new ones, so they are copied back and replaced by the views
+        complete = True
+        for param, grad_view in zip(self._params, self._grad_views):
+            if not param.requires_grad or param.grad is grad_view:
+                continue
+            if param.grad is None:
+                grad_view.zero_()
+                if zero:
+                    param.grad = grad_view
+                else:
+                    complete = False
+            else:
+                if not zero:
+                    grad_view.copy_(param.grad)
+                param.grad = grad_view
+        return complete
+
+    def get_flat_grads(self):
+        r"""gives the buffer of the gradients, which the gradients of the parameters
+        are views of. The gradients of parameters that have none read as zeros.
+
+        Returns:
+            Tensor: the 1-D buffer, or None if a parameter that requires grad has no
+                gradient.
+        """
+        if not self._attach_grads():
+            return None
+        return self.flat_grads
+
+    def zero_grad(self, set_to_none: bool = True) -> None:
+        r"""zeros the buffer of the gradients in place. The gradients stay views of
+        the buffer, so ``set_to_none`` is ignored.
+
+        Args:
+            set_to_none (bool, optional): ignored. Defaults to True.
+        """
+        self._attach_grads(zero=True)
+        self.flat_grads.zero_()
+
+    def forward(self, *args, **kwargs):
+        return self.module(*args, **kwargs)
+
+    def _apply(self, fn, *args, **kwargs):
+        super()._apply(fn, *args, **kwargs)
+        self._flatten()
+        return self
+
+    def __getstate__(self):
+        # views are pickled with the whole buffer, so the parameters are pickled as
+        # separate tensors and flattened again on load
+        state = super().__getstate__()
+        memo = {
+            id(param): Parameter(param.detach().clone(), param.requires_grad)
+            for param in self._params
+        }
+        state["_modules"] = copy.deepcopy(state["_modules"], memo)
+        for key in ("flat_params", "flat_grads", "_params", "_grad_views"):
+            state.pop(key)
+        return state
+
+    def __setstate__(self, state) -> None:
+        super().__setstate__(state)
+        self._flatten()
@@ -0,0 +1,205 @@
+r"""
+Lazy Storage Dict
+-----------------
+"""
+import collections
+import os
+import shutil
+import tempfile
+import weakref
+from collections.abc import MutableMapping
+
+import torch
+
+from .storage import Storage
+
+
+class _TrackedStorage(Storage):
+    # storage that lets its owner know when it is written to
+
+    def __init__(self, owner, key) -> None:
+        super().__init__()
+        self._owner = owner
+        self._key = key
+
+    def write(
+        self, key, obj, read_protected=False, write_protected=False, silent=False
+    ):
+        super().write(key, obj, read_protected, write_protected, silent)
+        self._owner._on_write(self._key)
+
+    def remove(self, key, silent=False):
+        super().remove(key, silent)
+        self._owner._on_write(self._key)
+
+    def __reduce__(self):
+        # a copy made for another process is a plain storage. Memory-mapped tensors
+        # can not be shared with other processes, so they are copied to memory.
+        spilled = self._owner._spilled.get(self._key, dict())
+        storage = Storage()
+        for key, (obj, read_p, write_p) in self._storage.items():
+            if key in spilled and obj is spilled[key][0]:
+                obj = obj.detach().clone().requires_grad_(obj.requires_grad)
+            storage._storage[key] = (obj, read_p, write_p)
+        return storage.__reduce__()
+
+
+class LazyStorageDict(MutableMapping):
+    r"""dictionary of storages (e.g., one per client) that makes the storage of a key
+    on its first access. The cpu tensors written to the storages are kept in memory
+    up to the given budget. Beyond it, the tensors of the least recently used
+    storages are spilled to memory-mapped files, so they are paged in from the disk
+    when read. Reads and writes of the storages work as before; writing a tensor to a
+    spilled storage brings that entry back to memory.
+
+    .. note::
+        Only the tensors directly written to the storages are spilled (not the ones
+        nested in other objects). The storage written to most recently is always
+        kept in memory, so the budget could be exceeded by the size of one storage.
+
+    .. warning::
+        Spilling copies a tensor to the file, so a spilled entry is no longer an
+        alias of any other tensor it used to share memory with.
+
+    Args:
+        max_bytes (int, optional): budget of the cpu tensors kept in memory by all
+            the storages in bytes. Defaults to None which keeps everything in memory.
+        spill_dir (str, optional): directory to put the spilled tensors in. Defaults
+            to None which makes a temporary directory that is removed with the
+            dictionary.
+    """
+
+    def __init__(self, max_bytes=None, spill_dir=None) -> None:
+        if max_bytes is not None and max_bytes < 0:
+            raise Exception(f"invalid memory budget ({max_bytes})")
+        self.max_bytes = max_bytes
+        self._storages = dict()
+        # bytes kept in memory by each storage, in the order of their last access
+        self._lru = collections.OrderedDict()
+        self._resident_bytes = 0
+        # memory-mapped tensor and its file of each spilled entry
+        self._spilled = collections.defaultdict(dict)
+        self._spill_dir = spill_dir
+        self._num_files = 0
+
+    def _get_spill_dir(self):
+        if self._spill_dir is None:
+            self._spill_dir = tempfile.mkdtemp(prefix="fedsim-storage-")
+            weakref.finalize(self, shutil.rmtree, self._spill_dir, True)
+        else:
+            os.makedirs(self._spill_dir, exist_ok=True)
+        return self._spill_dir
+
+    def _measure(self, key):
+        # bytes of the cpu tensors of a storage that are held in memory
+        storage = self._storages[key]
+        spilled = self._spilled.get(key, dict())
+        num_bytes = 0
+        for entry_key, (obj, _, _) in storage._storage.items():
+            if (
+                torch.is_tensor(obj)
+                and obj.device.type == "cpu"
+                and obj is not spilled.get(entry_key, (None,))[0]
+            ):
+                num_bytes += obj.nelement() * obj.element_size()
+        return num_bytes
+
+    def _release(self, key, keep_current=True):
+        # removes the files of the spilled entries that are over-written
+        if key not in self._spilled:
+            return
+        storage = self._storages.get(key)
+        spilled = self._spilled[key]
+        for entry_key in list(spilled):
+            tensor, file_name = spilled[entry_key]
+            current = None
+            if keep_current and storage is not None:
+                current = storage._storage.get(entry_key, (None,))[0]
+            if current is not tensor:
+                # already mapped pages stay valid for whoever still holds the tensor
+                os.remove(file_name)
+                del spilled[entry_key]
+        if len(spilled) == 0:
+            del self._spilled[key]
+
+    def _spill(self, key) -> None:
+        storage = self._storages[key]
+        spill_dir = self._get_spill_dir()
+        spilled = self._spilled[key]
+        for entry_key, (obj, read_p, write_p) in list(storage._storage.items()):
+            if (
+                not torch.is_tensor(obj)
+                or obj.device.type != "cpu"
+                or obj.nelement() == 0
+                or obj is spilled.get(entry_key, (None,))[0]
+            ):
+                continue
+            file_name = os.path.join(spill_dir, f"{self._num_files}.bin")
+            self._num_files += 1
+            tensor = torch.from_file(
+                file_name, shared=True, size=obj.nelement(), dtype=obj.dtype
+            )
+            tensor.copy_(obj.detach().reshape(-1))
+            tensor = tensor.view(obj.shape)
+            if obj.requires_grad:
+                tensor.requires_grad_(True)
+            if entry_key in spilled:
+                os.remove(spilled[entry_key][1])
+            spilled[entry_key] = (tensor, file_name)
+            # bypass the tracking, the entry is only moved
+            storage._storage[entry_key] = (tensor, read_p, write_p)
+        self._resident_bytes -= self._lru.pop(key)
+
+    def _on_write(self, key) -> None:
+        self._release(key)
+        if self.max_bytes is None:
+            return
+        num_bytes = self._measure(key)
+        self._resident_bytes += num_bytes - self._lru.pop(key, 0)
+        if num_bytes > 0:
+            self._lru[key] = num_bytes
+        for lru_key in list(self._lru):
+            if self._resident_bytes <= self.max_bytes:
+                break
+            if lru_key != key:
+                self._spill(lru_key)
+
+    def get_resident_bytes(self) -> int:
+        r"""bytes of the cpu tensors of the storages held in memory. Only tracked if
+        a memory budget is given.
+
+        Returns:
+            int: number of bytes.
+        """
+        return self._resident_bytes
+
+    def __getitem__(self, key):
+        storage = self._storages.get(key)
+        if storage is None:
+            storage = _TrackedStorage(self, key)
+            self._storages[key] = storage
+        elif key in self._lru:
+            self._lru.move_to_end(key)
+        return storage
+
+    def __setitem__(self, key, storage) -> None:
+        if key in self._storages:
+            del self[key]
+        tracked = _TrackedStorage(self, key)
+        tracked._storage = storage._storage
+        self._storages[key] = tracked
+        self._on_write(key)
+
+    def __delitem__(self, key) -> None:
+        del self._storages[key]
+        self._release(key, keep_current=False)
+        self._resident_bytes -= self._lru.pop(key, 0)
+
+    def __contains__(self, key) -> bool:
+        return key in self._storages
+
+    def __iter__(self):
+        return iter(self._storages)
+
+    def __len__(self) -> int:
+        return len(self._storages)
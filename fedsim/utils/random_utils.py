@@ -2,6 +2,7 @@ r"""
 Random Utils
 ------------
 """
+import contextlib
 import random
 
 import numpy as np
@@ -23,3 +24,102 @@ def set_seed(seed, use_cuda) -> None:
     if use_cuda:
         torch.backends.cudnn.deterministic = True
         torch.cuda.manual_seed_all(seed)
+
+
+def get_rng_state():
+    """gets the state of the default random generators of ``random``, ``numpy`` and
+    ``torch`` (and cuda if it is initialized).
+
+    Returns:
+        Dict[str, Any]: state of the generators.
+    """
+    state = dict(
+        random=random.getstate(),
+        numpy=np.random.get_state(),
+        torch=torch.get_rng_state(),
+    )
+    if torch.cuda.is_available() and torch.cuda.is_initialized():
+        state["cuda"] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def set_rng_state(state) -> None:
+    """sets the state of the default random generators, inverse of
+    ``get_rng_state``.
+
+    Args:
+        state (Dict[str, Any]): state of the generators.
+    """
+    random.setstate(state["random"])
+    np.random.set_state(state["numpy"])
+    torch.set_rng_state(state["torch"])
+    if "cuda" in state:
+        torch.cuda.set_rng_state_all(state["cuda"])
+
+
+def derive_seed(seed, *keys) -> int:
+    """derives a seed from a base seed and a tuple of non-negative integer keys (e.g.,
+    round number and client id). The keys are hashed with the seed by
+    ``numpy.random.SeedSequence``, so the derived seed does not depend on how many
+    other seeds are derived before it.
+
+    Args:
+        seed (int): base seed.
+        *keys (int): keys of the stream.
+
+    Returns:
+        int: derived seed, in [0, 2**63).
+    """
+    # the number of keys is included so that trailing zero keys are not ignored
+    entropy = [seed, len(keys), *keys]
+    state = np.random.SeedSequence(entropy).generate_state(1, np.uint64)
+    return int(state[0]) % 2**63
+
+
+@contextlib.contextmanager
+def fork_rng(seed=None):
+    """context in which the default random generators of ``random``, ``numpy`` and
+    ``torch`` could be used without affecting their state outside.
+
+    Args:
+        seed (int, optional): seed of the generators inside the context. Defaults to
+            None which starts from their current state.
+    """
+    state = get_rng_state()
+    if seed is not None:
+        random.seed(seed)
+        np.random.seed(seed % 2**32)
+        torch.manual_seed(seed)
+    try:
+        yield
+    finally:
+        set_rng_state(state)
+
+
+def forked_iter(iterable, seed):
+    """iterates over an iterable with the default random generators of ``random``,
+    ``numpy`` and ``torch`` in a stream of their own seeded by ``seed``. The state of
+    the stream is kept between the items, so several iterables (e.g., the data loaders
+    of several clients) can be advanced in turns while each draws as if it was
+    iterated alone under ``fork_rng(seed)``. The state outside is left untouched.
+
+    Args:
+        iterable (Iterable): the iterable, e.g., a data loader that samples and
+            transforms with the default random generators.
+        seed (int): seed of the stream.
+
+    Yields:
+        Any: the items of the iterable.
+    """
+    with fork_rng(seed):
+        iterator = iter(iterable)
+        state = get_rng_state()
+    while True:
+        with fork_rng():
+            set_rng_state(state)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            state = get_rng_state()
+        yield item
@@ -2,6 +2,21 @@ r"""
 Storage
 -------
 """
+import torch
+
+
+class _ObjectState(object):
+    # placeholder for an object that is saved by its own state_dict
+    def __init__(self, state) -> None:
+        self.state = state
+
+
+def _has_state(obj):
+    return (
+        not isinstance(obj, type)
+        and callable(getattr(obj, "state_dict", None))
+        and callable(getattr(obj, "load_state_dict", None))
+    )
 
 
 class Storage(object):
@@ -128,3 +143,54 @@ class Storage(object):
         if not silent and w_p:
             print(f"write protected entry {key} is removed from the storage.")
         del self._storage[key]
+
+    def state_dict(self, keys=None):
+        """gets the state of the entries, e.g., to save them with ``torch.save``.
+        Objects that have their own ``state_dict`` (modules, optimizers, lr
+        schedulers, etc.) are represented by their state and the rest are kept as
+        they are.
+
+        Args:
+            keys (Iterable[Hashable], optional): keys of the entries to include.
+                Defaults to None which includes all the entries.
+
+        Returns:
+            Dict[Hashable, Tuple[Any, bool, bool]]: state of each entry followed by
+            its read and write protection status.
+        """
+        if keys is None:
+            keys = self._storage.keys()
+        state = dict()
+        for key in keys:
+            obj, r_p, w_p = self._storage[key]
+            if _has_state(obj):
+                obj = _ObjectState(obj.state_dict())
+            state[key] = (obj, r_p, w_p)
+        return state
+
+    def load_state_dict(self, state_dict):
+        """loads the state of entries, inverse of ``state_dict``. The state of objects
+        that have their own ``state_dict`` is loaded into the existing entries. The
+        same goes for tensors of matching shape so the references to them (e.g., by
+        an optimizer) stay valid. Other entries are over-written.
+
+        Args:
+            state_dict (Dict[Hashable, Tuple[Any, bool, bool]]): state of the entries.
+        """
+        for key, (state, r_p, w_p) in state_dict.items():
+            obj = self._storage.get(key, (None,))[0]
+            if isinstance(state, _ObjectState):
+                if obj is None:
+                    raise Exception(f"entry {key} should exist to load its state.")
+                obj.load_state_dict(state.state)
+                state = obj
+            elif (
+                torch.is_tensor(state)
+                and torch.is_tensor(obj)
+                and obj.shape == state.shape
+                and obj.dtype == state.dtype
+            ):
+                with torch.no_grad():
+                    obj.copy_(state)
+                state = obj
+            self._storage[key] = (state, r_p, w_p)
@@ -12,9 +12,14 @@ from typing import Optional
 
 import click
 import torch
+import torch.distributed as dist
 from logall import TensorboardLogger
 
 from fedsim import __version__ as fedsim_version
+from fedsim.distributed.centralized import EarlyStopping
+from fedsim.distributed.centralized.simulation import SystemSimulator
+from fedsim.distributed.centralized.simulation import estimate_run
+from fedsim.utils import FlatModule
 from fedsim.utils import set_seed
 
 from .utils import OptionEatAll
@@ -23,6 +28,14 @@ from .utils import ingest_scores
 from .utils import validate_score
 
 
+def _format_bytes(num_bytes):
+    for unit in ["B", "KB", "MB", "GB"]:
+        if num_bytes < 1024:
+            return f"{num_bytes:.1f}{unit}"
+        num_bytes /= 1024
+    return f"{num_bytes:.1f}TB"
+
+
 @click.command(
     name="fed-learn",
     help="Simulates a Federated Learning system.",
@@ -64,7 +77,8 @@ from .utils import validate_score
     type=str,
     default="uniform",
     show_default=True,
-    help="client sampling scheme (uniform or sequential for now).",
+    help="client sampling scheme (uniform, sequential, stratified or\
+        power_of_choice).",
 )
 @click.option(
     "--client-sample-rate",
@@ -74,6 +88,14 @@ from .utils import validate_score
     show_default=True,
     help="mean portion of num clients to sample.",
 )
+@click.option(
+    "--num-candidates",
+    type=int,
+    default=None,
+    show_default=True,
+    help="number of candidates of the power_of_choice sample scheme. Defaults to\
+        twice the number of sampled clients.",
+)
 @click.option(
     "--algorithm",
     "-a",
@@ -92,6 +114,28 @@ from .utils import validate_score
     show_default=True,
     help="model architecture.",
 )
+@click.option(
+    "--flat-params",
+    is_flag=True,
+    default=False,
+    help="keeps the parameters and the gradients of the model in contiguous buffers,\
+        so whole-model vector operations of the algorithms do not copy them.",
+)
+@click.option(
+    "--compile",
+    is_flag=True,
+    default=False,
+    help="compiles the model by torch.compile once per process and reuses it for\
+        all clients and rounds.",
+)
+@click.option(
+    "--precision",
+    type=click.Choice(["fp32", "bf16"]),
+    default="fp32",
+    show_default=True,
+    help="precision of the forward passes of the clients and the server evaluation\
+        (bf16 runs them under torch.autocast, the parameters stay in fp32).",
+)
 @click.option(
     "--epochs",
     "-e",
@@ -167,7 +211,18 @@ from .utils import validate_score
     "-s",
     type=int,
     default=None,
-    help="seed for random generators after data is partitioned.",
+    help="seed for random generators after data is partitioned. The clients are\
+        sampled and run with random streams derived from the seed, the round and the\
+        client id, so results do not depend on the execution order.",
+)
+@click.option(
+    "--seeds",
+    type=tuple,
+    cls=OptionEatAll,
+    default=None,
+    help="seeds of replicas of the simulation that are run together in the same\
+        process, each one as if it was run with --seed. The reports of each replica\
+        are prefixed by seed_{seed}. Can not be used with --seed.",
 )
 @click.option(
     "--device",
@@ -176,6 +231,232 @@ from .utils import validate_score
     show_default=True,
     help="device to load model and data one",
 )
+@click.option(
+    "--workers",
+    type=int,
+    default=0,
+    show_default=True,
+    help="number of worker processes to run the clients on (0 runs them serially).",
+)
+@click.option(
+    "--shared-memory",
+    is_flag=True,
+    default=False,
+    help="sends the models and the client updates between the server and the\
+        workers through shared memory instead of pickling them.",
+)
+@click.option(
+    "--client-scheduling",
+    type=click.Choice(["fifo", "lpt"]),
+    default="fifo",
+    show_default=True,
+    help="order the clients of a round are dispatched to the workers in. lpt\
+        dispatches the ones with the largest predicted cost first and lets idle\
+        workers steal queued clients.",
+)
+@click.option(
+    "--client-affinity",
+    is_flag=True,
+    default=False,
+    help="keeps the storages and the datasets of the clients on the workers that\
+        ran them and sends the clients back to the same workers.",
+)
+@click.option(
+    "--stack-clients",
+    is_flag=True,
+    default=False,
+    help="trains the sampled clients of each round together by vectorizing over\
+        their stacked parameters (FedAvg and FedNova).",
+)
+@click.option(
+    "--num-edges",
+    type=int,
+    default=0,
+    show_default=True,
+    help="number of simulated edge aggregators the clients are grouped under (0\
+        aggregates all clients on the server).",
+)
+@click.option(
+    "--edge-rounds",
+    type=int,
+    default=1,
+    show_default=True,
+    help="number of rounds the edges run with their clients in each round of the\
+        server.",
+)
+@click.option(
+    "--async-buffer-size",
+    type=int,
+    default=0,
+    show_default=True,
+    help="trains asynchronously and optimizes the server each time this many client\
+        updates are buffered (0 trains in synchronous rounds).",
+)
+@click.option(
+    "--staleness-exponent",
+    type=float,
+    default=0.5,
+    show_default=True,
+    help="exponent a of the staleness weight (1 + staleness)^-a in asynchronous\
+        training.",
+)
+@click.option(
+    "--overlap-report",
+    is_flag=True,
+    default=False,
+    help="evaluates the server model of each round in the background while the next\
+        round trains.",
+)
+@click.option(
+    "--simulate-system",
+    is_flag=True,
+    default=False,
+    help="simulates the computation and communication time of heterogeneous clients\
+        and logs the scores against the virtual time as well. Implied by\
+        --round-deadline.",
+)
+@click.option(
+    "--client-speed",
+    type=float,
+    default=10.0,
+    show_default=True,
+    help="median speed of the simulated clients in optimization steps per second.",
+)
+@click.option(
+    "--client-bandwidth",
+    type=float,
+    default=1e6,
+    show_default=True,
+    help="median bandwidth of the simulated clients in bytes per second.",
+)
+@click.option(
+    "--system-heterogeneity",
+    type=float,
+    default=1.0,
+    show_default=True,
+    help="standard deviation of the log-normal spread of the speed and bandwidth of\
+        the simulated clients.",
+)
+@click.option(
+    "--client-availability",
+    type=float,
+    default=1.0,
+    show_default=True,
+    help="probability of a sampled simulated client to be online.",
+)
+@click.option(
+    "--round-deadline",
+    type=float,
+    default=None,
+    show_default=True,
+    help="deadline of the rounds in simulated seconds.",
+)
+@click.option(
+    "--deadline-policy",
+    type=click.Choice(["drop", "truncate"]),
+    default="drop",
+    show_default=True,
+    help="drops the clients that would miss the deadline or truncates their local\
+        training.",
+)
+@click.option(
+    "--distributed",
+    is_flag=True,
+    default=False,
+    help="runs on the torch.distributed process group of a launcher such as\
+        torchrun (gloo backend). Rank 0 keeps the server and the other ranks run\
+        slices of the clients.",
+)
+@click.option(
+    "--stop-metric",
+    type=str,
+    default=None,
+    show_default=True,
+    help="reported metric to stop early on, e.g., server.avg.test.accuracy.",
+)
+@click.option(
+    "--stop-target",
+    type=float,
+    default=None,
+    show_default=True,
+    help="stops once the stop metric reaches this value.",
+)
+@click.option(
+    "--stop-mode",
+    type=click.Choice(["max", "min"]),
+    default="max",
+    show_default=True,
+    help="whether higher or lower values of the stop metric are better.",
+)
+@click.option(
+    "--patience",
+    type=int,
+    default=None,
+    show_default=True,
+    help="stops once this many reports of the stop metric in a row do not improve\
+        on the best one.",
+)
+@click.option(
+    "--min-delta",
+    type=float,
+    default=0.0,
+    show_default=True,
+    help="minimum change of the stop metric that counts as an improvement.",
+)
+@click.option(
+    "--time-budget",
+    type=float,
+    default=None,
+    show_default=True,
+    help="stops once this many seconds of wall-clock time are spent on training.",
+)
+@click.option(
+    "--checkpoint-freq",
+    type=int,
+    default=0,
+    show_default=True,
+    help="saves a checkpoint of the simulation every this many rounds (0 does not\
+        save checkpoints).",
+)
+@click.option(
+    "--checkpoint-dir",
+    type=click.Path(resolve_path=True),
+    default=None,
+    show_default=True,
+    help="directory to save the checkpoints in. Defaults to the checkpoint directory\
+        resumed from or else to checkpoint under the log directory.",
+)
+@click.option(
+    "--resume",
+    type=click.Path(exists=True, file_okay=False, resolve_path=True),
+    default=None,
+    show_default=True,
+    help="checkpoint directory to resume the simulation from. The rest of the options\
+        should be the same as the run the checkpoint is saved from.",
+)
+@click.option(
+    "--dry-run",
+    is_flag=True,
+    default=False,
+    help="estimates the time and the memory of the run from a few timed steps and\
+        exits without training.",
+)
+@click.option(
+    "--client-memory-budget",
+    type=float,
+    default=None,
+    show_default=True,
+    help="bytes of client states kept in memory, the least recently used ones beyond\
+        it are spilled to memory-mapped files on disk.",
+)
+@click.option(
+    "--client-spill-dir",
+    type=click.Path(resolve_path=True),
+    default=None,
+    show_default=True,
+    help="directory to spill the client states in. Defaults to a temporary\
+        directory.",
+)
 @click.option(
     "--log-dir",
     type=click.Path(resolve_path=True),
@@ -218,8 +499,12 @@ def fed_learn(
     n_clients: int,
     client_sample_scheme: str,
     client_sample_rate: float,
+    num_candidates: Optional[int],
     algorithm: str,
     model: str,
+    flat_params: bool,
+    compile: bool,
+    precision: str,
     epochs: int,
     criterion: str,
     batch_size: int,
@@ -230,7 +515,38 @@ def fed_learn(
     local_lr_scheduler,
     r2r_local_lr_scheduler,
     seed: Optional[float],
+    seeds: Optional[Iterable],
     device: Optional[str],
+    workers: int,
+    shared_memory: bool,
+    client_scheduling: str,
+    client_affinity: bool,
+    stack_clients: bool,
+    num_edges: int,
+    edge_rounds: int,
+    async_buffer_size: int,
+    staleness_exponent: float,
+    overlap_report: bool,
+    simulate_system: bool,
+    client_speed: float,
+    client_bandwidth: float,
+    system_heterogeneity: float,
+    client_availability: float,
+    round_deadline: Optional[float],
+    deadline_policy: str,
+    distributed: bool,
+    stop_metric: Optional[str],
+    stop_target: Optional[float],
+    stop_mode: str,
+    patience: Optional[int],
+    min_delta: float,
+    time_budget: Optional[float],
+    checkpoint_freq: int,
+    checkpoint_dir: Optional[str],
+    resume: Optional[str],
+    dry_run: bool,
+    client_memory_budget: Optional[float],
+    client_spill_dir: Optional[str],
     log_dir: str,
     n_point_summary: int,
     local_score: Iterable,
@@ -365,17 +681,59 @@ def fed_learn(
 
     data_manager_instant = cfg["data_manager"].definition()
 
+    model_def = cfg["model"].definition
+    if flat_params:
+        model_def = partial(FlatModule, model_def)
+
+    if seeds is not None:
+        if seed is not None:
+            raise click.UsageError("only one of --seed and --seeds can be given")
+        seeds = [int(replica_seed) for replica_seed in seeds]
+    if distributed and not dist.is_initialized():
+        dist.init_process_group("gloo")
     # set the seed of random generators
     if seed is not None:
         set_seed(seed, device)
 
+    system_simulator = None
+    if simulate_system or round_deadline is not None:
+        system_simulator = SystemSimulator.from_lognormal(
+            n_clients,
+            speed=client_speed,
+            bandwidth=client_bandwidth,
+            sigma=system_heterogeneity,
+            availability=client_availability,
+            seed=seed if seeds is None else seeds[0],
+            deadline=round_deadline,
+            policy=deadline_policy,
+        )
+
+    early_stopping = None
+    if stop_target is not None or patience is not None or time_budget is not None:
+        if stop_metric is None and time_budget is None:
+            raise click.UsageError("--stop-metric is needed to stop early on a metric")
+        early_stopping = EarlyStopping(
+            metric=stop_metric,
+            target=stop_target,
+            mode=stop_mode,
+            patience=patience,
+            min_delta=min_delta,
+            time_budget=time_budget,
+        )
+
+    if checkpoint_dir is None:
+        if resume is not None:
+            checkpoint_dir = resume
+        else:
+            checkpoint_dir = os.path.join(log_dir, "checkpoint")
+
     algorithm_instance = cfg["algorithm"].definition(
         data_manager=data_manager_instant,
         metric_logger=tb_logger,
         num_clients=n_clients,
         sample_scheme=client_sample_scheme,
         sample_rate=client_sample_rate,
-        model_def=cfg["model"].definition,
+        model_def=model_def,
         epochs=epochs,
         criterion_def=criterion_def,
         optimizer_def=cfg["optimizer"].definition,
@@ -386,6 +744,30 @@ def fed_learn(
         batch_size=batch_size,
         test_batch_size=test_batch_size,
         device=device,
+        workers=workers,
+        stack_clients=stack_clients,
+        async_buffer_size=async_buffer_size,
+        staleness_exponent=staleness_exponent,
+        overlap_report=overlap_report,
+        system_simulator=system_simulator,
+        checkpoint_dir=checkpoint_dir,
+        checkpoint_freq=checkpoint_freq,
+        client_memory_budget=None
+        if client_memory_budget is None
+        else int(client_memory_budget),
+        client_spill_dir=client_spill_dir,
+        seed=seed,
+        seeds=seeds,
+        distributed=distributed,
+        shared_memory=shared_memory,
+        num_edges=num_edges,
+        edge_rounds=edge_rounds,
+        early_stopping=early_stopping,
+        client_scheduling=client_scheduling,
+        client_affinity=client_affinity,
+        num_candidates=num_candidates,
+        compile=compile,
+        precision=precision,
     )
 
     local_score_defs = ingest_scores(local_score)
@@ -416,7 +798,49 @@ def fed_learn(
             score_name=score_name,
         )
 
-    report_summary = algorithm_instance.train(rounds, n_point_summary, train_split_name)
+    if resume is not None:
+        algorithm_instance.load_checkpoint(resume)
+        logger.info(
+            f"resumed from {resume} at round {algorithm_instance.get_round_number()}"
+        )
+
+    if dry_run:
+        estimate = estimate_run(
+            algorithm_instance, rounds - algorithm_instance.get_round_number()
+        )
+        logger.info(
+            f"model: {estimate['model.parameters']} parameters, "
+            f"{estimate['model.flops_per_sample'] / 1e6:.1f} MFLOPs per sample"
+        )
+        logger.info(
+            f"time: {estimate['time.round']:.2f}s per round, "
+            f"{estimate['time.total'] / 3600:.2f}h for {estimate['rounds']} rounds "
+            f"({estimate['time.step'] * 1e3:.1f}ms per step, "
+            f"{estimate['time.client']:.2f}s per client, "
+            f"{estimate['time.eval']:.2f}s of evaluation per round)"
+        )
+        logger.info(
+            f"memory: {_format_bytes(estimate['memory.peak'])} at peak "
+            f"(server {_format_bytes(estimate['memory.server'])}, "
+            f"client storages {_format_bytes(estimate['memory.client_storages'])}, "
+            f"datasets {_format_bytes(estimate['memory.datasets'])}, "
+            f"eval batch {_format_bytes(estimate['memory.eval_batch'])}, "
+            f"training {_format_bytes(estimate['memory.train'])} per worker), "
+            f"{_format_bytes(estimate['memory.process_peak'])} used so far"
+        )
+        logger.info(estimate)
+        return
+
+    report_summary = algorithm_instance.train(
+        rounds - algorithm_instance.get_round_number(),
+        n_point_summary,
+        train_split_name,
+    )
+    if report_summary is not None and "stop.reason" in report_summary:
+        logger.info(
+            f"stopped early at round {report_summary['stop.round']}: "
+            f"{report_summary['stop.reason']}"
+        )
     logger.info(f"average of the last {n_point_summary} reports")
     logger.info(report_summary)
     tb_logger.flush()
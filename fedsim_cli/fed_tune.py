@@ -113,7 +113,8 @@ from .utils import validate_score
     type=str,
     default="uniform",
     show_default=True,
-    help="client sampling scheme (uniform or sequential for now).",
+    help="client sampling scheme (uniform, sequential, stratified or\
+        power_of_choice).",
 )
 @click.option(
     "--client-sample-rate",
@@ -1,18 +1,44 @@
 import math
+import random
 from functools import partial
 
+import pytest
+import torch
 from logall import TensorboardLogger
 
 from fedsim.distributed.centralized import AdaBest
+from fedsim.distributed.centralized import EarlyStopping
 from fedsim.distributed.centralized import FedAvg
 from fedsim.distributed.centralized import FedDF
 from fedsim.distributed.centralized import FedDyn
 from fedsim.distributed.centralized import FedNova
 from fedsim.distributed.centralized import FedProx
+from fedsim.distributed.centralized import LockstepComparison
+from fedsim.distributed.centralized import StratifiedSampler
+from fedsim.distributed.centralized.execution import lpt_schedule
+from fedsim.distributed.centralized.execution.distributed import spawn_local
+from fedsim.distributed.centralized.sampling import select_highest_losses
+from fedsim.distributed.centralized.simulation import SystemSimulator
+from fedsim.distributed.centralized.simulation import estimate_run
+from fedsim.distributed.centralized.training.fedavg import _make_train_loader
 from fedsim.distributed.data_management import BasicDataManager
+from fedsim.local.training import GradientAnchor
+from fedsim.local.training import OptimizerPool
+from fedsim.local.training import compile_module
+from fedsim.local.training import default_step_closure
+from fedsim.local.training import local_precision
+from fedsim.local.training import local_train
 from fedsim.models.simple_models import SimpleCNN2
 from fedsim.scores import Accuracy
 from fedsim.scores import CrossEntropyScore
+from fedsim.utils import FlatModule
+from fedsim.utils import LazyStorageDict
+from fedsim.utils import add_vector_to_module_grads
+from fedsim.utils import copy_vector_to_module
+from fedsim.utils import fork_rng
+from fedsim.utils import get_rng_state
+from fedsim.utils import vectorize_module
+from fedsim.utils import vectorize_module_grads
 
 
 def alg_hook(alg, dm):
@@ -38,59 +64,548 @@ def acc_check(alg):
             assert 0 <= value < 2 * math.log(100)
 
 
-def test_algs():
-    n_clients = 5000
-    dm = BasicDataManager("./data", "cifar100", n_clients, global_valid_portion=0.4)
-    sw = TensorboardLogger(path=None)
-    # device = "cuda" if torch.cuda.is_available() else "cpu"
-    device = "cpu"
-    common_cfg = dict(
+def _make_data_manager():
+    return BasicDataManager("./data", "cifar100", 5000, global_valid_portion=0.4)
+
+
+def _make_alg(dm, alg_def=FedAvg, **kwargs):
+    cfg = dict(
         data_manager=dm,
-        num_clients=2,
+        num_clients=4,
         sample_scheme="uniform",
         sample_rate=1.0,
         model_def=partial(SimpleCNN2, num_classes=100),
         epochs=1,
         criterion_def=partial(CrossEntropyScore, log_freq=100),
         batch_size=32,
-        metric_logger=sw,
-        device=device,
+        metric_logger=TensorboardLogger(path=None),
+        device="cpu",
     )
-    # test fedavg
-    alg = FedAvg(**common_cfg)
+    cfg.update(kwargs)
+    alg = alg_def(**cfg)
     alg_hook(alg, dm)
-    acc_check(alg)
-    del alg
+    return alg
 
-    # test fedprox
-    alg = FedProx(**common_cfg)
-    alg_hook(alg, dm)
-    acc_check(alg)
-    del alg
 
-    # test fednova
-    alg = FedNova(**common_cfg)
-    alg_hook(alg, dm)
-    acc_check(alg)
-    del alg
+@pytest.fixture(scope="module")
+def data_manager():
+    return _make_data_manager()
 
-    # test feddyn
-    alg = FedDyn(**common_cfg)
-    alg_hook(alg, dm)
-    acc_check(alg)
-    del alg
 
-    # test AdaBest
-    alg = AdaBest(**common_cfg)
-    alg_hook(alg, dm)
-    acc_check(alg)
-    del alg
+@pytest.fixture
+def make_alg(data_manager):
+    # makes an algorithm on the shared data manager, kwargs override the defaults
+    return partial(_make_alg, data_manager)
 
-    # test AdaBest
-    alg = FedDF(**common_cfg)
-    alg_hook(alg, dm)
-    acc_check(alg)
-    del alg
+
+def _cloud_params(alg):
+    return alg.get_server_storage().read("cloud_params")
+
+
+def test_algs(make_alg):
+    for alg_def in [FedAvg, FedProx, FedNova, FedDyn, AdaBest, FedDF]:
+        acc_check(make_alg(alg_def, num_clients=2))
+
+
+def test_workers(make_alg):
+    cloud_params = []
+    for workers in [0, 1, 2]:
+        torch.manual_seed(0)
+        random.seed(0)
+        alg = make_alg(workers=workers)
+        alg.train(rounds=1)
+        cloud_params.append(_cloud_params(alg))
+    # the aggregate does not depend on the number of workers, serial included
+    assert torch.equal(cloud_params[0], cloud_params[1])
+    assert torch.equal(cloud_params[0], cloud_params[2])
+
+
+def test_shared_memory(make_alg):
+    cloud_params = []
+    for shared_memory in [False, True]:
+        torch.manual_seed(0)
+        alg = make_alg(workers=2, seed=0, shared_memory=shared_memory)
+        alg.train(rounds=1)
+        cloud_params.append(_cloud_params(alg))
+    # the messages are the same whether they are pickled or shared
+    assert torch.equal(cloud_params[0], cloud_params[1])
+
+
+def test_client_scheduling(make_alg):
+    # largest first, each to the least loaded worker
+    order, makespan = lpt_schedule([1.0, 3.0, 2.0, 2.0], 2)
+    assert order == [1, 2, 3, 0]
+    assert makespan == 4.0
+
+    cloud_params = []
+    for client_scheduling in ["fifo", "lpt"]:
+        torch.manual_seed(0)
+        alg = make_alg(
+            num_clients=6, workers=2, seed=0, client_scheduling=client_scheduling
+        )
+        report = alg.train(rounds=1)
+        cloud_params.append(_cloud_params(alg))
+    # the messages are aggregated in the same order whatever the dispatch order
+    assert torch.equal(cloud_params[0], cloud_params[1])
+    assert "schedule.makespan" in report
+    # predicted once the clients of the first round are measured
+    assert "schedule.predicted_makespan" in report
+
+
+def test_client_affinity(make_alg):
+    cloud_params = []
+    for client_affinity in [False, True]:
+        torch.manual_seed(0)
+        alg = make_alg(FedDyn, workers=2, seed=0, client_affinity=client_affinity)
+        report = alg.train(rounds=2)
+        cloud_params.append(_cloud_params(alg))
+    # the storages kept on the workers are the ones the server would send
+    assert torch.equal(cloud_params[0], cloud_params[1])
+    assert report["affinity.hit_rate"] > 0
+
+
+def test_edge_aggregation(make_alg):
+    cloud_params = []
+    for num_edges in [0, 3]:
+        torch.manual_seed(0)
+        alg = make_alg(num_clients=8, seed=0, num_edges=num_edges)
+        alg.train(rounds=1)
+        cloud_params.append(_cloud_params(alg))
+    # the edges only change the order of the additions
+    assert torch.allclose(cloud_params[0], cloud_params[1], atol=1e-6)
+
+    alg = make_alg(num_clients=8, seed=0, num_edges=3, edge_rounds=2)
+    report = alg.train(rounds=1)
+    assert "edge.backhaul_bytes" in report
+
+
+def test_edge_aggregation_state(make_alg):
+    cloud_params = []
+    average_samples = []
+    for num_edges in [0, 3]:
+        torch.manual_seed(0)
+        alg = make_alg(AdaBest, num_clients=8, seed=0, num_edges=num_edges)
+        alg.train(rounds=2)
+        cloud_params.append(_cloud_params(alg))
+        average_samples.append(
+            alg.get_server_storage().read("running_stats").get("avg_m")
+        )
+    # the running stats AdaBest keeps on the server are summed over the edges
+    assert average_samples[0] > 0
+    assert math.isclose(average_samples[0], average_samples[1])
+    assert torch.allclose(cloud_params[0], cloud_params[1], atol=1e-6)
+
+    # the clients of edge rounds see the state of the server
+    alg = make_alg(AdaBest, num_clients=8, seed=0, num_edges=3, edge_rounds=2)
+    alg.train(rounds=2)
+    assert alg.get_server_storage().read("running_stats").get("avg_m") > 0
+
+
+def test_estimate_run(make_alg):
+    n_clients = 5000
+    alg = make_alg(FedDyn, num_clients=n_clients, sample_rate=0.01)
+    estimate = estimate_run(alg, rounds=100, num_steps=2, num_eval_batches=1)
+    assert estimate["time.total"] == 100 * estimate["time.round"] > 0
+    # FedDyn keeps a vector of the size of the model on each client
+    model_bytes = 4 * estimate["model.parameters"]
+    assert estimate["memory.client_state"] >= model_bytes
+    assert estimate["memory.client_storages"] >= n_clients * model_bytes
+
+
+def test_early_stopping(make_alg):
+    alg = make_alg(
+        early_stopping=EarlyStopping("server.avg.valid.accuracy", target=0.0)
+    )
+    alg.hook_global_score(
+        partial(Accuracy, log_freq=1),
+        split_name="valid",
+        score_name="accuracy",
+    )
+    report = alg.train(rounds=5)
+    # the target is reached by the first report
+    assert report["stop.round"] == 0
+    assert alg.get_round_number() == 1
+
+
+def test_stacked_clients(make_alg):
+    for alg_def in [FedAvg, FedNova]:
+        cloud_params = []
+        for stack_clients in [False, True]:
+            torch.manual_seed(0)
+            alg = make_alg(alg_def, seed=0, stack_clients=stack_clients)
+            acc_check(alg)
+            cloud_params.append(_cloud_params(alg))
+        # stacking the clients only changes the float rounding
+        assert torch.allclose(*cloud_params, atol=1e-5)
+
+
+def test_async(make_alg):
+    for workers in [0, 2]:
+        acc_check(make_alg(sample_rate=0.5, workers=workers, async_buffer_size=1))
+
+
+def test_overlap_report(make_alg):
+    acc_check(make_alg(num_clients=2, overlap_report=True))
+
+
+def test_system_simulator():
+    speed = [1.0, 2.0, 4.0]
+    bandwidth = [10.0, 10.0, 10.0]
+    # client 0 needs 2 + 10 = 12 seconds, client 1 7 and client 2 4.5
+    simulator = SystemSimulator(speed, bandwidth, deadline=8.0, policy="drop")
+    client_ids, max_steps = simulator.schedule([0, 1, 2], [10, 10, 10], 10)
+    assert client_ids.tolist() == [1, 2]
+    stats = simulator.end_round(client_ids, max_steps, [10, 10])
+    # the server waits until the deadline for the dropped client
+    assert stats["system.virtual_time"] == 8.0
+    assert stats["system.dropped"] == 1
+
+    simulator = SystemSimulator(speed, bandwidth, deadline=8.0, policy="truncate")
+    client_ids, max_steps = simulator.schedule([0, 1, 2], [10, 10, 10], 10)
+    assert client_ids.tolist() == [0, 1, 2]
+    assert max_steps.tolist() == [6, 10, 10]
+    stats = simulator.end_round(client_ids, max_steps, [10, 10, 10])
+    assert stats["system.virtual_time"] == 8.0
+    assert stats["system.truncated"] == 1
+
+
+def test_checkpoint(make_alg, tmp_path):
+    def make_checkpointed_alg(checkpoint_dir):
+        return make_alg(
+            FedDyn,
+            sample_rate=0.5,
+            checkpoint_dir=str(checkpoint_dir),
+            checkpoint_freq=1,
+        )
+
+    torch.manual_seed(0)
+    random.seed(0)
+    uninterrupted_alg = make_checkpointed_alg(tmp_path / "uninterrupted")
+    uninterrupted_alg.train(rounds=3)
+    uninterrupted_rng_state = get_rng_state()
+
+    # stopped after the first two rounds and resumed for the other two
+    torch.manual_seed(0)
+    random.seed(0)
+    make_checkpointed_alg(tmp_path / "resumed").train(rounds=1)
+    torch.manual_seed(1)
+    random.seed(1)
+    resumed_alg = make_checkpointed_alg(tmp_path / "resumed")
+    resumed_alg.load_checkpoint(str(tmp_path / "resumed"))
+    assert resumed_alg.get_round_number() == 2
+    resumed_alg.train(rounds=1)
+    resumed_rng_state = get_rng_state()
+
+    assert resumed_alg.get_round_number() == uninterrupted_alg.get_round_number()
+    assert torch.equal(_cloud_params(resumed_alg), _cloud_params(uninterrupted_alg))
+    assert torch.equal(resumed_rng_state["torch"], uninterrupted_rng_state["torch"])
+    assert resumed_rng_state["random"] == uninterrupted_rng_state["random"]
+
+
+def test_lazy_storage_dict():
+    storages = LazyStorageDict(max_bytes=1000)
+    assert len(storages) == 0
+    for i in range(5):
+        storages[i].write("h", torch.full((100,), float(i)))
+    assert len(storages) == 5
+    # each storage holds 400 bytes, the least recently written ones are spilled
+    assert storages.get_resident_bytes() == 800
+    assert torch.equal(storages[0].read("h"), torch.zeros(100))
+    storages[0].write("h", storages[0].read("h") + 1)
+    assert storages.get_resident_bytes() == 800
+    assert torch.equal(storages[0].read("h"), torch.ones(100))
+    assert torch.equal(storages[1].read("h"), torch.ones(100))
+
+
+def test_stratified_sampler():
+    # two kinds of clients, each holding one label
+    histograms = [[10, 0]] * 6 + [[0, 10]] * 2
+    sampler = StratifiedSampler(histograms, 2)
+    assert sorted(len(stratum) for stratum in sampler.strata) == [2, 6]
+    assert sorted(sampler.get_allocation(4)) == [1, 3]
+    clients = sampler.sample(4, random.Random(0))
+    assert len(set(clients)) == 4
+    assert sum(client >= 6 for client in clients) == 1
+
+
+def test_power_of_choice():
+    candidates = [4, 7, 1, 3]
+    losses = [0.5, math.nan, 2.0, 0.5]
+    # unknown losses first, ties in the order of the candidates
+    assert select_highest_losses(candidates, losses, 3) == [7, 1, 4]
+
+
+def test_optimizer_pool():
+    pool = OptimizerPool()
+    model = torch.nn.Linear(4, 2)
+    optimizer_def = partial(torch.optim.SGD, lr=0.1, momentum=0.9)
+    inputs = torch.rand(8, 4)
+    pooled = pool.get(model, optimizer_def)
+    model(inputs).sum().backward()
+    pooled.step()
+    params = []
+    optimizers = [optimizer_def(model.parameters()), pool.get(model, optimizer_def)]
+    for optimizer in optimizers:
+        copy_vector_to_module(model, torch.zeros(10))
+        for _ in range(3):
+            optimizer.zero_grad()
+            model(inputs).pow(2).sum().backward()
+            optimizer.step()
+        params.append(vectorize_module(model))
+    # the reused optimizer starts over without the momentum of its last use
+    assert optimizers[1] is pooled
+    assert torch.equal(params[0], params[1])
+
+
+def test_flat_module():
+    torch.manual_seed(0)
+    model = torch.nn.Sequential(torch.nn.Linear(4, 3), torch.nn.Linear(3, 2))
+    flat_model = FlatModule(model)
+    inputs = torch.rand(8, 4)
+    flat_model(inputs).sum().backward()
+    # vectors of the flat model are its buffers, not copies
+    params = vectorize_module(flat_model, clone=False)
+    grads = vectorize_module_grads(flat_model, clone=False)
+    assert params.data_ptr() == flat_model.flat_params.data_ptr()
+    assert grads.data_ptr() == flat_model.flat_grads.data_ptr()
+    add_vector_to_module_grads(flat_model, torch.ones(23))
+    assert torch.equal(model[1].bias.grad, grads[-2:])
+    # the parameters stay views of the buffer when they are set
+    copy_vector_to_module(flat_model, torch.zeros(23))
+    assert torch.equal(model[0].weight, torch.zeros(3, 4))
+    flat_model.zero_grad()
+    assert model[0].weight.grad is not None
+    assert torch.equal(grads, torch.zeros(23))
+
+
+def test_gradient_anchor():
+    torch.manual_seed(0)
+    model = torch.nn.Linear(4, 2)
+    inputs = torch.rand(8, 4)
+    anchor = torch.rand(10)
+    bias = torch.rand(10)
+    optimizer = torch.optim.SGD(model.parameters(), lr=0.1)
+    handle = GradientAnchor(anchor, 0.5, bias, -2.0).attach(optimizer)
+    params = vectorize_module(model)
+    model(inputs).sum().backward()
+    grads = vectorize_module_grads(model)
+    optimizer.step()
+    expected = params - 0.1 * (grads + 0.5 * (params - anchor) - 2.0 * bias)
+    assert torch.allclose(vectorize_module(model), expected)
+    # once removed, the steps are plain again
+    handle.remove()
+    optimizer.zero_grad()
+    model(inputs).sum().backward()
+    grads = vectorize_module_grads(model)
+    optimizer.step()
+    assert torch.allclose(vectorize_module(model), expected - 0.1 * grads)
+
+
+def test_compile_module():
+    torch.manual_seed(0)
+    model = torch.nn.Linear(4, 2)
+    inputs = torch.rand(8, 4)
+    expected = model(inputs)
+    assert torch.allclose(compile_module(model, backend="eager")(inputs), expected)
+
+    def failing_backend(graph_module, example_inputs):
+        raise RuntimeError("unsupported")
+
+    # the module runs eagerly once compiling fails
+    compile_module(model, backend=failing_backend)
+    with pytest.warns(RuntimeWarning):
+        outputs = model(inputs)
+    assert torch.allclose(outputs, expected)
+    assert torch.allclose(model(inputs), expected)
+
+
+def test_local_precision():
+    torch.manual_seed(0)
+    model = torch.nn.Linear(4, 2)
+    optimizer = torch.optim.SGD(model.parameters(), lr=0.1)
+    inputs = torch.rand(8, 4)
+    labels = torch.randint(0, 2, (8,))
+    criterion = CrossEntropyScore()
+    with local_precision("bf16"):
+        loss = default_step_closure(inputs, labels, model, criterion, optimizer, None)
+    # the loss and the parameters stay in float32 under autocast
+    assert loss.dtype == torch.float32
+    assert model.weight.dtype == torch.float32
+    assert math.isfinite(criterion.get_score())
+
+
+def _unchecked_step_closure(x, y, model, criterion, optimizer, *args, **kwargs):
+    # steps on any loss, as the default step closure does on accelerators
+    loss = criterion(model(x), y)
+    loss.backward()
+    optimizer.step()
+    optimizer.zero_grad()
+    return loss
+
+
+def test_local_train_divergence():
+    inputs = torch.rand(8, 4)
+    labels = torch.randint(0, 2, (8,))
+    batches = [(inputs, labels)] * 20
+    # the loss diverges on the 7th step, which is found at the second check
+    batches[6] = (torch.full_like(inputs, math.nan), labels)
+    for step_closure in [default_step_closure, _unchecked_step_closure]:
+        torch.manual_seed(0)
+        model = torch.nn.Linear(4, 2)
+        init_params = vectorize_module(model, clone=True, detach=True)
+        optimizer = torch.optim.SGD(model.parameters(), lr=0.1, momentum=0.9)
+        num_samples, num_steps, diverged = local_train(
+            model,
+            batches,
+            epochs=1,
+            steps=0,
+            criterion=CrossEntropyScore(),
+            optimizer=optimizer,
+            step_closure=step_closure,
+            check_freq=4,
+        )
+        assert diverged
+        assert num_steps == 0
+        assert num_samples == 0
+        # the model and the optimizer are rolled back to where they started
+        assert torch.equal(vectorize_module(model), init_params)
+        assert len(optimizer.state) == 0
+
+
+def test_client_streams(make_alg):
+    cloud_params = []
+    for workers in [0, 2]:
+        torch.manual_seed(0)
+        alg = make_alg(sample_rate=0.5, workers=workers, seed=0)
+        alg.train(rounds=1)
+        cloud_params.append(_cloud_params(alg))
+    # the clients draw from their own streams wherever they run
+    assert torch.equal(*cloud_params)
+
+
+def test_stacked_client_streams(make_alg):
+    cloud_params = []
+    for stack_clients in [False, True]:
+        torch.manual_seed(0)
+        alg = make_alg(sample_rate=0.5, stack_clients=stack_clients, seed=0)
+        alg.train(rounds=2)
+        cloud_params.append(_cloud_params(alg))
+    # stacked clients draw their batches and augmentations from their own streams
+    assert torch.allclose(*cloud_params, atol=1e-5)
+
+
+def test_seeds(make_alg):
+    alg = make_alg(sample_rate=0.5, seeds=[0, 1])
+    alg.train(rounds=1)
+    # each replica follows the run made with its own seed
+    for seed, replica in zip([0, 1], alg._replicas):
+        torch.manual_seed(seed)
+        single = make_alg(sample_rate=0.5, seed=seed)
+        single.train(rounds=1)
+        assert torch.equal(_cloud_params(replica), _cloud_params(single))
+
+
+def test_stacked_seeds(make_alg):
+    alg = make_alg(sample_rate=0.5, seeds=[0, 1], stack_clients=True)
+    alg.train(rounds=1)
+    # each stacked replica follows the serial run made with its own seed
+    for seed, replica in zip([0, 1], alg._replicas):
+        torch.manual_seed(seed)
+        single = make_alg(sample_rate=0.5, seed=seed)
+        single.train(rounds=1)
+        assert torch.allclose(_cloud_params(replica), _cloud_params(single), atol=1e-5)
+
+
+def _recording(alg_cls, records):
+    # records the client, round and first mini-batch of each run of send_to_server
+    class Recording(alg_cls):
+        def send_to_server(
+            id,
+            rounds,
+            storage,
+            datasets,
+            train_split_name,
+            scores,
+            epochs,
+            criterion,
+            train_batch_size,
+            *args,
+            **kwargs,
+        ):
+            with fork_rng():
+                dataset = datasets[train_split_name]
+                loader = _make_train_loader(dataset, train_batch_size)
+                records.append((rounds, id, next(iter(loader))[0]))
+            return alg_cls.send_to_server(
+                id,
+                rounds,
+                storage,
+                datasets,
+                train_split_name,
+                scores,
+                epochs,
+                criterion,
+                train_batch_size,
+                *args,
+                **kwargs,
+            )
+
+    return Recording
+
+
+def test_lockstep_comparison(make_alg):
+    algorithms = dict()
+    records = dict()
+    for name, alg_cls in [("fedavg", FedAvg), ("fedprox", FedProx)]:
+        records[name] = []
+        algorithms[name] = make_alg(
+            _recording(alg_cls, records[name]), sample_rate=0.5, seed=0
+        )
+    comparison = LockstepComparison(algorithms)
+    reports = comparison.train(rounds=2)
+    assert set(reports) == {"fedavg", "fedprox"}
+    hook_times = comparison.get_hook_times()
+    assert all(hook_times[name]["send_to_server"] > 0 for name in algorithms)
+    # both algorithms train the same clients on the same mini-batches
+    assert len(records["fedavg"]) > 0
+    assert [record[:2] for record in records["fedavg"]] == [
+        record[:2] for record in records["fedprox"]
+    ]
+    for (_, _, fedavg_batch), (_, _, fedprox_batch) in zip(
+        records["fedavg"], records["fedprox"]
+    ):
+        assert torch.equal(fedavg_batch, fedprox_batch)
+
+
+def _make_distributed_alg(dm, **kwargs):
+    torch.manual_seed(0)
+    return _make_alg(
+        dm,
+        num_clients=8,
+        sample_scheme="power_of_choice",
+        sample_rate=0.25,
+        criterion_def=partial(CrossEntropyScore, log_freq=1),
+        seed=0,
+        **kwargs,
+    )
+
+
+def _train_distributed(cloud_params):
+    # runs on each rank of the process group, with a data manager of its own
+    alg = _make_distributed_alg(_make_data_manager(), distributed=True)
+    reports = alg.train(rounds=2)
+    if torch.distributed.get_rank() == 0:
+        assert "clients.train.accuracy" in reports
+        # the losses of the clients of all ranks decide the sampling, as in serial
+        assert torch.allclose(_cloud_params(alg), cloud_params, atol=1e-6)
+    else:
+        assert reports is None
+
+
+def test_distributed(data_manager):
+    alg = _make_distributed_alg(data_manager)
+    alg.train(rounds=2)
+    spawn_local(_train_distributed, 3, args=(_cloud_params(alg),))
 
 
 # if __name__ == "__main__":